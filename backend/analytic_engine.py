@@ -0,0 +1,353 @@
+"""
+Analytic Engine - 正交擠出交集的解析幾何引擎（不經過 OpenSCAD / CGAL）
+
+DUET 的形狀永遠是「字母 1 沿 Y 軸擠出」∩「字母 2 沿 X 軸擠出」：
+點 (x, y, z) 在模型內 ⇔ (x, z) 在字形 1 內 且 (y, z) 在字形 2 內
+
+做法：
+1. 以兩個字形所有頂點（以及同一字形邊與邊的交點）的 z 值切出水平薄層（slab）
+2. 每個 slab 內，兩個字形的掃描線區間端點都是 z 的線性函數（非零環繞數規則）
+3. 每一對區間 [x 區間] × [y 區間] 在 slab 內是一個四面都是平面的柱體，
+   外側四面直接輸出成三角形；slab 之間的水平面 = 下方截面 XOR 上方截面
+4. 共用的水平邊都在同一組格點上切分，沒有 T 形接點，輸出封閉網格
+5. 最後附加 torus 墜頭（獨立的封閉殼）
+
+座標與 SCAD 版本相同：字形 1 (u, v) → (x=u, z=v)，字形 2 (u, v) → (y=u, z=v)，
+並以前進寬度水平置中、墨水範圍垂直置中、等比縮放到 target_h
+"""
+import logging
+import math
+import time
+
+import numpy as np
+
+from scad_generator import BAIL_RADIUS, BAIL_TUBE
+from stl_mesh import write_binary_stl
+
+logger = logging.getLogger(__name__)
+
+# 引擎版本（網格產生方式改變時遞增，讓舊快取失效）
+ANALYTIC_ENGINE_VERSION = 1
+
+# 座標量化（mm）：同一個幾何點由不同邊計算時的浮點誤差在此合併
+COORD_DECIMALS = 6
+
+
+class _GlyphSlabs:
+    """單一字形在 (u, z) 平面的非水平邊，以及每個 slab 的掃描線區間"""
+
+    def __init__(self, outline, target_h):
+        xmin, ymin, xmax, ymax = outline.bbox
+        scale = target_h / (ymax - ymin)
+        offset = np.array([-outline.advance / 2.0, -(ymax + ymin) / 2.0])
+
+        starts = []
+        ends = []
+        for contour in outline.contours:
+            points = np.round((contour.astype(np.float64) + offset) * scale, COORD_DECIMALS)
+            starts.append(points)
+            ends.append(np.roll(points, -1, axis=0))
+        start = np.concatenate(starts)
+        end = np.concatenate(ends)
+
+        self.vertex_z = np.unique(start[:, 1])
+
+        # 水平邊不影響掃描線區間（由上下 slab 的截面差表現）
+        dz = end[:, 1] - start[:, 1]
+        keep = dz != 0
+        up = dz[keep] > 0
+        start, end = start[keep], end[keep]
+        low = np.where(up[:, None], start, end)
+        high = np.where(up[:, None], end, start)
+
+        self.u0, self.z0 = low[:, 0], low[:, 1]
+        self.u1, self.z1 = high[:, 0], high[:, 1]
+        self.winding = np.where(up, 1, -1)
+
+    def crossing_z(self):
+        """同一字形內邊與邊交叉點的 z（重疊輪廓，例如可變字體的外框）"""
+        n = len(self.u0)
+        if n < 2:
+            return np.zeros(0)
+
+        i, j = np.triu_indices(n, k=1)
+        # 先以 z 範圍篩掉不可能相交的組合
+        overlap = (self.z0[i] < self.z1[j]) & (self.z0[j] < self.z1[i])
+        i, j = i[overlap], j[overlap]
+
+        p = np.stack([self.u0[i], self.z0[i]], axis=1)
+        r = np.stack([self.u1[i] - self.u0[i], self.z1[i] - self.z0[i]], axis=1)
+        q = np.stack([self.u0[j], self.z0[j]], axis=1)
+        s = np.stack([self.u1[j] - self.u0[j], self.z1[j] - self.z0[j]], axis=1)
+
+        denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+        qp = q - p
+        valid = np.abs(denom) > 1e-12
+        safe = np.where(valid, denom, 1.0)
+        t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / safe
+        w = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / safe
+
+        eps = 1e-9
+        proper = valid & (t > eps) & (t < 1 - eps) & (w > eps) & (w < 1 - eps)
+        return np.round(p[proper, 1] + t[proper] * r[proper, 1], COORD_DECIMALS)
+
+    def u_at(self, edges, z):
+        """邊在高度 z 的 u（端點直接回傳原值，避免浮點誤差）"""
+        z0, z1 = self.z0[edges], self.z1[edges]
+        u0, u1 = self.u0[edges], self.u1[edges]
+        u = u0 + (u1 - u0) * (z - z0) / (z1 - z0)
+        u = np.where(z == z0, u0, np.where(z == z1, u1, u))
+        return np.round(u, COORD_DECIMALS)
+
+    def intervals(self, z_bottom, z_top):
+        """
+        slab (z_bottom, z_top) 內的掃描線區間
+
+        Returns:
+            tuple: (左邊界的邊索引, 右邊界的邊索引)
+        """
+        active = np.flatnonzero((self.z0 <= z_bottom) & (self.z1 >= z_top))
+        if len(active) == 0:
+            return active, active
+
+        z_mid = (z_bottom + z_top) / 2.0
+        u_mid = self.u0[active] + (self.u1[active] - self.u0[active]) * (
+            z_mid - self.z0[active]
+        ) / (self.z1[active] - self.z0[active])
+        ordered = active[np.argsort(u_mid, kind="stable")]
+
+        # 非零環繞數：重疊的外框視為聯集
+        inside = np.cumsum(self.winding[ordered]) != 0
+        before = np.concatenate([[False], inside[:-1]])
+        return ordered[inside & ~before], ordered[~inside & before]
+
+
+def _chain(low, high, grid):
+    """水平邊上的頂點：兩端點 + 落在中間的格點"""
+    if high <= low:
+        return np.array([low])
+    inner = grid[(grid > low) & (grid < high)]
+    return np.concatenate([[low], inner, [high]])
+
+
+def _zipper(bottom, top):
+    """
+    兩條平行鏈之間的三角帶（依各自長度比例前進，不產生退化三角形）
+
+    Args:
+        bottom, top: (n, 3) / (m, 3) 頂點，沿同一方向排列
+    """
+    def progress(chain):
+        span = np.linalg.norm(chain[-1] - chain[0])
+        if span == 0:
+            return np.zeros(len(chain))
+        return np.linalg.norm(chain - chain[0], axis=1) / span
+
+    tb, tt = progress(bottom), progress(top)
+    i = j = 0
+    triangles = []
+    while i < len(bottom) - 1 or j < len(top) - 1:
+        advance_bottom = j == len(top) - 1 or (i < len(bottom) - 1 and tb[i + 1] <= tt[j + 1])
+        if advance_bottom:
+            triangles.append((bottom[i], top[j], bottom[i + 1]))
+            i += 1
+        else:
+            triangles.append((bottom[i], top[j], top[j + 1]))
+            j += 1
+    return triangles
+
+
+def _orient(triangles, axis, sign):
+    """讓三角形法向量在指定軸上的分量朝向 sign（外側）"""
+    if len(triangles) == 0:
+        return triangles
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    flip = normals[:, axis] * sign < 0
+    triangles[flip] = triangles[flip][:, ::-1]
+    return triangles
+
+
+def build_intersection_mesh(outline1, outline2, target_h):
+    """
+    兩個字形正交擠出的交集網格
+
+    Returns:
+        np.ndarray: (n, 3, 3) float64 三角形（封閉、法向量朝外）
+    """
+    glyph1 = _GlyphSlabs(outline1, target_h)
+    glyph2 = _GlyphSlabs(outline2, target_h)
+
+    z_levels = np.unique(
+        np.concatenate(
+            [glyph1.vertex_z, glyph2.vertex_z, glyph1.crossing_z(), glyph2.crossing_z()]
+        )
+    )
+
+    slabs = [
+        (glyph1.intervals(z_levels[k], z_levels[k + 1]), glyph2.intervals(z_levels[k], z_levels[k + 1]))
+        for k in range(len(z_levels) - 1)
+    ]
+
+    def section(glyph, edges, z):
+        low_edges, high_edges = edges
+        return glyph.u_at(low_edges, z), glyph.u_at(high_edges, z)
+
+    # 每個水平面上的截面（下方 slab 的頂面、上方 slab 的底面）與切分格點
+    below = [None] * len(z_levels)
+    above = [None] * len(z_levels)
+    x_grid = []
+    y_grid = []
+    empty = (np.zeros(0), np.zeros(0))
+    for b, z in enumerate(z_levels):
+        below[b] = (
+            (section(glyph1, slabs[b - 1][0], z), section(glyph2, slabs[b - 1][1], z))
+            if b > 0
+            else (empty, empty)
+        )
+        above[b] = (
+            (section(glyph1, slabs[b][0], z), section(glyph2, slabs[b][1], z))
+            if b < len(slabs)
+            else (empty, empty)
+        )
+        x_grid.append(np.unique(np.concatenate([*below[b][0], *above[b][0]])))
+        y_grid.append(np.unique(np.concatenate([*below[b][1], *above[b][1]])))
+
+    pieces = []
+
+    # 側面：每個 slab 內每一對區間的四個面
+    for k, ((low1, high1), (low2, high2)) in enumerate(slabs):
+        if len(low1) == 0 or len(low2) == 0:
+            continue
+        z_bottom, z_top = z_levels[k], z_levels[k + 1]
+        (a_low_b, a_high_b), (b_low_b, b_high_b) = above[k]
+        (a_low_t, a_high_t), (b_low_t, b_high_t) = below[k + 1]
+
+        for i in range(len(low1)):
+            for j in range(len(low2)):
+                y_bottom = _chain(b_low_b[j], b_high_b[j], y_grid[k])
+                y_top = _chain(b_low_t[j], b_high_t[j], y_grid[k + 1])
+                x_bottom = _chain(a_low_b[i], a_high_b[i], x_grid[k])
+                x_top = _chain(a_low_t[i], a_high_t[i], x_grid[k + 1])
+
+                # 字形 1 的左右邊界（x = a(z)）
+                for x_b, x_t, sign in ((a_low_b[i], a_low_t[i], -1), (a_high_b[i], a_high_t[i], 1)):
+                    bottom = np.column_stack([np.full(len(y_bottom), x_b), y_bottom, np.full(len(y_bottom), z_bottom)])
+                    top = np.column_stack([np.full(len(y_top), x_t), y_top, np.full(len(y_top), z_top)])
+                    pieces.append(_orient(np.array(_zipper(bottom, top)), 0, sign))
+
+                # 字形 2 的左右邊界（y = b(z)）
+                for y_b, y_t, sign in ((b_low_b[j], b_low_t[j], -1), (b_high_b[j], b_high_t[j], 1)):
+                    bottom = np.column_stack([x_bottom, np.full(len(x_bottom), y_b), np.full(len(x_bottom), z_bottom)])
+                    top = np.column_stack([x_top, np.full(len(x_top), y_t), np.full(len(x_top), z_top)])
+                    pieces.append(_orient(np.array(_zipper(bottom, top)), 1, sign))
+
+    # 水平面：下方截面與上方截面的差集
+    for b, z in enumerate(z_levels):
+        xs, ys = x_grid[b], y_grid[b]
+        if len(xs) < 2 or len(ys) < 2:
+            continue
+        x_mid = (xs[:-1] + xs[1:]) / 2.0
+        y_mid = (ys[:-1] + ys[1:]) / 2.0
+
+        def covered(mid, bounds):
+            low, high = bounds
+            if len(low) == 0:
+                return np.zeros(len(mid), dtype=bool)
+            return np.any((mid[:, None] > low[None, :]) & (mid[:, None] < high[None, :]), axis=1)
+
+        inside_below = np.outer(covered(x_mid, below[b][0]), covered(y_mid, below[b][1]))
+        inside_above = np.outer(covered(x_mid, above[b][0]), covered(y_mid, above[b][1]))
+
+        for mask, sign in ((inside_below & ~inside_above, 1), (inside_above & ~inside_below, -1)):
+            ii, jj = np.nonzero(mask)
+            if len(ii) == 0:
+                continue
+            x0, x1, y0, y1 = xs[ii], xs[ii + 1], ys[jj], ys[jj + 1]
+            zz = np.full(len(ii), z)
+            corner = lambda x, y: np.column_stack([x, y, zz])
+            quads = np.concatenate(
+                [
+                    np.stack([corner(x0, y0), corner(x1, y0), corner(x1, y1)], axis=1),
+                    np.stack([corner(x0, y0), corner(x1, y1), corner(x0, y1)], axis=1),
+                ]
+            )
+            pieces.append(_orient(quads, 2, sign))
+
+    pieces = [p for p in pieces if len(p)]
+    if not pieces:
+        return np.zeros((0, 3, 3))
+    return np.concatenate(pieces)
+
+
+def build_bail_mesh(pos_x, pos_y, pos_z, bail_rotation, bail_fn=32, bail_tube_fn=24):
+    """
+    torus 墜頭網格（與 SCAD 的 bail() 相同：rotate_extrude → rotate([90,0,0]) → rotate z → translate）
+
+    Args:
+        bail_rotation: 前端角度（內部加上 90° 偏移，與 SCAD 相同）
+    """
+    u = 2 * np.pi * np.arange(bail_fn) / bail_fn
+    v = 2 * np.pi * np.arange(bail_tube_fn) / bail_tube_fn
+    uu, vv = np.meshgrid(u, v, indexing="ij")
+    ring = BAIL_RADIUS + BAIL_TUBE * np.cos(vv)
+    points = np.stack([ring * np.cos(uu), ring * np.sin(uu), BAIL_TUBE * np.sin(vv)], axis=-1)
+
+    i = np.arange(bail_fn)[:, None]
+    j = np.arange(bail_tube_fn)[None, :]
+    i1, j1 = (i + 1) % bail_fn, (j + 1) % bail_tube_fn
+    a, b, c, d = points[i, j], points[i1, j], points[i1, j1], points[i, j1]
+    triangles = np.concatenate(
+        [np.stack([a, b, c], axis=-2).reshape(-1, 3, 3), np.stack([a, c, d], axis=-2).reshape(-1, 3, 3)]
+    )
+
+    # 法向量朝外：遠離管中心
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    centroid = triangles.mean(axis=1)
+    angle = np.arctan2(centroid[:, 1], centroid[:, 0])
+    tube_center = np.stack([BAIL_RADIUS * np.cos(angle), BAIL_RADIUS * np.sin(angle), np.zeros(len(angle))], axis=1)
+    flip = np.einsum("ij,ij->i", normals, centroid - tube_center) < 0
+    triangles[flip] = triangles[flip][:, ::-1]
+
+    # rotate([90, 0, 0])：(x, y, z) → (x, -z, y)
+    triangles = np.stack([triangles[..., 0], -triangles[..., 2], triangles[..., 1]], axis=-1)
+
+    theta = math.radians(bail_rotation + 90)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    x, y = triangles[..., 0], triangles[..., 1]
+    triangles = np.stack([x * cos_t - y * sin_t, x * sin_t + y * cos_t, triangles[..., 2]], axis=-1)
+
+    return triangles + np.array([pos_x, pos_y, pos_z])
+
+
+def render_analytic_stl(stl_path, params, outline1, outline2, quality=None):
+    """
+    以解析引擎產生完整模型 STL（字母交集 + torus 墜頭）
+
+    Args:
+        params: 9 個 SCAD 參數
+        outline1, outline2: glyph_outline.GlyphOutline
+        quality: quality_tiers 的解析度設定（墜頭分段數）
+
+    Returns:
+        dict: 三角面數與耗時
+    """
+    started = time.monotonic()
+
+    core = build_intersection_mesh(outline1, outline2, float(params["size"]))
+    bail = build_bail_mesh(
+        params["bailRelativeX"],
+        params["bailRelativeY"],
+        params["bailRelativeZ"],
+        params["bailRotation"],
+        bail_fn=quality["bail_fn"] if quality else 32,
+        bail_tube_fn=quality["bail_tube_fn"] if quality else 24,
+    )
+
+    write_binary_stl(stl_path, np.concatenate([core, bail]))
+
+    seconds = time.monotonic() - started
+    logger.info(
+        f"⚡ 解析引擎完成: {params['letter1']}{params['letter2']} "
+        f"{len(core)} + {len(bail)} 面，耗時 {seconds:.3f}s"
+    )
+    return {"facets": len(core) + len(bail), "seconds": round(seconds, 3)}
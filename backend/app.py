@@ -10,7 +10,41 @@ from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import subprocess
 import tempfile
-from scad_generator import generate_scad_script
+from stl_renderer import (
+    extract_scad_params,
+    extract_render_options,
+    STLRenderError,
+    RenderCancelled,
+    RENDER_ENGINE,
+    PREVIEW_QUALITY,
+    stl_cache,
+)
+from openscad_runner import get_openscad_capabilities
+from quality_tiers import QUALITY_PRODUCTION
+from render_pool import render_pool, RenderPoolFull, RENDER_QUEUE_TIMEOUT, RENDER_SLOTS
+from render_client import (
+    render_stl,
+    render_service_status,
+    compute_render_key,
+    get_stl_backend,
+    RenderServiceUnavailable,
+    RENDER_SERVICE_SOCKET,
+)
+from render_scheduling import scheduling_status
+from render_memory import render_memory
+from font_index import font_index, preflight_fonts, UnknownFontError
+from render_telemetry import font_aggregates
+from openscad_runner import OPENSCAD_TIMEOUT
+from stl_jobs import (
+    submit_job,
+    wait_for_job,
+    load_job,
+    cancel_job,
+    public_job_view,
+    recover_orphaned_jobs,
+)
+from speculative_render import speculative_renders
+from workspace import run_janitor, disk_usage_report, JANITOR_INTERVAL
 import logging
 import hashlib
 import urllib.parse
@@ -28,6 +62,10 @@ import anthropic
 import re
 import os
 import sys
+import select
+import socket
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 # API Key - 使用環境變量
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
@@ -118,6 +156,30 @@ GOOGLE_SHEETS_CONFIG = {
     "cache_duration": 3600,  # 快取 1 小時
 }
 
+# 訂單 STL 的幾何引擎："openscad"（OpenSCAD 渲染）或 "analytic"（解析交集網格）
+ORDER_STL_ENGINE = os.environ.get("ORDER_STL_ENGINE", RENDER_ENGINE)
+
+# 同步 STL 請求的期限（秒）：超過後結束渲染，避免已放棄的預覽繼續佔用 CPU
+STL_REQUEST_DEADLINE = float(
+    os.environ.get("STL_REQUEST_DEADLINE", str(RENDER_QUEUE_TIMEOUT + OPENSCAD_TIMEOUT))
+)
+# 等待渲染時檢查用戶端是否斷線的間隔（秒）
+DISCONNECT_POLL_INTERVAL = 1.0
+
+# 批次 STL：單次請求最多幾個設計、整批的期限（秒）
+STL_BATCH_MAX_DESIGNS = int(os.environ.get("STL_BATCH_MAX_DESIGNS", "50"))
+STL_BATCH_DEADLINE = float(os.environ.get("STL_BATCH_DEADLINE", "1800"))
+
+# 同一訂單的商品同時渲染幾個（預設與 render_pool 名額相同）
+ORDER_STL_WORKERS = int(os.environ.get("ORDER_STL_WORKERS", str(RENDER_SLOTS)))
+
+# AI 推薦字體後預先渲染幾組字體搭配（依推薦順序，設計頁預覽的品質 PREVIEW_QUALITY，預設 draft）
+PREFETCH_FONT_PAIRS = int(os.environ.get("PREFETCH_FONT_PAIRS", "3"))
+
+# 背景 Worker 檢查隊列目錄是否有新訂單的間隔（秒）；失敗重試仍間隔 STL_QUEUE_RETRY_INTERVAL
+STL_QUEUE_POLL_INTERVAL = float(os.environ.get("STL_QUEUE_POLL_INTERVAL", "1"))
+STL_QUEUE_RETRY_INTERVAL = 60
+
 # 優惠碼快取
 PROMO_CODES_CACHE = {"data": {}, "last_updated": None}
 
@@ -125,9 +187,12 @@ PROMO_CODES_CACHE = {"data": {}, "last_updated": None}
 ORDERS_DIR = "orders"
 STL_DIR = "stl_files"
 QUEUE_DIR = "stl_queue"
+# 訂單 STL 的逐項完成記錄（重試時只重做失敗的商品）
+STL_CHECKPOINT_DIR = os.path.join(QUEUE_DIR, "checkpoints")
 os.makedirs(ORDERS_DIR, exist_ok=True)
 os.makedirs(STL_DIR, exist_ok=True)
 os.makedirs(QUEUE_DIR, exist_ok=True)
+os.makedirs(STL_CHECKPOINT_DIR, exist_ok=True)
 
 # ==========================================
 # 優惠碼系統（完全使用 Google Sheets）
@@ -472,6 +537,25 @@ def remove_from_queue(queue_file):
         pass
 
 
+def get_order_status_value(order_id):
+    """訂單目前的狀態（訂單不存在時為 None）"""
+    order = load_order(order_id)
+    return order.get("status") if order else None
+
+
+def preflight_order_fonts(order_id):
+    """檢查訂單所有商品的字體是否已安裝，返回錯誤訊息（全部正常時為 None）"""
+    order = load_order(order_id)
+    if not order:
+        return None
+    try:
+        for item in order["items"]:
+            preflight_fonts(dict(item))
+    except UnknownFontError as e:
+        return str(e)
+    return None
+
+
 def process_stl_queue():
     """處理 STL 隊列"""
     items = get_pending_queue_items()
@@ -488,11 +572,23 @@ def process_stl_queue():
 
     logger.info(f"🔨 處理訂單: {order_id}")
 
+    font_error = preflight_order_fonts(order_id)
+    if font_error:
+        # 字體不存在時重試也不會成功：直接標記失敗，不啟動 OpenSCAD
+        item["status"] = "failed"
+        item["error"] = font_error
+        with open(queue_file, "w", encoding="utf-8") as f:
+            json.dump(item, f, ensure_ascii=False, indent=2)
+        update_order_status(order_id, "stl_failed")
+        logger.error(f"❌ 訂單 {order_id} 字體預檢失敗: {font_error}")
+        return
+
     try:
         success = generate_and_send_stl(order_id)
 
         if success:
             remove_from_queue(queue_file)
+            clear_stl_checkpoint(order_id)
             update_order_status(order_id, "completed")
             logger.info(f"✅ 訂單 {order_id} 處理完成")
         else:
@@ -512,17 +608,60 @@ def process_stl_queue():
         logger.error(f"❌ 處理錯誤: {str(e)}")
 
 
+def wait_for_queue_change(timeout):
+    """
+    等待隊列目錄變動（新訂單加入、處理完成的訂單移除）或逾時
+
+    add_to_stl_queue 可能在其他 gunicorn worker 執行，以目錄 mtime 判斷；
+    重試次數改寫的是既有檔案，不會改變目錄 mtime，失敗的訂單仍依原間隔重試
+    """
+    def snapshot():
+        try:
+            return os.stat(QUEUE_DIR).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    before = snapshot()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(STL_QUEUE_POLL_INTERVAL)
+        if snapshot() != before:
+            return True
+    return False
+
+
 def stl_queue_worker():
     """背景 Worker"""
     logger.info("🚀 STL Queue Worker 已啟動")
 
+    last_janitor = 0
     while True:
+        try:
+            # 接手重啟前未完成的 STL 工作
+            recover_orphaned_jobs()
+        except Exception as e:
+            logger.error(f"STL 工作恢復錯誤: {str(e)}")
+
+        if time.time() - last_janitor >= JANITOR_INTERVAL:
+            try:
+                # 清理過期的訂單 STL 與遺留的渲染暫存檔
+                run_janitor(STL_DIR, TEMP_DIR)
+            except Exception as e:
+                logger.error(f"磁碟清理錯誤: {str(e)}")
+            try:
+                # 刪除未付款訂單的預先渲染結果
+                speculative_renders.expire(order_status=get_order_status_value)
+            except Exception as e:
+                logger.error(f"預先渲染清理錯誤: {str(e)}")
+            last_janitor = time.time()
+
         try:
             process_stl_queue()
         except Exception as e:
             logger.error(f"Worker 錯誤: {str(e)}")
 
-        time.sleep(60)
+        # 付款回調加入隊列後立即處理，不等下一輪
+        wait_for_queue_change(STL_QUEUE_RETRY_INTERVAL)
 
 
 def start_background_worker():
@@ -554,63 +693,63 @@ def start_background_worker():
 # ==========================================
 
 
-def generate_stl_for_item(item):
-    """生成 STL"""
-    try:
-        logger.info(f"🔨 生成 STL: {item['letter1']}{item['letter2']}")
-
-        # 只傳送 scad_generator 需要的 9 個參數
-        params = {
-            "letter1": item["letter1"],
-            "letter2": item["letter2"],
-            "font1": item["font1"],
-            "font2": item["font2"],
-            "size": item["size"],
-            "bailRelativeX": item.get("bailRelativeX", 0),
-            "bailRelativeY": item.get("bailRelativeY", 0),
-            "bailRelativeZ": item.get("bailRelativeZ", 0),
-            "bailRotation": item.get("bailRotation", 0),
+def order_item_render_args(item):
+    """訂單商品的渲染參數（付款後的 STL 生成與結帳時的預先渲染共用，快取 key 才會一致）"""
+    # 只傳送 scad_generator 需要的 9 個參數
+    params = extract_scad_params(item)
+    # 訂單檔案要送去鑄造，一律使用 production 品質；幾何引擎可由商品項目或 ORDER_STL_ENGINE 指定
+    options = extract_render_options(
+        {
+            **item,
+            "quality": QUALITY_PRODUCTION,
+            "engine": item.get("engine") or ORDER_STL_ENGINE,
         }
+    )
+    return params, options
 
-        scad_content = generate_scad_script(**params)
 
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".scad", delete=False
-        ) as scad_file:
-            scad_file.write(scad_content)
-            scad_path = scad_file.name
-
-        stl_path = scad_path.replace(".scad", ".stl")
+def start_speculative_renders(order_id, items):
+    """結帳時預先渲染訂單商品（失敗不影響結帳）"""
+    designs = []
+    for item in items:
+        try:
+            designs.append(order_item_render_args(item))
+        except Exception as e:
+            logger.warning(f"⚠️ 無法預先渲染商品 {item.get('id')}: {e}")
+    try:
+        speculative_renders.start(order_id, designs)
+    except Exception as e:
+        logger.error(f"❌ 預先渲染啟動失敗: {e}")
 
-        cmd = ["openscad", "-o", stl_path, "--export-format", "binstl", scad_path]
 
-        env = os.environ.copy()
-        env["DISPLAY"] = ":99"
+def generate_stl_for_item(item):
+    """生成 STL（相同設計直接使用快取）"""
+    try:
+        logger.info(f"🔨 生成 STL: {item['letter1']}{item['letter2']}")
 
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=180, env=env
-        )
+        params, options = order_item_render_args(item)
 
         try:
-            os.unlink(scad_path)
-        except:
-            pass
-
-        if result.returncode != 0 or not os.path.exists(stl_path):
-            logger.error(f"❌ STL 生成失敗")
+            # 背景隊列不搶佔 HTTP 的等待名額：佇列滿時持續等待而不是失敗
+            stl_path, cache_hit = render_stl(
+                params, options, queue_timeout=None, reject_when_full=False
+            )
+        except STLRenderError as e:
+            # stderr 已由 render_telemetry 解析記錄；這裡保留最後一段方便直接從 log 排查
+            logger.error(f"❌ STL 生成失敗: {e}\n{(e.stderr or '')[-2000:]}")
             return None
 
         final_path = os.path.join(STL_DIR, f"{item['id']}.stl")
         import shutil
 
-        shutil.copy(stl_path, final_path)
+        # 先複製到暫存檔再改名：中斷時不會留下被當成已完成的半個檔案
+        tmp_path = f"{final_path}.{threading.get_ident()}.tmp"
+        shutil.copy(stl_path, tmp_path)
+        os.replace(tmp_path, final_path)
 
-        try:
-            os.unlink(stl_path)
-        except:
-            pass
-
-        logger.info(f"✅ STL 已生成: {final_path}")
+        logger.info(
+            f"✅ STL 已生成: {final_path}（快取命中: {cache_hit}，幾何後端: {get_stl_backend(stl_path)}）"
+        )
         return final_path
 
     except Exception as e:
@@ -618,22 +757,85 @@ def generate_stl_for_item(item):
         return None
 
 
+def _stl_checkpoint_path(order_id):
+    return os.path.join(STL_CHECKPOINT_DIR, f"{order_id}.json")
+
+
+def load_stl_checkpoint(order_id):
+    """讀取訂單已完成的商品 STL（{item_id: {"path", "completed_at"}}），檔案已不存在的項目略過"""
+    try:
+        with open(_stl_checkpoint_path(order_id), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {
+        item_id: entry
+        for item_id, entry in checkpoint.items()
+        if os.path.exists(entry.get("path", "")) and os.path.getsize(entry["path"]) > 0
+    }
+
+
+def save_stl_checkpoint(order_id, checkpoint):
+    path = _stl_checkpoint_path(order_id)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def clear_stl_checkpoint(order_id):
+    try:
+        os.unlink(_stl_checkpoint_path(order_id))
+    except FileNotFoundError:
+        pass
+
+
 def generate_and_send_stl(order_id):
-    """生成所有 STL 並發送內部 Email-2"""
+    """
+    生成所有 STL 並發送內部 Email-2
+
+    商品同時渲染（最多 ORDER_STL_WORKERS 個），每完成一個就寫入 checkpoint；
+    重試時只重新渲染失敗的商品，已完成的直接沿用
+    """
     try:
         order = load_order(order_id)
         if not order:
             return False
 
-        logger.info(f"🔨 開始生成訂單 {order_id} 的 STL...")
+        checkpoint = load_stl_checkpoint(order_id)
+        # checkpoint 存成 JSON，key 一律是字串
+        pending = [item for item in order["items"] if str(item["id"]) not in checkpoint]
+        if checkpoint:
+            logger.info(
+                f"♻️ 訂單 {order_id} 沿用 {len(order['items']) - len(pending)} 個已完成的 STL"
+            )
+        logger.info(f"🔨 開始生成訂單 {order_id} 的 STL（{len(pending)} 個）...")
+
+        failed = []
+        if pending:
+            workers = max(1, min(len(pending), ORDER_STL_WORKERS))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(generate_stl_for_item, item): item for item in pending}
+                for future in as_completed(futures):
+                    item = futures[future]
+                    stl_path = future.result()
+                    if not stl_path:
+                        failed.append(item["id"])
+                        continue
+                    # checkpoint 只由這個 thread 寫入
+                    checkpoint[str(item["id"])] = {
+                        "path": stl_path,
+                        "completed_at": datetime.now().isoformat(),
+                    }
+                    save_stl_checkpoint(order_id, checkpoint)
+
+        if failed:
+            logger.warning(
+                f"⚠️ 訂單 {order_id} 有 {len(failed)} 個商品 STL 生成失敗: {', '.join(map(str, failed))}"
+            )
+            return False
 
-        stl_files = []
-        for item in order["items"]:
-            stl_path = generate_stl_for_item(item)
-            if stl_path:
-                stl_files.append(stl_path)
-            else:
-                return False
+        stl_files = [checkpoint[str(item["id"])]["path"] for item in order["items"]]
 
         # 發送內部 Email-2（帶 STL）
         email_sent = send_internal_stl_email(order, stl_files)
@@ -1218,71 +1420,348 @@ def generate_internal_stl_email_html(order_data):
 # ==========================================
 
 
+def render_pool_busy_response(e):
+    """渲染佇列已滿：429 + Retry-After；渲染服務無法連線：503 + Retry-After（不是用戶端送太多請求）"""
+    if isinstance(e, RenderServiceUnavailable):
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "error": "STL 渲染服務暫時無法使用，請稍後再試",
+                    "retryAfter": e.retry_after,
+                }
+            ),
+            503,
+            {"Retry-After": str(e.retry_after)},
+        )
+    return (
+        jsonify(
+            {
+                "success": False,
+                "error": "STL 生成忙碌中，請稍後再試",
+                "retryAfter": e.retry_after,
+            }
+        ),
+        429,
+        {"Retry-After": str(e.retry_after)},
+    )
+
+
+def get_client_session(data):
+    """前端 session 識別（X-Session-Id 標頭或 sessionId 欄位），同一 session 的新請求會取代舊的渲染"""
+    return request.headers.get("X-Session-Id") or (data or {}).get("sessionId")
+
+
+def client_disconnected():
+    """
+    用戶端是否已關閉連線（gunicorn 提供原始 socket 時才能判斷）
+
+    socket 可讀但 peek 不到資料 = 對方已送出 FIN
+    """
+    sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
 @app.route("/api/generate-stl", methods=["POST"])
 def generate_stl():
-    """生成 STL"""
+    """生成 STL（同步版：提交工作並等待完成，保留給舊版前端）"""
     try:
         data = request.json
         logger.info(f"🔨 收到 STL 生成請求")
 
         # 只傳送 scad_generator 需要的 9 個參數
-        params = {
-            "letter1": data["letter1"],
-            "letter2": data["letter2"],
-            "font1": data["font1"],
-            "font2": data["font2"],
-            "size": data.get("size", 15),
-            "bailRelativeX": data.get("bailRelativeX", 0),
-            "bailRelativeY": data.get("bailRelativeY", 0),
-            "bailRelativeZ": data.get("bailRelativeZ", 0),
-            "bailRotation": data.get("bailRotation", 0),
-        }
+        params = extract_scad_params(data)
+        options = extract_render_options(data, default_quality=PREVIEW_QUALITY)
 
-        scad_content = generate_scad_script(**params)
+        deadline = time.time() + STL_REQUEST_DEADLINE
+        try:
+            job = submit_job(
+                params, options, session=get_client_session(data), deadline=deadline
+            )
+        except RenderPoolFull as e:
+            return render_pool_busy_response(e)
 
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".scad", delete=False
-        ) as scad_file:
-            scad_file.write(scad_content)
-            scad_path = scad_file.name
+        # 等待期間用戶端關閉分頁時取消渲染（期限由工作本身檢查）
+        while True:
+            job = wait_for_job(job["id"], timeout=DISCONNECT_POLL_INTERVAL)
+            if job["status"] not in ("queued", "running") or time.time() > deadline:
+                break
+            if client_disconnected():
+                cancel_job(job["id"], "client disconnected")
+                return "", 499
 
-        stl_path = scad_path.replace(".scad", ".stl")
+        if job["status"] == "rejected":
+            error_class = RenderServiceUnavailable if job.get("service_unavailable") else RenderPoolFull
+            return render_pool_busy_response(error_class(job.get("retry_after", 1)))
 
-        cmd = ["openscad", "-o", stl_path, "--export-format", "binstl", scad_path]
+        if job["status"] == "failed":
+            return jsonify({"success": False, "error": job.get("error", "")}), 500
 
-        env = os.environ.copy()
-        env["DISPLAY"] = ":99"
+        if job["status"] == "cancelled":
+            return (
+                jsonify({"success": False, "error": f"STL 生成已取消: {job.get('error', '')}"}),
+                409,
+            )
 
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=180, env=env
+        if job["status"] != "done":
+            # 超過期限：工作會在下一次檢查時結束
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "STL 生成逾時，已取消渲染",
+                        "jobId": job["id"],
+                    }
+                ),
+                504,
+            )
+
+        logger.info(
+            f"✅ STL 生成成功: {job['stl_path']}（快取命中: {job.get('cache_hit')}，幾何後端: {job.get('backend')}）"
         )
 
-        try:
-            os.unlink(scad_path)
-        except:
-            pass
+        response = send_file(
+            job["stl_path"],
+            as_attachment=True,
+            download_name=f"{data['letter1']}_{data['letter2']}.stl",
+        )
+        response.headers["X-Geometry-Backend"] = job.get("backend") or ""
+        return response
 
-        if result.returncode != 0:
-            logger.error(f"❌ OpenSCAD 錯誤: {result.stderr}")
-            return jsonify({"success": False, "error": result.stderr}), 500
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"❌ STL 生成錯誤: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def _batch_stl_filename(index, params):
+    """ZIP 內的檔名（字母可能是檔名不允許的符號）"""
+    letters = re.sub(r'[\\/:*?"<>|]', "_", f"{params['letter1']}_{params['letter2']}")
+    return f"{index + 1:02d}_{letters}_{params['size']}mm.stl"
+
+
+@app.route("/api/generate-stl/batch", methods=["POST"])
+def generate_stl_batch():
+    """
+    批次生成 STL，回傳一個 ZIP
+
+    請求：{"designs": [{9 個參數 + 選用的 backend / quality / engine}, ...]}，
+    最外層的 backend / quality / engine 作為每個設計的預設值
+
+    相同設計（快取 key 相同）只渲染一次；最多同時渲染 RENDER_SLOTS 個（與 render_pool 名額相同），
+    ZIP 內附 manifest.json 記錄每個請求項目對應的檔案或錯誤
+    """
+    try:
+        data = request.json or {}
+        designs = data.get("designs") or []
+        if not designs:
+            return jsonify({"success": False, "error": "缺少 designs"}), 400
+        if len(designs) > STL_BATCH_MAX_DESIGNS:
+            return (
+                jsonify(
+                    {"success": False, "error": f"一次最多 {STL_BATCH_MAX_DESIGNS} 個設計"}
+                ),
+                400,
+            )
 
-        if not os.path.exists(stl_path):
-            logger.error("❌ STL 檔案不存在")
-            return jsonify({"success": False, "error": "STL file not generated"}), 500
+        defaults = {k: data[k] for k in ("backend", "quality", "engine") if k in data}
+        unique = {}  # 快取 key -> (params, options, 第一次出現的位置)
+        keys = []
+        for index, design in enumerate(designs):
+            try:
+                params = extract_scad_params(design)
+                options = extract_render_options({**defaults, **design})
+            except KeyError as e:
+                return jsonify({"success": False, "error": f"第 {index + 1} 個設計缺少參數: {e}"}), 400
+            except ValueError as e:
+                return jsonify({"success": False, "error": f"第 {index + 1} 個設計: {e}"}), 400
+            key = compute_render_key(params, options)
+            unique.setdefault(key, (params, options, index))
+            keys.append(key)
+
+        logger.info(f"📦 批次 STL: {len(designs)} 個設計（不重複 {len(unique)} 個）")
+
+        deadline = time.time() + STL_BATCH_DEADLINE
+        cancelled = threading.Event()
+
+        def should_cancel():
+            if cancelled.is_set():
+                return "client disconnected"
+            if time.time() > deadline:
+                return "deadline exceeded"
+            return None
 
-        logger.info(f"✅ STL 生成成功: {stl_path}")
+        def render_one(params, options):
+            # 批次本身就限制了並行數：名額滿時等待而不是拒絕
+            stl_path, _ = render_stl(
+                params,
+                options,
+                queue_timeout=None,
+                reject_when_full=False,
+                should_cancel=should_cancel,
+            )
+            return stl_path
 
-        return send_file(
-            stl_path,
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(len(unique), max(1, RENDER_SLOTS))) as executor:
+            futures = {
+                executor.submit(render_one, params, options): key
+                for key, (params, options, _) in unique.items()
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending, timeout=DISCONNECT_POLL_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    try:
+                        results[futures[future]] = (future.result(), None)
+                    except (STLRenderError, RenderCancelled) as e:
+                        results[futures[future]] = (None, str(e))
+                    except Exception as e:
+                        # 單一設計的非預期錯誤（例如 RenderPoolFull、檔案系統錯誤）不影響其他設計
+                        logger.error(f"❌ 批次 STL 設計錯誤: {str(e)}")
+                        results[futures[future]] = (None, str(e) or type(e).__name__)
+                if pending and not cancelled.is_set() and client_disconnected():
+                    logger.info("🛑 批次 STL 用戶端已斷線，取消剩餘渲染")
+                    cancelled.set()
+
+        if cancelled.is_set():
+            return "", 499
+
+        manifest = []
+        for index, key in enumerate(keys):
+            params, _, first_index = unique[key]
+            stl_path, error = results[key]
+            entry = {"index": index, "letter1": params["letter1"], "letter2": params["letter2"]}
+            if stl_path:
+                entry["file"] = _batch_stl_filename(first_index, params)
+                entry["backend"] = get_stl_backend(stl_path)
+            else:
+                entry["error"] = error
+            manifest.append(entry)
+
+        if not any(stl_path for stl_path, _ in results.values()):
+            return jsonify({"success": False, "error": "全部設計都生成失敗", "items": manifest}), 500
+
+        # ZIP 寫到暫存檔（數十個 STL 不放記憶體）；開啟後即刪除路徑，送完自動釋放
+        fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=TEMP_DIR)
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(
+            f, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1
+        ) as archive:
+            for key, (params, _, first_index) in unique.items():
+                stl_path, _ = results[key]
+                if stl_path:
+                    archive.write(stl_path, _batch_stl_filename(first_index, params))
+            archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        zip_file = open(zip_path, "rb")
+        os.unlink(zip_path)
+
+        failed = sum(1 for entry in manifest if "error" in entry)
+        logger.info(f"✅ 批次 STL 完成: {len(manifest) - failed} 成功，{failed} 失敗")
+        response = send_file(
+            zip_file,
+            mimetype="application/zip",
             as_attachment=True,
-            download_name=f"{data['letter1']}_{data['letter2']}.stl",
+            download_name=f"duet-stl-batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip",
         )
+        response.headers["X-Batch-Failed"] = str(failed)
+        return response
 
     except Exception as e:
-        logger.error(f"❌ STL 生成錯誤: {str(e)}")
+        logger.error(f"❌ 批次 STL 錯誤: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/stl-jobs", methods=["POST"])
+def create_stl_job():
+    """提交 STL 渲染工作（立即返回 jobId）"""
+    try:
+        data = request.json
+        params = extract_scad_params(data)
+        options = extract_render_options(data, default_quality=PREVIEW_QUALITY)
+
+        try:
+            job = submit_job(params, options, session=get_client_session(data))
+        except RenderPoolFull as e:
+            return render_pool_busy_response(e)
+
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    **public_job_view(job),
+                    "statusUrl": f"/api/stl-jobs/{job['id']}",
+                    "downloadUrl": f"/api/stl-jobs/{job['id']}/download",
+                }
+            ),
+            202,
+        )
+
+    except KeyError as e:
+        return jsonify({"success": False, "error": f"缺少參數: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"❌ STL 工作提交錯誤: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/stl-jobs/<job_id>", methods=["GET"])
+def get_stl_job(job_id):
+    """查詢 STL 工作狀態與進度"""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "工作不存在"}), 404
+    return jsonify({"success": True, **public_job_view(job)})
+
+
+@app.route("/api/stl-jobs/<job_id>", methods=["DELETE"])
+def delete_stl_job(job_id):
+    """取消尚未完成的 STL 工作（前端放棄預覽時呼叫）"""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "工作不存在"}), 404
+    cancelled = cancel_job(job_id, "cancelled by client")
+    return jsonify({"success": True, "cancelled": cancelled, **public_job_view(load_job(job_id))})
+
+
+@app.route("/api/stl-jobs/<job_id>/download", methods=["GET"])
+def download_stl_job(job_id):
+    """下載已完成工作的 binary STL"""
+    job = load_job(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "工作不存在"}), 404
+
+    if job["status"] != "done":
+        return (
+            jsonify({"success": False, **public_job_view(job), "error": "STL 尚未完成"}),
+            409,
+        )
+
+    if not os.path.exists(job["stl_path"]):
+        return jsonify({"success": False, "error": "STL 已過期，請重新提交"}), 410
+
+    params = job["params"]
+    response = send_file(
+        job["stl_path"],
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{params['letter1']}_{params['letter2']}.stl",
+    )
+    response.headers["X-Geometry-Backend"] = job.get("backend") or ""
+    return response
+
+
 # ==========================================
 # 綠界金流
 # ==========================================
@@ -1442,6 +1921,14 @@ def checkout():
         ai_consultation = data.get("aiConsultation", None)  # ✅ 新增：接收 AI 諮詢資料
         return_url = data.get("returnUrl", request.host_url + "payment-success")
 
+        # ✅ 字體預檢：付款前校正字體名稱，未安裝的字體直接拒絕（否則鑄造檔會是預設字體）
+        try:
+            for item in items:
+                preflight_fonts(item)
+        except UnknownFontError as e:
+            logger.warning(f"❌ 字體預檢失敗: {e}")
+            return jsonify({"success": False, "error": str(e)}), 400
+
         # ✅ 後端驗證優惠碼（安全性必須）
         is_valid, discount, promo_info, error_msg = validate_promo_code(
             promo_code, original_total
@@ -1493,6 +1980,9 @@ def checkout():
         }
         save_order(order_id, order_data)
 
+        # 付款期間先以閒置的渲染名額產生 STL，付款確認時通常已在快取中
+        start_speculative_renders(order_id, items)
+
         # 準備 CustomField（訂單備份）
         custom_fields = prepare_custom_fields(order_data)
 
@@ -1598,6 +2088,7 @@ def payment_callback():
             order_id = data.get("MerchantTradeNo")
             if order_id:
                 update_order_status(order_id, "payment_failed", data)
+                speculative_renders.discard(order_id)
             return "0|Payment Failed"
     except Exception as e:
         logger.error(f"❌ 回調處理錯誤: {str(e)}")
@@ -1696,6 +2187,7 @@ def process_order_after_payment(order_id, payment_data):
 
         # 1. 立即更新訂單狀態（同步）
         update_order_status(order_id, "paid", payment_data)
+        speculative_renders.claim(order_id)
 
         # 2. 非同步處理（不阻塞綠界回調）
         def async_tasks():
@@ -1860,7 +2352,35 @@ def test_custom_fields():
 @app.route("/health")
 def health():
     """健康檢查"""
-    return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
+    report = {
+        "status": "ok",
+        "timestamp": datetime.now().isoformat(),
+        "render_service": render_service_status(),
+        "fonts": font_index.status(),
+        "speculative_renders": speculative_renders.status(),
+        "disk": disk_usage_report(STL_DIR, TEMP_DIR),
+    }
+    # 渲染服務模式下名額 / 記憶體 / 快取 / 幾何後端都由服務回報（render_service），web worker 不自己探測
+    if not RENDER_SERVICE_SOCKET:
+        report.update(
+            render_pool=render_pool.status(),
+            render_memory=render_memory.status(),
+            render_scheduling=scheduling_status(),
+            geometry_backends=get_openscad_capabilities()["backends"],
+        )
+        report["disk"]["stl_cache"] = stl_cache.stats()
+    return jsonify(report)
+
+
+@app.route("/api/render-stats/fonts", methods=["GET"])
+def render_stats_fonts():
+    """各字體的渲染統計（平均 / p95 渲染秒數、面數、失敗與字體 fallback 次數），由慢到快排序"""
+    try:
+        days = request.args.get("days", type=float)
+        return jsonify({"success": True, "fonts": font_aggregates(days=days)})
+    except Exception as e:
+        logger.error(f"❌ 渲染統計錯誤: {str(e)}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
 
 # ==========================================
@@ -1873,6 +2393,13 @@ logger.info(f"📧 發件人: {SENDER_EMAIL}")
 logger.info(f"📧 內部收件: {INTERNAL_EMAIL}")
 logger.info(f"💳 綠界: {ECPAY_CONFIG['MerchantID']}")
 
+# 探測 OpenSCAD 幾何後端（結果快取，之後的請求不再呼叫 --help）；渲染服務模式由服務自己探測
+if not RENDER_SERVICE_SOCKET:
+    get_openscad_capabilities()
+
+# 建立字體索引（之後的字體預檢只查記憶體，不執行 fc-list）
+font_index.build()
+
 # 啟動背景 Worker
 start_background_worker()
 # ===== 在現有路由後面添加以下新端點 =====
@@ -1882,6 +2409,47 @@ start_background_worker()
 # ============================================================
 
 
+def recommended_font_pairs(result, limit=PREFETCH_FONT_PAIRS):
+    """
+    AI 推薦中最前面的幾組字體搭配 [(font1, font2), ...]
+
+    兩個字母各有一串推薦字體（依推薦程度排序），依兩邊名次的和排序：
+    (第 1, 第 1)、(第 1, 第 2)、(第 2, 第 1)、(第 2, 第 2)...
+    """
+    recommendations = result.get("recommendations") or {}
+    fonts1 = [r.get("font") for r in recommendations.get("letter1") or [] if r.get("font")]
+    fonts2 = [r.get("font") for r in recommendations.get("letter2") or [] if r.get("font")]
+    pairs = [(i + j, i, fonts1[i], fonts2[j]) for i in range(len(fonts1)) for j in range(len(fonts2))]
+    return [(font1, font2) for _, _, font1, font2 in sorted(pairs)[:limit]]
+
+
+def prefetch_recommended_fonts(result):
+    """AI 推薦完成時以閒置名額預先渲染推薦的字體搭配（設計頁第一次預覽就是快取命中）"""
+    # AI 回傳的 JSON 格式不一定完整，任何錯誤都不可影響對話回應
+    try:
+        letters = result["letters"]
+        designs = []
+        for font1, font2 in recommended_font_pairs(result):
+            try:
+                # 設計頁第一次預覽使用預設尺寸與墜頭位置；調整墜頭時仍可重用已快取的字母核心
+                params = extract_scad_params(
+                    {
+                        "letter1": letters["letter1"],
+                        "letter2": letters["letter2"],
+                        "font1": font1,
+                        "font2": font2,
+                    }
+                )
+                # 與設計頁預覽相同的選項（PREVIEW_QUALITY，預設 draft），快取 key 才相同
+                designs.append((params, extract_render_options({}, default_quality=PREVIEW_QUALITY)))
+            except UnknownFontError as e:
+                # AI 推薦了未安裝的字體：略過這組
+                logger.info(f"🔮 略過推薦字體: {e}")
+        speculative_renders.prefetch(designs)
+    except Exception as e:
+        logger.warning(f"⚠️ 推薦字體預先渲染失敗: {e}")
+
+
 @app.route("/api/ai-consultant", methods=["POST"])
 def chat():
     """
@@ -1941,6 +2509,7 @@ def chat():
                         result["conversationSummary"] = {}
 
                     logger.info("✅ 檢測到完整 JSON 推薦，對話完成")
+                    prefetch_recommended_fonts(result)
                 else:
                     logger.info("⚠️ JSON 但缺少推薦欄位，繼續對話")
                     is_json_response = False
@@ -0,0 +1,190 @@
+"""
+Font Index - 已安裝字體的記憶體索引（字體名稱預檢）
+OpenSCAD / fc-match 找不到字體時會靜默 fallback 到預設字體：
+渲染照樣花上數分鐘，做出來的卻是錯的字體。請求進來時先查索引，不存在的字體直接拒絕
+
+啟動時建立一次：
+- 優先解析 fc-list 的輸出（與 available-fonts.json 的來源相同："<檔案>: <家族>[,<別名>]:style=<樣式>"）
+- 沒有 fontconfig 時改讀字體目錄內 TTF / OTF 的 name table
+
+查詢只是 dict 查找；大小寫、空白、連字號不同的名稱會校正為已安裝的正式名稱
+"""
+import difflib
+import logging
+import os
+import re
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 沒有 fc-list 時掃描的字體目錄（冒號分隔）
+FONT_DIRS = os.environ.get("FONT_DIRS", "/usr/share/fonts:/usr/local/share/fonts")
+FONT_FILE_EXTENSIONS = (".ttf", ".otf")
+
+# 拒絕時附上的相近字體數量
+SUGGESTION_COUNT = 3
+
+
+class UnknownFontError(ValueError):
+    """字體未安裝（OpenSCAD 會 fallback 到預設字體）"""
+
+    def __init__(self, font_name, suggestions=()):
+        message = f"字體未安裝: {font_name}"
+        if suggestions:
+            message += f"（您是否要找: {', '.join(suggestions)}）"
+        super().__init__(message)
+        self.font_name = font_name
+        self.suggestions = list(suggestions)
+
+
+def normalize_family(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _parse_fc_list_line(line):
+    """
+    解析一行 fc-list 輸出
+
+    Returns:
+        tuple: (檔案路徑, [家族名稱...], 樣式) 或 None
+    """
+    font_file, sep, rest = line.partition(": ")
+    if not sep:
+        return None
+    families, _, style = rest.partition(":style=")
+    names = [name.strip() for name in families.split(",") if name.strip()]
+    if not names:
+        return None
+    return font_file.strip(), names, style.split(",")[0].strip()
+
+
+def _scan_font_files():
+    """沒有 fontconfig 時讀取字體檔的 name table（家族名稱 nameID 16 / 1，樣式 17 / 2）"""
+    from fontTools.ttLib import TTFont
+
+    for font_dir in FONT_DIRS.split(":"):
+        for root, _, filenames in os.walk(font_dir):
+            for filename in filenames:
+                if not filename.lower().endswith(FONT_FILE_EXTENSIONS):
+                    continue
+                font_file = os.path.join(root, filename)
+                try:
+                    font = TTFont(font_file, lazy=True)
+                    name_table = font["name"]
+                    family = name_table.getDebugName(16) or name_table.getDebugName(1)
+                    style = name_table.getDebugName(17) or name_table.getDebugName(2) or ""
+                    font.close()
+                except Exception as e:
+                    logger.warning(f"⚠️ 無法讀取字體檔 {font_file}: {e}")
+                    continue
+                if family:
+                    yield font_file, [family], style
+
+
+class FontIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = None  # normalize_family(名稱) -> 已安裝的家族名稱
+        self._files = {}  # 家族名稱 -> 字體檔（優先 Regular）
+        self.source = None
+
+    def _entries(self):
+        try:
+            result = subprocess.run(["fc-list"], capture_output=True, text=True, timeout=30)
+            if result.returncode == 0 and result.stdout.strip():
+                self.source = "fc-list"
+                return [
+                    entry
+                    for entry in map(_parse_fc_list_line, result.stdout.splitlines())
+                    if entry
+                ]
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"⚠️ 無法執行 fc-list: {e}")
+
+        self.source = "font-files"
+        return list(_scan_font_files())
+
+    def build(self):
+        """建立索引（啟動時呼叫；之後的查詢不再執行外部程式）"""
+        families = {}
+        files = {}
+        for font_file, names, style in self._entries():
+            # 別名（例如可變字體的 "Advent Pro Thin"）也是 fontconfig 認得的家族名稱，各自保留
+            for name in names:
+                families.setdefault(normalize_family(name), name)
+                if name not in files or style.lower() in ("regular", "book"):
+                    files[name] = font_file
+
+        with self._lock:
+            self._families = families
+            self._files = files
+        logger.info(f"🔤 字體索引: {len(files)} 個家族（來源: {self.source}）")
+        return self
+
+    def _ensure_built(self):
+        if self._families is None:
+            with self._lock:
+                built = self._families is not None
+            if not built:
+                self.build()
+
+    @property
+    def available(self):
+        """索引是否可用（沒有任何字體時不做預檢，避免擋下所有請求）"""
+        self._ensure_built()
+        return bool(self._families)
+
+    def resolve(self, font_name):
+        """
+        已安裝的正式家族名稱
+
+        "Name:style=Bold" 形式只檢查家族部分，樣式原樣保留
+
+        Raises:
+            UnknownFontError: 字體未安裝
+        """
+        self._ensure_built()
+        family, sep, style = str(font_name).partition(":")
+        canonical = self._families.get(normalize_family(family))
+        if canonical is None:
+            suggestions = difflib.get_close_matches(
+                family, list(self._files), n=SUGGESTION_COUNT, cutoff=0.6
+            )
+            raise UnknownFontError(font_name, suggestions)
+        return canonical + sep + style
+
+    def font_file(self, font_name):
+        """家族名稱對應的字體檔（不在索引中時為 None）"""
+        self._ensure_built()
+        canonical = self._families.get(normalize_family(str(font_name).partition(":")[0]))
+        return self._files.get(canonical)
+
+    def status(self):
+        self._ensure_built()
+        return {"families": len(self._files), "source": self.source}
+
+
+font_index = FontIndex()
+
+
+def preflight_fonts(data, keys=("font1", "font2")):
+    """
+    檢查並校正 data 內的字體名稱（原地修改）
+
+    Returns:
+        dict: data（字體名稱已校正為正式名稱）
+
+    Raises:
+        UnknownFontError: 任一字體未安裝
+    """
+    if not font_index.available:
+        return data
+    for key in keys:
+        if key not in data:
+            continue
+        resolved = font_index.resolve(data[key])
+        if resolved != data[key]:
+            logger.info(f"🔤 字體名稱校正: {data[key]} → {resolved}")
+            data[key] = resolved
+    return data
@@ -0,0 +1,223 @@
+"""
+Glyph Cache - 預先擠出的字母柱體 STL 快取
+每個 (字體, 字母, 高度, 解析度) 只需由字形輪廓（glyph_outline，攤平 + 簡化）經 duet.scad
+的 prism 模式擠出一次，之後交集核心直接 import() 柱體，OpenSCAD 只做布林交集
+
+柱體的 key 與輪廓都取自它所代替的交集核心的解析度設定（production 級距，quality_tiers），
+render_benchmark.py --tune 更新級距後舊柱體自然不再命中，不會與核心的解析度不一致
+
+交集核心預設以標準高度渲染後等比縮放（stl_renderer.CANONICAL_CORE_CACHE），只需要標準高度的柱體
+（每個 production 級距一組）；關閉標準核心或 STL_CANONICAL_MAX_SIZE 以上的尺寸才會用到實際尺寸的柱體
+
+CLI（在 Docker image 內預先填滿快取）：
+    python glyph_cache.py --dockerfile Dockerfile
+    python glyph_cache.py --dockerfile Dockerfile --sizes 45 50   # 直接渲染的大尺寸
+"""
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from glyph_outline import load_glyph_outline, glyph_source_tag, simplify_outline_mm
+from openscad_runner import get_openscad_version, get_font_fingerprint, run_openscad
+from render_pool import render_pool, RENDER_SLOTS
+from scad_generator import (
+    DUET_LIBRARY_PATH,
+    get_library_identity,
+    format_scad_defines,
+    prism_library_defines,
+)
+from stl_cache import make_cache_key
+from quality_tiers import production_tier_sizes
+
+logger = logging.getLogger(__name__)
+
+GLYPH_CACHE_DIR = os.environ.get("GLYPH_CACHE_DIR", "glyph_cache")
+USE_GLYPH_PRISMS = os.environ.get("STL_GLYPH_PRISMS", "true").lower() == "true"
+
+DEFAULT_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def glyph_prism_key(char, font, size, quality):
+    """
+    柱體快取 key：字體、字母、高度、解析度設定 + 模型庫版本 + OpenSCAD 版本 + 字體檔指紋 + 字形來源
+
+    Args:
+        quality: 柱體所代替的交集核心的解析度設定（quality_tiers）
+    """
+    return make_cache_key(
+        {
+            "kind": "glyph_prism",
+            "char": char,
+            "font": font,
+            "size": float(size),
+            "quality": quality,
+            "script": get_library_identity(),
+            "openscad": get_openscad_version(),
+            "font_file": get_font_fingerprint(font),
+            "glyph_source": glyph_source_tag(
+                load_glyph_outline(font, char, quality["curve_tolerance_em"])
+            ),
+        }
+    )
+
+
+def glyph_prism_path(char, font, size, quality):
+    return os.path.join(GLYPH_CACHE_DIR, f"{glyph_prism_key(char, font, size, quality)}.stl")
+
+
+def lookup_glyph_prism(char, font, size, quality):
+    """查詢柱體快取，未命中返回 None（執行期不會自動渲染）"""
+    if not USE_GLYPH_PRISMS:
+        return None
+    path = glyph_prism_path(char, font, size, quality)
+    return os.path.abspath(path) if os.path.exists(path) else None
+
+
+def _prism_outline(char, font, size, quality):
+    """與交集核心相同的字形輪廓：依解析度攤平，再依 mm 容許誤差簡化"""
+    outline = load_glyph_outline(font, char, quality["curve_tolerance_em"])
+    if outline is None:
+        return None
+    return simplify_outline_mm(outline, quality["simplify_tolerance_mm"], size)[0]
+
+
+def build_glyph_prism(char, font, size, quality, force=False):
+    """
+    渲染單一字母柱體並寫入快取
+
+    Returns:
+        str: 柱體 STL 路徑；渲染失敗返回 None
+    """
+    os.makedirs(GLYPH_CACHE_DIR, exist_ok=True)
+    final_path = glyph_prism_path(char, font, size, quality)
+    if os.path.exists(final_path) and not force:
+        return final_path
+
+    defines = prism_library_defines(
+        char, font, size, _prism_outline(char, font, size, quality), quality=quality
+    )
+    fd, stl_path = tempfile.mkstemp(suffix=".stl")
+    os.close(fd)
+
+    # 與線上渲染共用名額，預先填快取時不會搶走結帳流程的 CPU
+    with render_pool.slot(timeout=None, reject_when_full=False):
+        result = run_openscad(DUET_LIBRARY_PATH, stl_path, defines=format_scad_defines(defines))
+
+    if result.returncode != 0 or os.path.getsize(stl_path) == 0:
+        logger.error(f"❌ 字母柱體渲染失敗: {font} {char} {size}mm\n{result.stderr}")
+        os.unlink(stl_path)
+        return None
+
+    tmp_path = f"{final_path}.{os.getpid()}.tmp"
+    with open(stl_path, "rb") as src, open(tmp_path, "wb") as dst:
+        dst.write(src.read())
+    os.replace(tmp_path, final_path)
+    os.unlink(stl_path)
+    return final_path
+
+
+def dockerfile_font_families(dockerfile_path):
+    """
+    從 Dockerfile 的 sparse-checkout 清單（ofl/<目錄>）取得字體家族名稱
+
+    Google Fonts 目錄名稱 = 家族名稱去空白轉小寫（例如 cormorantgaramond），
+    以 fc-list 的已安裝家族名稱反查
+    """
+    with open(dockerfile_path, "r", encoding="utf-8") as f:
+        font_dirs = re.findall(r"\bofl/([a-z0-9]+)", f.read())
+
+    result = subprocess.run(
+        ["fc-list", ":", "family"], capture_output=True, text=True, timeout=30
+    )
+    installed = {}
+    for line in result.stdout.splitlines():
+        # 一個字體可能有多個家族別名（逗號分隔）
+        for family in line.split(","):
+            family = family.strip()
+            if family:
+                installed.setdefault(re.sub(r"[^a-z0-9]", "", family.lower()), family)
+
+    families = []
+    for font_dir in dict.fromkeys(font_dirs):
+        family = installed.get(font_dir)
+        if family:
+            families.append(family)
+        else:
+            logger.warning(f"⚠️ 找不到已安裝字體: ofl/{font_dir}")
+    return families
+
+
+def fill_glyph_cache(fonts, chars=DEFAULT_CHARS, sizes=None, workers=RENDER_SLOTS, force=False):
+    """
+    批次填滿柱體快取
+
+    Args:
+        sizes: 請求尺寸（None = 每個 production 級距的代表尺寸）；
+            實際渲染的高度與解析度由 stl_renderer.glyph_prism_targets 決定，與線上查詢一致
+
+    Returns:
+        tuple: (成功數, 失敗數)
+    """
+    # stl_renderer 匯入本模組，延後匯入避免循環
+    from stl_renderer import glyph_prism_targets
+
+    targets = glyph_prism_targets(sizes or production_tier_sizes())
+    tasks = [
+        (char, font, size, quality)
+        for font in fonts
+        for char in chars
+        for size, quality in targets
+    ]
+    logger.info(
+        f"🔤 準備渲染 {len(tasks)} 個字母柱體（{len(fonts)} 種字體，{len(targets)} 組高度 / 解析度）"
+    )
+
+    built = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(build_glyph_prism, char, font, size, quality, force): (char, font, size)
+            for char, font, size, quality in tasks
+        }
+        for index, future in enumerate(as_completed(futures), 1):
+            if future.result():
+                built += 1
+            else:
+                failed += 1
+            if index % 100 == 0:
+                logger.info(f"🔤 進度 {index}/{len(tasks)}")
+
+    logger.info(f"✅ 字母柱體快取完成：成功 {built}，失敗 {failed}")
+    return built, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預先渲染 DUET 字母柱體快取")
+    parser.add_argument("--dockerfile", default="Dockerfile", help="讀取字體清單的 Dockerfile")
+    parser.add_argument("--fonts", nargs="*", help="指定字體家族（預設使用 Dockerfile 清單）")
+    parser.add_argument("--chars", default=DEFAULT_CHARS, help="要渲染的字母")
+    parser.add_argument(
+        "--sizes", nargs="*", type=float, help="請求尺寸（預設為每個 production 級距的代表尺寸）"
+    )
+    parser.add_argument("--workers", type=int, default=RENDER_SLOTS)
+    parser.add_argument("--force", action="store_true", help="忽略既有快取重新渲染")
+    args = parser.parse_args(argv)
+
+    fonts = args.fonts or dockerfile_font_families(args.dockerfile)
+    if not fonts:
+        logger.error("❌ 沒有可渲染的字體")
+        return 1
+
+    _, failed = fill_glyph_cache(fonts, args.chars, args.sizes, args.workers, args.force)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Glyph Metrics - 每個字體 / 字元的前進寬度與墨水範圍索引
+由 glyph_outline 的攤平輪廓計算，SCAD 以此產生精確的 scale() 與緊貼的擠出深度，
+取代 resize() 與固定的 size * 5 深度
+
+CLI（在 Docker image 內預先建立索引）：
+    python glyph_metrics.py --dockerfile Dockerfile
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from collections import namedtuple
+
+from glyph_outline import (
+    GLYPH_OUTLINE_DIR,
+    OUTLINE_FORMAT_VERSION,
+    DEFAULT_CURVE_TOLERANCE_EM,
+    load_glyph_outline,
+)
+from openscad_runner import get_font_fingerprint
+
+logger = logging.getLogger(__name__)
+
+GLYPH_METRICS_PATH = os.environ.get(
+    "GLYPH_METRICS_PATH", os.path.join(GLYPH_OUTLINE_DIR, "glyph_metrics.json")
+)
+
+# 索引版本：輪廓格式或攤平容許誤差改變時整份索引失效
+METRICS_INDEX_VERSION = f"{OUTLINE_FORMAT_VERSION}:{DEFAULT_CURVE_TOLERANCE_EM}"
+
+
+class GlyphMetrics(namedtuple("GlyphMetrics", "advance xmin ymin xmax ymax")):
+    """單一字形的度量（字體單位）"""
+
+    __slots__ = ()
+
+    def scale_for_height(self, target_h):
+        """墨水高度縮放到 target_h 的比例（等同 resize([0, target_h, 0], auto=true)）"""
+        return target_h / (self.ymax - self.ymin)
+
+    def half_width(self, target_h):
+        """以前進寬度置中（halign="center"）後，墨水離中心最遠的水平距離 (mm)"""
+        center = self.advance / 2.0
+        scale = self.scale_for_height(target_h)
+        return max(abs(self.xmin - center), abs(self.xmax - center)) * scale
+
+
+_index_lock = threading.Lock()
+_index = None
+
+
+def _index_key(font, char):
+    # 以字體檔指紋為 key，字體更新後舊度量自動失效
+    return f"{get_font_fingerprint(font)}:{ord(char)}"
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(GLYPH_METRICS_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            _index = data["glyphs"] if data.get("version") == METRICS_INDEX_VERSION else {}
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            _index = {}
+    return _index
+
+
+def save_index():
+    """將目前的索引寫回磁碟（原子替換）"""
+    with _index_lock:
+        data = {"version": METRICS_INDEX_VERSION, "glyphs": dict(_load_index())}
+
+    os.makedirs(os.path.dirname(GLYPH_METRICS_PATH) or ".", exist_ok=True)
+    tmp_path = f"{GLYPH_METRICS_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, GLYPH_METRICS_PATH)
+
+
+def get_glyph_metrics(font, char):
+    """
+    查詢字形度量（索引未命中時由字形輪廓計算並記在記憶體中）
+
+    Returns:
+        GlyphMetrics；字體無法解析或沒有此字元時返回 None
+    """
+    key = _index_key(font, char)
+    with _index_lock:
+        cached = _load_index().get(key)
+    if cached:
+        return GlyphMetrics(*cached)
+
+    outline = load_glyph_outline(font, char)
+    if outline is None:
+        return None
+
+    metrics = GlyphMetrics(outline.advance, *outline.bbox)
+    with _index_lock:
+        _load_index()[key] = list(metrics)
+    return metrics
+
+
+def build_metrics_index(fonts, chars):
+    """
+    批次建立索引並寫入磁碟
+
+    Returns:
+        tuple: (成功數, 失敗數)
+    """
+    built = failed = 0
+    for font in fonts:
+        for char in chars:
+            if get_glyph_metrics(font, char):
+                built += 1
+            else:
+                failed += 1
+    save_index()
+    logger.info(f"✅ 字形度量索引完成：成功 {built}，失敗 {failed}")
+    return built, failed
+
+
+def main(argv=None):
+    # 延遲匯入：glyph_cache 依賴 render_pool，只有 CLI 需要
+    from glyph_cache import DEFAULT_CHARS, dockerfile_font_families
+
+    parser = argparse.ArgumentParser(description="建立 DUET 字形度量索引")
+    parser.add_argument("--dockerfile", default="Dockerfile", help="讀取字體清單的 Dockerfile")
+    parser.add_argument("--fonts", nargs="*", help="指定字體家族（預設使用 Dockerfile 清單）")
+    parser.add_argument("--chars", default=DEFAULT_CHARS, help="要建立索引的字母")
+    args = parser.parse_args(argv)
+
+    fonts = args.fonts or dockerfile_font_families(args.dockerfile)
+    if not fonts:
+        logger.error("❌ 沒有可建立索引的字體")
+        return 1
+
+    _, failed = build_metrics_index(fonts, args.chars)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""
+Glyph Outline - 從已安裝的 TTF 直接取出字形輪廓
+字形曲線由我們自己依容許誤差攤平成折線（float32 NumPy 陣列），
+SCAD 改用 polygon(points, paths) 常值，不再經過 OpenSCAD 的字體查找與 fallback；
+手寫 / 草書字體的密集輪廓可再以 Douglas–Peucker 依 mm 容許誤差簡化
+
+輪廓以字體單位（font units，y 軸向上）儲存，與尺寸無關；
+外輪廓統一為逆時針（面積為正）、內洞為順時針
+"""
+import functools
+import hashlib
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from fontTools.pens.basePen import BasePen
+from fontTools.ttLib import TTFont
+
+from openscad_runner import resolve_font_file
+
+logger = logging.getLogger(__name__)
+
+GLYPH_OUTLINE_DIR = os.environ.get("GLYPH_OUTLINE_DIR", "glyph_outlines")
+USE_GLYPH_OUTLINES = os.environ.get("STL_GLYPH_OUTLINES", "true").lower() == "true"
+
+# 曲線攤平容許誤差（以 em 的比例表示；15mm 字高約對應 0.02mm）
+DEFAULT_CURVE_TOLERANCE_EM = float(os.environ.get("GLYPH_CURVE_TOLERANCE_EM", "0.001"))
+
+# 輪廓格式版本（攤平演算法改變時遞增）
+OUTLINE_FORMAT_VERSION = 1
+
+
+class GlyphOutline:
+    """
+    單一字形的攤平輪廓
+
+    contours: list of float32 (n, 2) 陣列（不重複起點）
+    advance: 水平前進寬度（OpenSCAD halign="center" 以此置中）
+    tolerance_em: 攤平時使用的容許誤差
+    """
+
+    def __init__(self, contours, advance, units_per_em, tolerance_em=DEFAULT_CURVE_TOLERANCE_EM):
+        self.contours = contours
+        self.advance = float(advance)
+        self.units_per_em = int(units_per_em)
+        self.tolerance_em = float(tolerance_em)
+
+    @property
+    def vertex_count(self):
+        return sum(len(c) for c in self.contours)
+
+    @property
+    def bbox(self):
+        """攤平後的墨水範圍 (xmin, ymin, xmax, ymax)；空字形返回 None"""
+        if not self.contours:
+            return None
+        points = np.concatenate(self.contours)
+        xmin, ymin = points.min(axis=0)
+        xmax, ymax = points.max(axis=0)
+        return float(xmin), float(ymin), float(xmax), float(ymax)
+
+    def outer_contours(self):
+        return [c for c in self.contours if signed_area(c) > 0]
+
+    def hole_contours(self):
+        return [c for c in self.contours if signed_area(c) <= 0]
+
+
+def signed_area(contour):
+    """多邊形有號面積（逆時針為正）"""
+    x = contour[:, 0].astype(np.float64)
+    y = contour[:, 1].astype(np.float64)
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _point_segment_distance(points, a, b):
+    """點到線段的距離（逐列向量化）"""
+    ab = b - a
+    length_sq = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", points - a, ab) / np.where(length_sq > 0, length_sq, 1.0)
+    projection = a + np.clip(t, 0.0, 1.0)[:, None] * ab
+    return np.linalg.norm(points - projection, axis=1)
+
+
+def simplify_contour(contour, tolerance):
+    """
+    封閉輪廓的 Douglas–Peucker 簡化（所有待處理線段每輪一起向量化計算）
+
+    起點、離起點最遠的點與四個極值點（bbox）固定保留，簡化後墨水範圍不變，
+    resize 對齊與緊貼深度都不受影響
+
+    Returns:
+        tuple: (簡化後的 float32 輪廓, 被移除的點到簡化線段的最大距離)
+    """
+    n = len(contour)
+    if n <= 4 or tolerance <= 0:
+        return contour, 0.0
+
+    points = np.concatenate([contour, contour[:1]]).astype(np.float64)
+    anchors = {
+        0,
+        n,
+        int(np.argmax(np.linalg.norm(points[:n] - points[0], axis=1))),
+        int(np.argmin(contour[:, 0])),
+        int(np.argmax(contour[:, 0])),
+        int(np.argmin(contour[:, 1])),
+        int(np.argmax(contour[:, 1])),
+    }
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[list(anchors)] = True
+
+    anchor_idx = np.flatnonzero(keep)
+    starts, ends = anchor_idx[:-1], anchor_idx[1:]
+    max_deviation = 0.0
+
+    while True:
+        counts = ends - starts - 1
+        active = counts > 0
+        starts, ends, counts = starts[active], ends[active], counts[active]
+        if len(starts) == 0:
+            break
+
+        # 展開每條線段的內部點索引
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        segment = np.repeat(np.arange(len(starts)), counts)
+        inner = starts[segment] + 1 + (np.arange(counts.sum()) - offsets[segment])
+
+        distance = _point_segment_distance(
+            points[inner], points[starts[segment]], points[ends[segment]]
+        )
+        segment_max = np.maximum.reduceat(distance, offsets)
+
+        # 每條線段距離最大的點（同值時取第一個）
+        is_max = distance == segment_max[segment]
+        first = np.unique(segment[is_max], return_index=True)[1]
+        split_at = inner[np.flatnonzero(is_max)[first]]
+
+        split = segment_max > tolerance
+        if np.any(~split):
+            max_deviation = max(max_deviation, float(segment_max[~split].max()))
+
+        keep[split_at[split]] = True
+        starts = np.concatenate([starts[split], split_at[split]])
+        ends = np.concatenate([split_at[split], ends[split]])
+
+    simplified = points[:n][keep[:n]].astype(np.float32)
+    if len(simplified) < 3:
+        return contour, 0.0
+    return simplified, max_deviation
+
+
+def simplify_outline(outline, tolerance):
+    """
+    簡化字形的所有輪廓
+
+    Args:
+        tolerance: 容許誤差（字體單位）
+
+    Returns:
+        tuple: (新的 GlyphOutline, 移除的頂點數, 最大誤差（字體單位）)
+    """
+    contours = []
+    max_deviation = 0.0
+    for contour in outline.contours:
+        simplified, deviation = simplify_contour(contour, tolerance)
+        contours.append(simplified)
+        max_deviation = max(max_deviation, deviation)
+
+    simplified_outline = GlyphOutline(
+        contours, outline.advance, outline.units_per_em, outline.tolerance_em
+    )
+    removed = outline.vertex_count - simplified_outline.vertex_count
+    return simplified_outline, removed, max_deviation
+
+
+def simplify_outline_mm(outline, tolerance_mm, target_h):
+    """
+    以 mm 為單位的容許誤差簡化（依墨水高度縮放到 target_h 換算成字體單位）
+
+    Returns:
+        tuple: (新的 GlyphOutline, 移除的頂點數, 最大誤差 mm)
+    """
+    xmin, ymin, xmax, ymax = outline.bbox
+    scale = target_h / (ymax - ymin)
+    simplified, removed, max_deviation = simplify_outline(outline, tolerance_mm / scale)
+    return simplified, removed, max_deviation * scale
+
+
+class FlatteningPen(BasePen):
+    """將 TrueType / CFF 曲線依容許誤差攤平成折線的 pen"""
+
+    def __init__(self, glyph_set, tolerance):
+        super().__init__(glyph_set)
+        self.tolerance = tolerance
+        self.contours = []
+        self._current = []
+
+    def _segments(self, second_diff):
+        # 均勻參數化的弦高誤差 ≤ |B''|max / (8 n²)
+        return max(1, int(math.ceil(math.sqrt(second_diff / (8.0 * self.tolerance)))))
+
+    def _moveTo(self, pt):
+        self._current = [pt]
+
+    def _lineTo(self, pt):
+        self._current.append(pt)
+
+    def _qCurveToOne(self, pt1, pt2):
+        p0 = np.array(self._getCurrentPoint(), dtype=np.float64)
+        p1 = np.array(pt1, dtype=np.float64)
+        p2 = np.array(pt2, dtype=np.float64)
+        n = self._segments(2.0 * np.linalg.norm(p0 - 2 * p1 + p2))
+        t = np.linspace(0.0, 1.0, n + 1)[1:, None]
+        points = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+        self._current.extend(map(tuple, points))
+
+    def _curveToOne(self, pt1, pt2, pt3):
+        p0 = np.array(self._getCurrentPoint(), dtype=np.float64)
+        p1 = np.array(pt1, dtype=np.float64)
+        p2 = np.array(pt2, dtype=np.float64)
+        p3 = np.array(pt3, dtype=np.float64)
+        second_diff = 6.0 * max(
+            np.linalg.norm(p0 - 2 * p1 + p2), np.linalg.norm(p1 - 2 * p2 + p3)
+        )
+        n = self._segments(second_diff)
+        t = np.linspace(0.0, 1.0, n + 1)[1:, None]
+        points = (
+            (1 - t) ** 3 * p0
+            + 3 * (1 - t) ** 2 * t * p1
+            + 3 * (1 - t) * t ** 2 * p2
+            + t ** 3 * p3
+        )
+        self._current.extend(map(tuple, points))
+
+    def _closePath(self):
+        self._finish_contour()
+
+    def _endPath(self):
+        self._finish_contour()
+
+    def _finish_contour(self):
+        points = np.array(self._current, dtype=np.float32)
+        self._current = []
+        if len(points) > 1 and np.allclose(points[0], points[-1]):
+            points = points[:-1]
+        if len(points) >= 3:
+            self.contours.append(points)
+
+
+def _normalize_orientation(contours):
+    """
+    統一方向：外輪廓逆時針、內洞順時針
+
+    TrueType 外輪廓為順時針、CFF 為逆時針，以面積最大的輪廓（必為外輪廓）判斷
+    """
+    if not contours:
+        return contours
+    areas = [signed_area(c) for c in contours]
+    largest = max(range(len(areas)), key=lambda i: abs(areas[i]))
+    if areas[largest] < 0:
+        return [c[::-1].copy() for c in contours]
+    return contours
+
+
+# lazy 載入的 TTFont 在第一次讀取表格時才解析，不能由多個執行緒同時讀取
+_font_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=32)
+def _open_font(font_file):
+    """TTF 只讀取一次（每個 process）"""
+    return TTFont(font_file, lazy=True)
+
+
+def _outline_cache_path(font_file, char, tolerance_em):
+    stat = os.stat(font_file)
+    raw = f"{OUTLINE_FORMAT_VERSION}|{font_file}|{stat.st_size}|{int(stat.st_mtime)}|{ord(char)}|{tolerance_em}"
+    key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return os.path.join(GLYPH_OUTLINE_DIR, f"{key}.npz")
+
+
+def _save_outline(path, outline):
+    os.makedirs(GLYPH_OUTLINE_DIR, exist_ok=True)
+    lengths = np.array([len(c) for c in outline.contours], dtype=np.int32)
+    points = (
+        np.concatenate(outline.contours).astype(np.float32)
+        if outline.contours
+        else np.zeros((0, 2), dtype=np.float32)
+    )
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        points=points,
+        lengths=lengths,
+        metrics=np.array([outline.advance, outline.units_per_em], dtype=np.float64),
+    )
+    os.replace(tmp_path, path)
+
+
+def _load_outline(path, tolerance_em):
+    with np.load(path) as data:
+        points = data["points"]
+        lengths = data["lengths"]
+        advance, units_per_em = data["metrics"]
+    contours = np.split(points, np.cumsum(lengths)[:-1]) if len(lengths) else []
+    return GlyphOutline(list(contours), advance, units_per_em, tolerance_em)
+
+
+def extract_glyph_outline(font_file, char, tolerance_em=DEFAULT_CURVE_TOLERANCE_EM):
+    """
+    從字體檔取出單一字元的攤平輪廓（不經過磁碟快取）
+
+    Returns:
+        GlyphOutline；字體沒有此字元時返回 None
+    """
+    with _font_lock:
+        font = _open_font(font_file)
+        glyph_name = font.getBestCmap().get(ord(char))
+        if glyph_name is None:
+            return None
+
+        units_per_em = font["head"].unitsPerEm
+        glyph_set = font.getGlyphSet()
+        pen = FlatteningPen(glyph_set, tolerance_em * units_per_em)
+        glyph_set[glyph_name].draw(pen)
+        width = glyph_set[glyph_name].width
+
+    contours = _normalize_orientation(pen.contours)
+    return GlyphOutline(contours, width, units_per_em, tolerance_em)
+
+
+def glyph_source_tag(outline):
+    """快取 key 用的字形來源（輪廓格式或容許誤差改變時 key 跟著改變）"""
+    if outline is None:
+        return "text"
+    return f"outline:{OUTLINE_FORMAT_VERSION}:{outline.tolerance_em}"
+
+
+def load_glyph_outline(font_name, char, tolerance_em=DEFAULT_CURVE_TOLERANCE_EM):
+    """
+    取得字形輪廓（優先讀取 .npz 快取）
+
+    Returns:
+        GlyphOutline；停用、找不到字體檔或字元時返回 None（呼叫端改用 text()）
+    """
+    if not USE_GLYPH_OUTLINES:
+        return None
+
+    font_file = resolve_font_file(font_name)
+    if not font_file:
+        return None
+
+    try:
+        cache_path = _outline_cache_path(font_file, char, tolerance_em)
+        if os.path.exists(cache_path):
+            outline = _load_outline(cache_path, tolerance_em)
+            return outline if outline.contours else None
+
+        outline = extract_glyph_outline(font_file, char, tolerance_em)
+        if outline is None or not outline.contours:
+            logger.warning(f"⚠️ 字體 {font_name} 沒有字元 {char!r}")
+            return None
+
+        _save_outline(cache_path, outline)
+        logger.info(f"🔤 字形輪廓已快取: {font_name} {char}（{outline.vertex_count} 個頂點）")
+        return outline
+    except Exception as e:
+        logger.warning(f"⚠️ 讀取字形輪廓失敗 {font_name} {char}: {e}")
+        return None
@@ -0,0 +1,290 @@
+"""
+OpenSCAD Runner - 呼叫 OpenSCAD CLI 的共用工具
+集中處理：版本 / 幾何後端查詢、字體檔解析與指紋、執行 openscad 輸出 binary STL
+
+openscad 在獨立的 process group 中執行，取消或逾時時整組一起結束（killpg），
+不會留下繼續佔用 CPU 的子進程；結束時以 wait4 回收，取得該次渲染的 peak RSS；
+啟動後立即套用 render_scheduling 的 CPU 排程設定
+"""
+import functools
+import hashlib
+import logging
+import os
+import resource
+import shlex
+import signal
+import subprocess
+import tempfile
+import time
+
+from font_index import font_index, normalize_family
+from render_scheduling import apply_render_scheduling
+
+logger = logging.getLogger(__name__)
+
+OPENSCAD_BIN = os.environ.get("OPENSCAD_BIN", "openscad")
+OPENSCAD_TIMEOUT = 180
+
+# 檢查取消條件的間隔，以及 SIGTERM 後等待結束的秒數（之後改送 SIGKILL）
+# 剛啟動時以較短間隔檢查是否已結束，避免便宜的墜頭渲染多等一個完整間隔
+CANCEL_POLL_INTERVAL = 0.25
+FIRST_POLL_INTERVAL = 0.02
+KILL_GRACE_SECONDS = 2
+
+# 幾何後端：CGAL（所有版本）、Manifold（較新的 nightly，布林運算快很多）
+BACKEND_CGAL = "cgal"
+BACKEND_MANIFOLD = "manifold"
+
+
+class RenderCancelled(Exception):
+    """渲染被取消（用戶端斷線、超過期限、被同一 session 的新請求取代）"""
+
+    def __init__(self, reason):
+        super().__init__(f"Render cancelled: {reason}")
+        self.reason = reason
+
+
+@functools.lru_cache(maxsize=1)
+def get_openscad_version():
+    """
+    取得 OpenSCAD 版本字串（例如 "OpenSCAD version 2021.01"）
+
+    openscad --version 會輸出到 stderr；查詢失敗時回傳 "unknown"
+    """
+    try:
+        result = subprocess.run(
+            [OPENSCAD_BIN, "--version"], capture_output=True, text=True, timeout=15
+        )
+        version = (result.stderr or result.stdout).strip()
+        return version or "unknown"
+    except Exception as e:
+        logger.warning(f"⚠️ 無法取得 OpenSCAD 版本: {e}")
+        return "unknown"
+
+
+@functools.lru_cache(maxsize=1)
+def get_openscad_capabilities():
+    """
+    探測 openscad 支援的幾何後端（解析 --help 輸出）
+
+    - 2024 之後的 nightly：--backend Manifold
+    - 2023 的 nightly：實驗功能 --enable=manifold
+
+    Returns:
+        dict: {"backends": [...], "manifold_args": [...]}
+    """
+    capabilities = {"backends": [BACKEND_CGAL], "manifold_args": []}
+    try:
+        result = subprocess.run(
+            [OPENSCAD_BIN, "--help"], capture_output=True, text=True, timeout=15
+        )
+        help_text = (result.stderr + result.stdout).lower()
+    except Exception as e:
+        logger.warning(f"⚠️ 無法探測 OpenSCAD 功能: {e}")
+        return capabilities
+
+    if "--backend" in help_text and "manifold" in help_text:
+        capabilities["manifold_args"] = ["--backend", "Manifold"]
+    elif "manifold" in help_text:
+        capabilities["manifold_args"] = ["--enable=manifold"]
+
+    if capabilities["manifold_args"]:
+        capabilities["backends"].append(BACKEND_MANIFOLD)
+    logger.info(f"🧩 OpenSCAD 幾何後端: {', '.join(capabilities['backends'])}")
+    return capabilities
+
+
+@functools.lru_cache(maxsize=256)
+def resolve_font_file(font_name):
+    """
+    以 fc-match 解析字體名稱對應的字體檔
+
+    fc-match 找不到時會回傳 fallback 字體（例如 DejaVu Sans），
+    解析到的家族名稱與要求不符時視為未安裝，返回 None；
+    未指定樣式的家族名稱直接查字體索引，不啟動 fc-match
+    """
+    if ":" not in font_name:
+        font_file = font_index.font_file(font_name)
+        if font_file and os.path.exists(font_file):
+            return font_file
+
+    try:
+        result = subprocess.run(
+            ["fc-match", "--format=%{file}\t%{family}", font_name],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+        font_file, _, families = result.stdout.strip().partition("\t")
+        if not font_file or not os.path.exists(font_file):
+            return None
+
+        wanted = normalize_family(font_name.split(":", 1)[0])
+        if wanted not in {normalize_family(f) for f in families.split(",")}:
+            logger.warning(f"⚠️ 字體 {font_name} 未安裝（fc-match fallback 到 {families}）")
+            return None
+        return font_file
+    except Exception as e:
+        logger.warning(f"⚠️ 無法解析字體檔 {font_name}: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=256)
+def get_font_fingerprint(font_name):
+    """
+    取得字體檔指紋：fc-match 實際解析到的檔案路徑 + 大小 + 修改時間
+
+    OpenSCAD 找不到字體時會自動 fallback，所以必須以「實際使用的檔案」為準，
+    字體更新或 fallback 改變時快取 key 也會跟著改變。
+    """
+    try:
+        result = subprocess.run(
+            ["fc-match", "--format=%{file}", font_name],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+        font_file = result.stdout.strip()
+        if not font_file or not os.path.exists(font_file):
+            return f"unresolved:{font_name}"
+
+        stat = os.stat(font_file)
+        raw = f"{font_file}|{stat.st_size}|{int(stat.st_mtime)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    except Exception as e:
+        logger.warning(f"⚠️ 無法取得字體指紋 {font_name}: {e}")
+        return f"unresolved:{font_name}"
+
+
+def build_openscad_command(scad_path, stl_path, backend=None, defines=None):
+    """
+    OpenSCAD 命令列
+
+    Args:
+        backend: BACKEND_MANIFOLD 時加上對應參數；其他值使用 openscad 預設（CGAL）
+        defines: "name=value" 清單，逐一以 -D 覆寫 scad_path 內的變數
+    """
+    cmd = [OPENSCAD_BIN, "-o", stl_path, "--export-format", "binstl"]
+    if backend == BACKEND_MANIFOLD:
+        cmd += get_openscad_capabilities()["manifold_args"]
+    for define in defines or ():
+        cmd += ["-D", define]
+    cmd.append(scad_path)
+    return cmd
+
+
+def format_openscad_command(cmd, max_arg_chars=120):
+    """可直接貼到 shell 重現渲染的命令列（過長的參數如字形輪廓會截斷）"""
+    parts = []
+    for arg in cmd:
+        if len(arg) > max_arg_chars:
+            arg = f"{arg[:max_arg_chars]}…({len(arg)} chars)"
+        parts.append(shlex.quote(arg))
+    return " ".join(parts)
+
+
+def _kill_process_group(proc):
+    """結束整個 process group：先 SIGTERM，寬限期後仍未結束改送 SIGKILL"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        proc.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    # 回收子進程
+    proc.wait()
+
+
+def _apply_memory_limit(pid, memory_limit_mb):
+    """設定子進程的 RLIMIT_AS（超過時 openscad 配置記憶體失敗而結束，不觸發容器 OOM）"""
+    if not memory_limit_mb:
+        return
+    limit = int(memory_limit_mb) * 1024 * 1024
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"⚠️ 無法設定 OpenSCAD 記憶體上限: {e}")
+
+
+def run_openscad(scad_path, stl_path, timeout=OPENSCAD_TIMEOUT, backend=None, defines=None,
+                 should_cancel=None, memory_limit_mb=None):
+    """
+    執行 OpenSCAD，將 scad_path 輸出為 binary STL
+
+    Args:
+        backend: BACKEND_MANIFOLD 時加上對應參數；其他值使用 openscad 預設（CGAL）
+        defines: -D 參數（見 build_openscad_command）
+        should_cancel: 每 CANCEL_POLL_INTERVAL 秒呼叫一次，返回取消原因（字串）時結束渲染
+        memory_limit_mb: 子進程的 RLIMIT_AS（MB），None = 不限制
+
+    Returns:
+        subprocess.CompletedProcess，另有 peak_rss_mb 屬性（子進程的最大常駐記憶體）
+
+    Raises:
+        RenderCancelled: should_cancel 返回取消原因
+        subprocess.TimeoutExpired: 超過 timeout 秒
+    """
+    cmd = build_openscad_command(scad_path, stl_path, backend, defines)
+
+    env = os.environ.copy()
+    env["DISPLAY"] = ":99"
+
+    # 輸出寫到暫存檔而非 pipe：不需要另外讀取 pipe，才能自己以 wait4 回收子進程
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=stdout,
+            stderr=stderr,
+            text=True,
+            env=env,
+            start_new_session=True,
+        )
+        _apply_memory_limit(proc.pid, memory_limit_mb)
+        # nice / CPU affinity / cgroup quota：背景渲染不拖慢付款回調等 web 請求
+        apply_render_scheduling(proc.pid)
+
+        rusage = _wait_openscad(proc, cmd, timeout, should_cancel)
+
+        stdout.seek(0)
+        stderr.seek(0)
+        result = subprocess.CompletedProcess(cmd, proc.returncode, stdout.read(), stderr.read())
+    # Linux 的 ru_maxrss 單位為 KB
+    result.peak_rss_mb = round(rusage.ru_maxrss / 1024, 1)
+    return result
+
+
+def _wait_openscad(proc, cmd, timeout, should_cancel):
+    """等待 openscad 結束並返回其 rusage；期間檢查取消與逾時"""
+    deadline = time.monotonic() + timeout
+    interval = FIRST_POLL_INTERVAL
+
+    try:
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                return rusage
+
+            time.sleep(interval)
+            interval = min(interval * 2, CANCEL_POLL_INTERVAL)
+
+            reason = should_cancel() if should_cancel else None
+            if reason:
+                logger.info(f"🛑 取消 OpenSCAD（pid {proc.pid}）: {reason}")
+                _kill_process_group(proc)
+                raise RenderCancelled(reason)
+
+            if time.monotonic() > deadline:
+                logger.warning(f"⏱️ OpenSCAD 超過 {timeout}s，結束 process group {proc.pid}")
+                _kill_process_group(proc)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        # 任何例外（含 worker 被中斷）都不留下 openscad 子進程
+        if proc.returncode is None:
+            _kill_process_group(proc)
+        raise
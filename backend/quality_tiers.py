@@ -0,0 +1,147 @@
+"""
+Quality Tiers - 具名渲染品質（draft / preview / production）
+draft 給設計頁即時預覽、preview 給確認畫面、production 給鑄造用檔案
+
+每個品質是一組解析度設定：
+    fn / fa / fs：OpenSCAD 的 $fn / $fa / $fs（text() 模式的字母曲線）
+    bail_fn / bail_tube_fn：墜頭 torus 的分段數
+    curve_tolerance_em：字形輪廓攤平容許誤差（glyph_outline）
+    simplify_tolerance_mm：攤平後再以 Douglas–Peucker 簡化的容許誤差（mm）
+
+production 的數值由 render_benchmark.py --tune 量測後寫入 quality_tiers.json，
+沒有量測結果時沿用原本的設定（$fn 64 / 56 / 48，墜頭 32 / 24）
+"""
+import json
+import logging
+import os
+
+from glyph_outline import DEFAULT_CURVE_TOLERANCE_EM
+from scad_generator import get_fn_for_size
+
+logger = logging.getLogger(__name__)
+
+QUALITY_DRAFT = "draft"
+QUALITY_PREVIEW = "preview"
+QUALITY_PRODUCTION = "production"
+QUALITY_CHOICES = (QUALITY_DRAFT, QUALITY_PREVIEW, QUALITY_PRODUCTION)
+
+QUALITY_TIERS_PATH = os.environ.get("QUALITY_TIERS_PATH", "quality_tiers.json")
+
+# OpenSCAD 預設的 $fa / $fs（$fn > 0 時不會用到）
+DEFAULT_FA = 12
+DEFAULT_FS = 2
+
+# production 的輪廓簡化容許誤差（mm）：遠小於鑄造後拋光的公差
+DEFAULT_SIMPLIFY_TOLERANCE_MM = float(os.environ.get("GLYPH_SIMPLIFY_TOLERANCE_MM", "0.01"))
+
+FIXED_TIERS = {
+    QUALITY_DRAFT: {
+        "fn": 16,
+        "fa": DEFAULT_FA,
+        "fs": DEFAULT_FS,
+        "bail_fn": 16,
+        "bail_tube_fn": 8,
+        "curve_tolerance_em": 0.01,
+        "simplify_tolerance_mm": 0.05,
+    },
+    QUALITY_PREVIEW: {
+        "fn": 32,
+        "fa": DEFAULT_FA,
+        "fs": DEFAULT_FS,
+        "bail_fn": 24,
+        "bail_tube_fn": 12,
+        "curve_tolerance_em": 0.003,
+        "simplify_tolerance_mm": 0.02,
+    },
+}
+
+# 量測前 production 的尺寸級距（get_fn_for_size：20 以下 / 25 以下 / 更大）各取一個代表尺寸
+LEGACY_TIER_SIZES = (20, 25, 30)
+
+_tuned_mtime = None
+_tuned_production = {}
+
+
+def legacy_production_settings(size):
+    """量測前的 production 設定（與原本的 get_fn_for_size 相同）"""
+    return {
+        "fn": get_fn_for_size(size),
+        "fa": DEFAULT_FA,
+        "fs": DEFAULT_FS,
+        "bail_fn": 32,
+        "bail_tube_fn": 24,
+        "curve_tolerance_em": DEFAULT_CURVE_TOLERANCE_EM,
+        "simplify_tolerance_mm": DEFAULT_SIMPLIFY_TOLERANCE_MM,
+    }
+
+
+def _load_tuned_production():
+    """讀取 benchmark 寫出的 quality_tiers.json（檔案更新時重新讀取）"""
+    global _tuned_mtime, _tuned_production
+    try:
+        mtime = os.path.getmtime(QUALITY_TIERS_PATH)
+    except OSError:
+        return {}
+
+    if mtime != _tuned_mtime:
+        try:
+            with open(QUALITY_TIERS_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            _tuned_production = {
+                float(size): settings
+                for size, settings in data.get(QUALITY_PRODUCTION, {}).items()
+            }
+            logger.info(f"🎚️ 已載入 production 品質設定（{len(_tuned_production)} 個尺寸）")
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 無法讀取品質設定 {QUALITY_TIERS_PATH}: {e}")
+            _tuned_production = {}
+        _tuned_mtime = mtime
+    return _tuned_production
+
+
+def normalize_quality(quality):
+    """
+    檢查品質名稱
+
+    Raises:
+        ValueError: 不是 draft / preview / production
+    """
+    quality = str(quality or QUALITY_PRODUCTION).lower()
+    if quality not in QUALITY_CHOICES:
+        raise ValueError(f"不支援的品質: {quality}")
+    return quality
+
+
+def get_quality_settings(quality, size):
+    """
+    取得指定品質與尺寸的解析度設定
+
+    production 使用量測結果中「不小於 size 的最小尺寸」的設定
+    （分段數相同時尺寸越小誤差越小，往上取較保守），超出量測範圍時取最大的尺寸
+
+    Returns:
+        dict: fn / fa / fs / bail_fn / bail_tube_fn / curve_tolerance_em / simplify_tolerance_mm
+    """
+    quality = normalize_quality(quality)
+    if quality in FIXED_TIERS:
+        return dict(FIXED_TIERS[quality])
+
+    tuned = _load_tuned_production()
+    if not tuned:
+        return legacy_production_settings(size)
+
+    sizes = sorted(tuned)
+    bucket = next((s for s in sizes if s >= float(size)), sizes[-1])
+    return {**legacy_production_settings(size), **tuned[bucket]}
+
+
+def production_tier_sizes():
+    """
+    production 每個解析度級距的代表尺寸（預先渲染 glyph_cache 柱體用）
+
+    有量測結果時為量測過的尺寸，否則為 get_fn_for_size 各級距的上限
+    """
+    tuned = _load_tuned_production()
+    if tuned:
+        return tuple(sorted(tuned))
+    return LEGACY_TIER_SIZES
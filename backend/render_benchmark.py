@@ -0,0 +1,327 @@
+"""
+Render Benchmark - 渲染時間量測與 production 品質調校
+
+比較模式：交集核心的渲染時間
+    legacy：text() + resize() + 固定 size * 5 擠出深度
+    tight：字形輪廓 polygon() + 精確 scale() + 依另一個字母寬度計算的緊貼深度
+
+調校模式（--tune）：每個尺寸以多組解析度渲染完整模型，量測三角面數、渲染時間
+與表面誤差（相對高解析度參考模型的 |ΔV| / 表面積），選出誤差在預算內最快的一組，
+寫入 quality_tiers.json 作為 production 品質
+
+用法（需在已安裝 OpenSCAD 與字體的 Docker image 內執行）：
+    python render_benchmark.py --dockerfile Dockerfile --pairs AB MW --size 15
+    python render_benchmark.py --tune --sizes 10 15 20 25 30 --budget 0.01
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from glyph_metrics import get_glyph_metrics
+from glyph_outline import load_glyph_outline, simplify_outline_mm
+from openscad_runner import run_openscad, get_openscad_version
+from quality_tiers import (
+    QUALITY_PRODUCTION,
+    QUALITY_TIERS_PATH,
+    DEFAULT_FA,
+    DEFAULT_FS,
+    DEFAULT_SIMPLIFY_TOLERANCE_MM,
+)
+from stl_mesh import stl_facet_count, mesh_volume_area
+from scad_generator import (
+    DUET_LIBRARY_PATH,
+    format_scad_defines,
+    core_library_defines,
+    model_library_defines,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAIRS = ("AB", "MW", "OQ", "RK")
+DEFAULT_TUNE_SIZES = (10, 15, 20, 25, 30)
+
+# 表面誤差預算（mm）：鑄造件表面處理後看不出差異
+DEFAULT_DEVIATION_BUDGET_MM = 0.01
+
+
+def _settings(fn, bail_fn, bail_tube_fn, curve_tolerance_em, fa=DEFAULT_FA, fs=DEFAULT_FS,
+              simplify_tolerance_mm=DEFAULT_SIMPLIFY_TOLERANCE_MM):
+    return {
+        "fn": fn,
+        "fa": fa,
+        "fs": fs,
+        "bail_fn": bail_fn,
+        "bail_tube_fn": bail_tube_fn,
+        "curve_tolerance_em": curve_tolerance_em,
+        "simplify_tolerance_mm": simplify_tolerance_mm,
+    }
+
+
+# 調校候選（由粗到細）；$fn = 0 時改由 $fa / $fs 依曲率決定分段
+TUNE_CANDIDATES = (
+    _settings(24, 20, 10, 0.004),
+    _settings(32, 24, 12, 0.003),
+    _settings(0, 24, 16, 0.002, fa=6, fs=0.4),
+    _settings(48, 28, 16, 0.002),
+    _settings(0, 32, 20, 0.0015, fa=4, fs=0.25),
+    _settings(64, 32, 24, 0.001),
+    _settings(96, 48, 32, 0.0005),
+)
+
+# 量測表面誤差用的參考解析度
+REFERENCE_SETTINGS = _settings(192, 128, 64, 0.0001, simplify_tolerance_mm=0)
+
+
+def _render_case(defines, measure=False):
+    """
+    以 -D 參數渲染一次模型庫 duet.scad（與線上渲染相同的 SCAD）並計時
+
+    Args:
+        measure: 同時量測網格體積與表面積（調校模式）
+
+    Returns:
+        dict: seconds / facets（/ volume / area）；失敗時含 error
+    """
+    with tempfile.TemporaryDirectory(prefix="duet_bench_") as work_dir:
+        stl_path = os.path.join(work_dir, "core.stl")
+
+        started = time.monotonic()
+        result = run_openscad(DUET_LIBRARY_PATH, stl_path, defines=format_scad_defines(defines))
+        seconds = time.monotonic() - started
+
+        if result.returncode != 0 or not os.path.exists(stl_path):
+            return {"seconds": seconds, "error": result.stderr[-500:]}
+        row = {"seconds": round(seconds, 3), "facets": stl_facet_count(stl_path)}
+        if measure:
+            row["volume"], row["area"] = mesh_volume_area(stl_path)
+        return row
+
+
+def benchmark_font(font, pairs, size):
+    """單一字體：每組字母各渲染 legacy 與 tight 一次"""
+    rows = []
+    for pair in pairs:
+        letter1, letter2 = pair[0], pair[1]
+        core_params = {
+            "letter1": letter1,
+            "letter2": letter2,
+            "font1": font,
+            "font2": font,
+            "size": size,
+        }
+
+        outline1 = load_glyph_outline(font, letter1)
+        outline2 = load_glyph_outline(font, letter2)
+        if not (outline1 and outline2):
+            logger.warning(f"⚠️ 略過 {font} {pair}：無法取得字形輪廓")
+            continue
+
+        legacy = _render_case(core_library_defines(**core_params))
+        tight = _render_case(
+            core_library_defines(
+                **core_params,
+                outline1=outline1,
+                outline2=outline2,
+                metrics1=get_glyph_metrics(font, letter1),
+                metrics2=get_glyph_metrics(font, letter2),
+            )
+        )
+        rows.append({"font": font, "pair": pair, "size": size, "legacy": legacy, "tight": tight})
+        logger.info(
+            f"⏱️ {font} {pair}: legacy {legacy['seconds']:.2f}s → tight {tight['seconds']:.2f}s"
+        )
+    return rows
+
+
+def summarize(rows):
+    """彙整：兩種方式都成功的案例的總時間、中位數與加速倍率"""
+    ok = [r for r in rows if "error" not in r["legacy"] and "error" not in r["tight"]]
+    if not ok:
+        return {"cases": 0}
+
+    legacy = [r["legacy"]["seconds"] for r in ok]
+    tight = [r["tight"]["seconds"] for r in ok]
+    return {
+        "cases": len(ok),
+        "failed": len(rows) - len(ok),
+        "legacy_total": round(sum(legacy), 2),
+        "tight_total": round(sum(tight), 2),
+        "legacy_median": round(statistics.median(legacy), 3),
+        "tight_median": round(statistics.median(tight), 3),
+        "speedup": round(sum(legacy) / max(sum(tight), 1e-6), 2),
+        "legacy_facets": sum(r["legacy"]["facets"] for r in ok),
+        "tight_facets": sum(r["tight"]["facets"] for r in ok),
+    }
+
+
+def _full_model_defines(font, pair, size, quality):
+    """調校用的完整模型 -D 參數（字形輪廓 + 緊貼深度 + 墜頭置於頂端）"""
+    letter1, letter2 = pair[0], pair[1]
+    tolerance_em = quality["curve_tolerance_em"]
+    outlines = []
+    for letter in (letter1, letter2):
+        outline = load_glyph_outline(font, letter, tolerance_em)
+        if outline:
+            outline = simplify_outline_mm(outline, quality["simplify_tolerance_mm"], size)[0]
+        outlines.append(outline)
+
+    return model_library_defines(
+        letter1,
+        letter2,
+        font,
+        font,
+        size,
+        0,
+        0,
+        size / 2.0,
+        0,
+        outline1=outlines[0],
+        outline2=outlines[1],
+        metrics1=get_glyph_metrics(font, letter1),
+        metrics2=get_glyph_metrics(font, letter2),
+        quality=quality,
+    )
+
+
+def tune_size(fonts, pairs, size, budget_mm):
+    """
+    單一尺寸：量測每組候選解析度，選出表面誤差在預算內、平均渲染時間最短的一組
+
+    Returns:
+        tuple: (選出的設定, 每組候選的量測結果)
+    """
+    stats = [{"settings": c, "seconds": [], "facets": [], "deviation": []} for c in TUNE_CANDIDATES]
+
+    for font in fonts:
+        for pair in pairs:
+            reference = _render_case(_full_model_defines(font, pair, size, REFERENCE_SETTINGS), measure=True)
+            if "error" in reference:
+                logger.warning(f"⚠️ 參考模型渲染失敗，略過 {font} {pair} {size}mm")
+                continue
+
+            for stat in stats:
+                row = _render_case(_full_model_defines(font, pair, size, stat["settings"]), measure=True)
+                if "error" in row:
+                    stat["deviation"].append(float("inf"))
+                    continue
+                stat["seconds"].append(row["seconds"])
+                stat["facets"].append(row["facets"])
+                # 平均表面誤差：體積差攤在參考模型的表面積上
+                stat["deviation"].append(abs(row["volume"] - reference["volume"]) / reference["area"])
+
+    results = []
+    for stat in stats:
+        if not stat["seconds"]:
+            continue
+        results.append(
+            {
+                "settings": stat["settings"],
+                "mean_seconds": round(statistics.mean(stat["seconds"]), 3),
+                "mean_facets": int(statistics.mean(stat["facets"])),
+                "max_deviation_mm": round(max(stat["deviation"]), 5),
+            }
+        )
+
+    if not results:
+        return None, results
+
+    within_budget = [r for r in results if r["max_deviation_mm"] <= budget_mm]
+    if within_budget:
+        chosen = min(within_budget, key=lambda r: r["mean_seconds"])
+    else:
+        chosen = min(results, key=lambda r: r["max_deviation_mm"])
+        logger.warning(f"⚠️ {size}mm 沒有候選符合誤差預算 {budget_mm}mm，改用誤差最小的一組")
+
+    logger.info(
+        f"🎚️ {size}mm → {chosen['settings']}（{chosen['mean_seconds']}s, "
+        f"{chosen['mean_facets']} 面, 誤差 {chosen['max_deviation_mm']}mm）"
+    )
+    return chosen["settings"], results
+
+
+def tune_production(fonts, pairs, sizes, budget_mm, out_path):
+    """調校所有尺寸並寫出 quality_tiers.json"""
+    production = {}
+    measurements = {}
+    for size in sizes:
+        chosen, results = tune_size(fonts, pairs, size, budget_mm)
+        measurements[str(size)] = results
+        if chosen:
+            production[str(size)] = chosen
+
+    data = {
+        QUALITY_PRODUCTION: production,
+        "budget_mm": budget_mm,
+        "openscad": get_openscad_version(),
+        "measurements": measurements,
+    }
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, out_path)
+    logger.info(f"✅ production 品質設定已寫入 {out_path}")
+    return data
+
+
+def print_report(rows, summary):
+    print(f"{'font':<28} {'pair':<5} {'legacy s':>9} {'tight s':>9} {'legacy f':>9} {'tight f':>9}")
+    for r in rows:
+        legacy, tight = r["legacy"], r["tight"]
+        print(
+            f"{r['font']:<28} {r['pair']:<5} {legacy['seconds']:>9.2f} {tight['seconds']:>9.2f} "
+            f"{legacy.get('facets', '-'):>9} {tight.get('facets', '-'):>9}"
+        )
+    print()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+def main(argv=None):
+    # 延遲匯入：glyph_cache 依賴 render_pool，只有 CLI 需要
+    from glyph_cache import dockerfile_font_families
+
+    parser = argparse.ArgumentParser(description="DUET 渲染時間比較（legacy vs tight）與 production 品質調校")
+    parser.add_argument("--dockerfile", default="Dockerfile", help="讀取字體清單的 Dockerfile")
+    parser.add_argument("--fonts", nargs="*", help="指定字體家族（預設使用 Dockerfile 清單）")
+    parser.add_argument("--pairs", nargs="*", default=list(DEFAULT_PAIRS), help="字母組合（兩個字元）")
+    parser.add_argument("--size", type=float, default=15)
+    parser.add_argument("--json", help="將完整結果寫入 JSON 檔")
+    parser.add_argument("--tune", action="store_true", help="調校 production 品質並寫入 --out")
+    parser.add_argument("--sizes", nargs="*", type=float, default=list(DEFAULT_TUNE_SIZES))
+    parser.add_argument("--budget", type=float, default=DEFAULT_DEVIATION_BUDGET_MM, help="表面誤差預算 (mm)")
+    parser.add_argument("--out", default=QUALITY_TIERS_PATH, help="調校結果輸出路徑")
+    args = parser.parse_args(argv)
+
+    fonts = args.fonts or dockerfile_font_families(args.dockerfile)
+    if not fonts:
+        logger.error("❌ 沒有可測試的字體")
+        return 1
+
+    if args.tune:
+        data = tune_production(fonts, args.pairs, args.sizes, args.budget, args.out)
+        print(json.dumps(data[QUALITY_PRODUCTION], ensure_ascii=False, indent=2))
+        return 0 if data[QUALITY_PRODUCTION] else 1
+
+    rows = []
+    for font in fonts:
+        rows.extend(benchmark_font(font, args.pairs, args.size))
+
+    summary = summarize(rows)
+    summary["openscad"] = get_openscad_version()
+    print_report(rows, summary)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+Render Client - 把渲染交給獨立的渲染服務（render_service.py，UNIX socket）
+設定 RENDER_SERVICE_SOCKET 時，Flask 與背景隊列不再自己 fork OpenSCAD，
+而是透過 socket 送出渲染請求；未設定時維持原本的 process 內渲染（stl_renderer.render_stl）
+
+協定：每行一則 UTF-8 JSON 訊息（\\n 結尾）
+    請求：{"op": "render", "params", "options", "queue_timeout", "reject_when_full",
+           "allow_downgrade", "low_priority"}
+          {"op": "call", "name", "args"}（SERVICE_CALLS 的查詢：快取 key / 快取 / 名額 / OpenSCAD 功能）
+          {"op": "status"}
+    回應：{"event": "stage", "stage": "waiting" | "rendering"}（render 進行中，可有多則）
+          {"event": "done", "stl_path", "cache_hit"}
+          {"event": "result", "result"}（call 的返回值）
+          {"event": "error", "type", "message", ...}（type 為例外名稱，附帶重建例外所需的欄位）
+          {"event": "status", ...}
+
+服務模式下 web worker 不碰 OpenSCAD、STL 快取與渲染名額：快取 key（字體指紋要執行 fc-match、
+字形輪廓要讀 TTF）、快取查詢、名額是否已滿與 OpenSCAD 功能探測都經由 call 交給渲染服務
+    渲染進行中用戶端可送 {"op": "cancel", "reason"}；連線中斷視同取消
+
+渲染服務重啟時：連線失敗會在 RENDER_SERVICE_CONNECT_WAIT 秒內重試，
+渲染到一半服務結束（type = "restarting" 或連線中斷）時重新送出同一個請求（結果多半已在快取中）
+"""
+import json
+import logging
+import os
+import socket
+import time
+
+import stl_renderer
+from openscad_runner import RenderCancelled, get_openscad_capabilities
+from render_pool import render_pool, RenderPoolFull, RENDER_QUEUE_TIMEOUT
+from stl_renderer import STLRenderError
+
+logger = logging.getLogger(__name__)
+
+# 渲染服務的 socket 路徑（空字串 = 在目前的 process 內渲染）
+RENDER_SERVICE_SOCKET = os.environ.get("RENDER_SERVICE_SOCKET", "")
+# 連不上渲染服務時持續重試的秒數（涵蓋服務重啟的空檔）
+RENDER_SERVICE_CONNECT_WAIT = float(os.environ.get("RENDER_SERVICE_CONNECT_WAIT", "30"))
+# 渲染途中服務結束時重新送出的次數
+RENDER_SERVICE_RESUBMITS = 3
+# call 查詢等待回覆的秒數
+RENDER_SERVICE_CALL_TIMEOUT = float(os.environ.get("RENDER_SERVICE_CALL_TIMEOUT", "30"))
+
+CONNECT_RETRY_INTERVAL = 0.5
+# 等待結果期間檢查 should_cancel 的間隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+# 渲染服務結束前中止的渲染（用戶端應重新送出）
+ERROR_RESTARTING = "restarting"
+
+
+class RenderServiceUnavailable(RenderPoolFull):
+    """渲染服務無法連線（呼叫端依 RenderPoolFull 處理：HTTP 503 + Retry-After、背景隊列稍後重試）"""
+
+
+class _ServiceRestarting(Exception):
+    pass
+
+
+class MessageConnection:
+    """以換行分隔 JSON 訊息的 socket 連線（渲染服務與用戶端共用）"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b""
+
+    def send(self, message):
+        data = json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.sock.sendall(data)
+
+    def receive(self, timeout=None):
+        """
+        讀取下一則訊息
+
+        Returns:
+            dict: 訊息；timeout 秒內沒有完整訊息時返回 None
+
+        Raises:
+            ConnectionError: 對方已關閉連線
+        """
+        self.sock.settimeout(timeout)
+        while b"\n" not in self._buffer:
+            try:
+                chunk = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not chunk:
+                raise ConnectionError("render service connection closed")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line.decode("utf-8"))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def error_message(e):
+    """例外轉成 error 訊息（渲染服務使用）"""
+    message = {"event": "error", "type": type(e).__name__, "message": str(e)}
+    if isinstance(e, STLRenderError):
+        message["type"] = "STLRenderError"
+        message["stderr"] = e.stderr
+    elif isinstance(e, RenderPoolFull):
+        message["type"] = "RenderPoolFull"
+        message["retry_after"] = e.retry_after
+    elif isinstance(e, RenderCancelled):
+        message["type"] = "RenderCancelled"
+        message["reason"] = e.reason
+    elif isinstance(e, ValueError):
+        message["type"] = "ValueError"
+    return message
+
+
+def _error_from_message(message):
+    error_type = message.get("type")
+    if error_type == ERROR_RESTARTING:
+        return _ServiceRestarting(message.get("message", ""))
+    if error_type == "STLRenderError":
+        return STLRenderError(message.get("message", ""), message.get("stderr") or "")
+    if error_type == "RenderPoolFull":
+        return RenderPoolFull(message.get("retry_after", 1))
+    if error_type == "RenderCancelled":
+        return RenderCancelled(message.get("reason", "cancelled"))
+    if error_type == "ValueError":
+        return ValueError(message.get("message", ""))
+    return RuntimeError(f"render service error: {message.get('message', '')}")
+
+
+def _connect(wait, should_cancel=None):
+    """
+    連線到渲染服務（服務重啟期間持續重試 wait 秒）
+
+    Raises:
+        RenderServiceUnavailable: 超過 wait 秒仍無法連線
+        RenderCancelled: 等待期間被取消
+    """
+    start = time.time()
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(RENDER_SERVICE_SOCKET)
+            return MessageConnection(sock)
+        except OSError:
+            sock.close()
+            if time.time() - start >= wait:
+                raise RenderServiceUnavailable(int(RENDER_SERVICE_CONNECT_WAIT))
+
+        reason = should_cancel() if should_cancel else None
+        if reason:
+            raise RenderCancelled(reason)
+        time.sleep(CONNECT_RETRY_INTERVAL)
+
+
+def _await_result(conn, request, on_stage, should_cancel):
+    conn.send(request)
+    cancel_sent = False
+    while True:
+        message = conn.receive(timeout=CANCEL_POLL_INTERVAL)
+        if message is None:
+            # 取消要求轉送給渲染服務，由服務結束 OpenSCAD 後回覆 RenderCancelled
+            reason = should_cancel() if should_cancel and not cancel_sent else None
+            if reason:
+                conn.send({"op": "cancel", "reason": reason})
+                cancel_sent = True
+            continue
+
+        event = message.get("event")
+        if event == "stage":
+            if on_stage:
+                on_stage(message["stage"])
+        elif event == "done":
+            return message["stl_path"], message["cache_hit"]
+        elif event == "error":
+            raise _error_from_message(message)
+
+
+def render_stl(
+    params,
+    options=None,
+    queue_timeout=RENDER_QUEUE_TIMEOUT,
+    reject_when_full=True,
+    on_stage=None,
+    should_cancel=None,
+    allow_downgrade=False,
+    low_priority=False,
+):
+    """
+    產生 STL（參數、返回值與例外都與 stl_renderer.render_stl 相同）
+
+    設定 RENDER_SERVICE_SOCKET 時由渲染服務執行，否則在目前的 process 內渲染
+
+    Raises:
+        RenderServiceUnavailable: 渲染服務無法連線（RenderPoolFull 子類別）
+    """
+    if not RENDER_SERVICE_SOCKET:
+        return stl_renderer.render_stl(
+            params,
+            options,
+            queue_timeout=queue_timeout,
+            reject_when_full=reject_when_full,
+            on_stage=on_stage,
+            should_cancel=should_cancel,
+            allow_downgrade=allow_downgrade,
+            low_priority=low_priority,
+        )
+
+    request = {
+        "op": "render",
+        "params": params,
+        "options": options,
+        "queue_timeout": queue_timeout,
+        "reject_when_full": reject_when_full,
+        "allow_downgrade": allow_downgrade,
+        "low_priority": low_priority,
+    }
+    wait = RENDER_SERVICE_CONNECT_WAIT
+    if queue_timeout is not None:
+        wait = min(wait, queue_timeout)
+
+    for attempt in range(RENDER_SERVICE_RESUBMITS + 1):
+        try:
+            conn = _connect(wait, should_cancel)
+        except RenderServiceUnavailable:
+            logger.error(f"❌ 無法連線到渲染服務: {RENDER_SERVICE_SOCKET}")
+            raise
+        try:
+            return _await_result(conn, request, on_stage, should_cancel)
+        except (ConnectionError, _ServiceRestarting) as e:
+            logger.warning(f"🔌 渲染服務中斷（第 {attempt + 1} 次）: {e}")
+        finally:
+            conn.close()
+
+    raise RenderServiceUnavailable(int(RENDER_SERVICE_CONNECT_WAIT))
+
+
+# ---------- 快取 / 名額查詢（服務模式下由渲染服務執行） ----------
+
+
+def _lookup_cached_stl(params, options):
+    stl_path = stl_renderer.lookup_cached_stl(params, options)
+    return os.path.abspath(stl_path) if stl_path else None
+
+
+def _render_admission():
+    return {
+        "full": render_pool.is_full(),
+        "retry_after": render_pool.estimate_retry_after(),
+        "slots": render_pool.slots,
+        "average_render_seconds": render_pool.average_render_seconds(),
+    }
+
+
+# 渲染服務接受的 call 名稱 → 在擁有快取與名額的 process 內執行的函式
+SERVICE_CALLS = {
+    "compute_render_key": stl_renderer.compute_render_key,
+    "lookup_cached_stl": _lookup_cached_stl,
+    "get_stl_meta": stl_renderer.get_stl_meta,
+    "cache_last_used": stl_renderer.stl_cache.last_used,
+    "cache_remove": stl_renderer.stl_cache.remove,
+    "render_admission": _render_admission,
+    "openscad_capabilities": get_openscad_capabilities,
+}
+
+
+def _call(name, *args):
+    """
+    執行 SERVICE_CALLS 的查詢：設定 RENDER_SERVICE_SOCKET 時交給渲染服務，否則在目前的 process 內執行
+
+    Raises:
+        RenderServiceUnavailable: 渲染服務無法連線或沒有回覆
+    """
+    if not RENDER_SERVICE_SOCKET:
+        return SERVICE_CALLS[name](*args)
+
+    conn = _connect(RENDER_SERVICE_CONNECT_WAIT)
+    try:
+        conn.send({"op": "call", "name": name, "args": list(args)})
+        message = conn.receive(timeout=RENDER_SERVICE_CALL_TIMEOUT)
+    except (OSError, ValueError) as e:
+        logger.warning(f"🔌 渲染服務查詢中斷（{name}）: {e}")
+        message = None
+    finally:
+        conn.close()
+
+    if message is None:
+        raise RenderServiceUnavailable(int(RENDER_SERVICE_CONNECT_WAIT))
+    if message.get("event") == "error":
+        raise _error_from_message(message)
+    return message["result"]
+
+
+def compute_render_key(params, options=None):
+    """STL 快取 key（stl_renderer.compute_render_key）"""
+    return _call("compute_render_key", params, options)
+
+
+def lookup_cached_stl(params, options=None):
+    """只查詢快取，不觸發渲染；未命中返回 None"""
+    return _call("lookup_cached_stl", params, options)
+
+
+def get_stl_meta(stl_path):
+    """快取中 STL 的 metadata（stl_renderer.get_stl_meta）"""
+    return _call("get_stl_meta", stl_path)
+
+
+def get_stl_backend(stl_path):
+    """快取中的 STL 實際由哪個幾何後端產生"""
+    return get_stl_meta(stl_path).get("backend")
+
+
+def cache_last_used(key):
+    """快取項目最後寫入或命中的時間，不存在時返回 None（不算一次命中）"""
+    return _call("cache_last_used", key)
+
+
+def remove_cached_stl(key):
+    """刪除單一快取項目"""
+    _call("cache_remove", key)
+
+
+def render_admission():
+    """
+    渲染名額狀況（提交工作前的快速檢查）
+
+    Returns:
+        dict: full（名額與等待佇列都已滿）、retry_after、slots、average_render_seconds
+    """
+    return _call("render_admission")
+
+
+def openscad_capabilities():
+    """OpenSCAD 支援的幾何後端（openscad_runner.get_openscad_capabilities）"""
+    return _call("openscad_capabilities")
+
+
+def render_service_status():
+    """渲染服務狀態（健康檢查用；未啟用時為 None）"""
+    if not RENDER_SERVICE_SOCKET:
+        return None
+    try:
+        conn = _connect(wait=0)
+    except RenderServiceUnavailable:
+        return {"socket": RENDER_SERVICE_SOCKET, "available": False}
+    try:
+        conn.send({"op": "status"})
+        message = conn.receive(timeout=5) or {}
+    except (OSError, ValueError):
+        message = {}
+    finally:
+        conn.close()
+    message.pop("event", None)
+    return {"socket": RENDER_SERVICE_SOCKET, "available": bool(message), **message}
@@ -0,0 +1,376 @@
+"""
+Render Memory - OpenSCAD 渲染的記憶體控管
+CGAL 的 Nef 多面體運算對複雜字形（草寫、襯線密集的字體）會吃掉數 GB 記憶體，
+兩個大渲染同時執行就可能讓容器被 OOM killer 整個砍掉（連同 gunicorn worker）
+
+三層保護：
+- 單次渲染上限：openscad 子進程設定 RLIMIT_AS，超過時該次渲染失敗，不拖垮整個容器。
+  RLIMIT_AS 限制的是虛擬記憶體（VSZ），不是 RSS：共享函式庫、thread stack、
+  glibc 每個 thread 的 malloc arena（預留 64MB）都算在 VSZ 裡，多執行緒的 openscad
+  VSZ 常比 peak RSS 大上數百 MB 到 1GB 以上。所以預設上限是容器記憶體再加
+  RENDER_MEMORY_VSZ_HEADROOM_MB，只擋失控的渲染；平常的記憶體分配靠准入控制
+- 峰值記錄：每次渲染結束後以 wait4 取得子進程 peak RSS，依字體 / 品質 / $fn 記錄最大值
+- 准入控制：取得渲染名額後，預估記憶體放得下才開始；放不下就等待，
+  允許降級的請求（互動預覽）等待 RENDER_MEMORY_PATIENCE 秒後改用較便宜的品質
+
+預留量與統計都是 RENDER_POOL_DIR 下的檔案，所有 gunicorn worker 與背景隊列共用：
+- memory-<pid>-<thread>.res：執行中渲染的預估記憶體，持有 flock；process 崩潰時鎖自動釋放，
+  下一次計算預留量時會清掉
+- memory-stats.json：各字體的峰值記錄
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from openscad_runner import RenderCancelled
+from render_pool import render_pool, RenderPoolFull, RENDER_POOL_DIR, POLL_INTERVAL
+from quality_tiers import QUALITY_DRAFT, QUALITY_PREVIEW, QUALITY_PRODUCTION
+
+logger = logging.getLogger(__name__)
+
+# 保留給 gunicorn worker / 系統的記憶體（MB），不分配給渲染
+RENDER_MEMORY_RESERVE_MB = int(os.environ.get("RENDER_MEMORY_RESERVE_MB", "768"))
+# 渲染可用的總記憶體（MB）；0 = 容器上限（cgroup / MemTotal）扣掉保留量
+RENDER_MEMORY_BUDGET_MB = int(os.environ.get("RENDER_MEMORY_BUDGET_MB", "0"))
+# 單次渲染的 RLIMIT_AS（MB）；0 = 容器上限與渲染預算取大者 + VSZ 餘裕。
+# RLIMIT_AS 限制的是虛擬記憶體，明確設定時要比 peak RSS 高出 VSZ 的差距，否則正常渲染會 bad_alloc
+RENDER_MEMORY_LIMIT_MB = int(os.environ.get("RENDER_MEMORY_LIMIT_MB", "0"))
+# 預設 RLIMIT_AS 在容器上限之上額外允許的虛擬記憶體（MB）：thread stack、malloc arena、共享函式庫
+RENDER_MEMORY_VSZ_HEADROOM_MB = int(os.environ.get("RENDER_MEMORY_VSZ_HEADROOM_MB", "2048"))
+# 允許降級的請求等待原品質的秒數，之後改用放得下的較低品質
+RENDER_MEMORY_PATIENCE = float(os.environ.get("RENDER_MEMORY_PATIENCE", "10"))
+
+# 預估值 = 歷史峰值 × 安全係數
+RENDER_MEMORY_SAFETY = 1.25
+# 沒有歷史資料時的預估峰值（MB）
+DEFAULT_RENDER_MEMORY_MB = {
+    QUALITY_DRAFT: 192,
+    QUALITY_PREVIEW: 384,
+    QUALITY_PRODUCTION: 768,
+}
+# 降級順序（由貴到便宜）
+QUALITY_FALLBACK_ORDER = (QUALITY_PRODUCTION, QUALITY_PREVIEW, QUALITY_DRAFT)
+
+MIN_RENDER_BUDGET_MB = 256
+
+_local = threading.local()
+
+
+# ---------- 系統記憶體 ----------
+
+
+def _read_first_line(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _meminfo_mb(field):
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _cgroup_memory_mb():
+    """容器的 cgroup 記憶體 (上限, 目前用量)（MB）；沒有上限時上限為 None"""
+    # cgroup v2
+    limit = _read_first_line("/sys/fs/cgroup/memory.max")
+    usage = _read_first_line("/sys/fs/cgroup/memory.current")
+    if limit is None:
+        # cgroup v1
+        limit = _read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        usage = _read_first_line("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+
+    try:
+        limit_mb = int(limit) // (1024 * 1024)
+    except (TypeError, ValueError):
+        limit_mb = None  # "max" 或讀不到
+    try:
+        usage_mb = int(usage) // (1024 * 1024)
+    except (TypeError, ValueError):
+        usage_mb = None
+
+    # cgroup v1 沒有上限時是接近 2^63 的數字
+    total_mb = _meminfo_mb("MemTotal")
+    if limit_mb is not None and total_mb is not None and limit_mb >= total_mb:
+        limit_mb = None
+    return limit_mb, usage_mb
+
+
+def memory_limit_mb():
+    """容器可用的記憶體上限（MB）"""
+    limit_mb, _ = _cgroup_memory_mb()
+    return limit_mb or _meminfo_mb("MemTotal") or 0
+
+
+def available_memory_mb():
+    """目前還能分配的記憶體（MB）：cgroup 剩餘量與 MemAvailable 取較小者"""
+    candidates = []
+    limit_mb, usage_mb = _cgroup_memory_mb()
+    if limit_mb is not None and usage_mb is not None:
+        candidates.append(limit_mb - usage_mb)
+    available = _meminfo_mb("MemAvailable")
+    if available is not None:
+        candidates.append(available)
+    return max(0, min(candidates)) if candidates else 0
+
+
+def render_memory_budget_mb():
+    """所有渲染合計可用的記憶體（MB）"""
+    if RENDER_MEMORY_BUDGET_MB > 0:
+        return RENDER_MEMORY_BUDGET_MB
+    return max(MIN_RENDER_BUDGET_MB, memory_limit_mb() - RENDER_MEMORY_RESERVE_MB)
+
+
+def render_memory_limit_mb():
+    """單次 openscad 的 RLIMIT_AS（MB）
+
+    預設不能等於渲染預算：1GB 的容器預算只有 256MB，VSZ 卡在 256MB 時
+    production 渲染一定 bad_alloc。以容器上限加上 VSZ 餘裕，只攔截失控的渲染
+    """
+    if RENDER_MEMORY_LIMIT_MB > 0:
+        return RENDER_MEMORY_LIMIT_MB
+    return max(memory_limit_mb(), render_memory_budget_mb()) + RENDER_MEMORY_VSZ_HEADROOM_MB
+
+
+# ---------- 准入控制 ----------
+
+
+class MemoryTicket:
+    """一次已准入的渲染：選定的品質、預估值，以及執行期間回報的 peak RSS"""
+
+    def __init__(self, quality, estimate_mb, fonts, fn):
+        self.quality = quality
+        self.estimate_mb = estimate_mb
+        self.fonts = fonts
+        self.fn = fn
+        self.peaks = []
+
+
+class RenderMemory:
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    # ---------- 峰值統計 ----------
+
+    def _stats_path(self):
+        return os.path.join(self.state_dir, "memory-stats.json")
+
+    def _load_stats(self):
+        try:
+            with open(self._stats_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _stats_key(font, quality, fn):
+        return f"{font}|{quality}|{fn}"
+
+    def estimate_mb(self, fonts, quality, fn):
+        """
+        預估一次渲染的 peak RSS（MB）
+
+        兩個字母的字體各自記錄，取較大者：記憶體主要由較複雜的字形決定
+        """
+        stats = self._load_stats()
+        peaks = [
+            stats[key]["peak_mb"]
+            for key in (self._stats_key(font, quality, fn) for font in fonts)
+            if key in stats
+        ]
+        if not peaks:
+            return DEFAULT_RENDER_MEMORY_MB.get(quality, DEFAULT_RENDER_MEMORY_MB[QUALITY_PRODUCTION])
+        return int(max(peaks) * RENDER_MEMORY_SAFETY)
+
+    def record_peak(self, fonts, quality, fn, peak_mb):
+        """記錄渲染峰值（保留最大值與最近一次）"""
+        with self._admission_lock():
+            stats = self._load_stats()
+            for font in set(fonts):
+                key = self._stats_key(font, quality, fn)
+                entry = stats.get(key, {"peak_mb": 0, "renders": 0})
+                entry["peak_mb"] = max(entry["peak_mb"], round(peak_mb, 1))
+                entry["last_mb"] = round(peak_mb, 1)
+                entry["renders"] = entry["renders"] + 1
+                stats[key] = entry
+            tmp_path = f"{self._stats_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f)
+            os.replace(tmp_path, self._stats_path())
+
+    # ---------- 預留量 ----------
+
+    @contextmanager
+    def _admission_lock(self):
+        with open(os.path.join(self.state_dir, "memory.lock"), "w") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _reservation_paths(self):
+        for filename in os.listdir(self.state_dir):
+            if filename.startswith("memory-") and filename.endswith(".res"):
+                yield os.path.join(self.state_dir, filename)
+
+    def reserved_mb(self):
+        """
+        執行中渲染的預估記憶體合計（順便清掉崩潰 process 遺留的預留檔）
+        需持有 _admission_lock，避免把剛建立、尚未上鎖的預留檔當成遺留檔
+        """
+        total = 0
+        for path in self._reservation_paths():
+            try:
+                fd = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with fd:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    # 持有者仍在渲染
+                    try:
+                        total += int(json.load(fd)["estimate_mb"])
+                    except (ValueError, KeyError, json.JSONDecodeError):
+                        pass
+                    continue
+                # 鎖沒人持有：持有者已結束
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _reserve(self, estimate_mb):
+        path = os.path.join(
+            self.state_dir, f"memory-{os.getpid()}-{threading.get_ident()}.res"
+        )
+        fd = open(path, "w", encoding="utf-8")
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        json.dump({"estimate_mb": estimate_mb, "pid": os.getpid()}, fd)
+        fd.flush()
+        return path, fd
+
+    @staticmethod
+    def _release(reservation):
+        path, fd = reservation
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            fd.close()
+
+    def _fits(self, estimate_mb, reserved_mb):
+        budget = render_memory_budget_mb()
+        if reserved_mb == 0:
+            # 沒有其他渲染時一定放行：預估值超過整個預算也只能單獨執行
+            return True
+        return reserved_mb + estimate_mb <= budget and estimate_mb <= available_memory_mb()
+
+    @contextmanager
+    def admit(self, candidates, fonts, patience=None, timeout=None, should_cancel=None):
+        """
+        等待記憶體足夠時開始渲染
+
+        Args:
+            candidates: [(quality, fn), ...] 依偏好排序；第一個是請求的品質，其餘為可降級的品質
+            fonts: 兩個字母的字體（查詢 / 記錄峰值用）
+            patience: 等待第一個候選多少秒後接受其他候選（None = 不降級）
+            timeout: 最長等待秒數（None = 無限等待）
+            should_cancel: 等待期間定期呼叫，返回取消原因時放棄等待
+
+        Yields:
+            MemoryTicket: 選定的品質；執行期間 report_peak 回報的峰值在結束時寫入統計
+
+        Raises:
+            RenderPoolFull: 等待逾時
+            RenderCancelled: 等待期間被取消
+        """
+        estimates = [(quality, fn, self.estimate_mb(fonts, quality, fn)) for quality, fn in candidates]
+        start = time.time()
+        ticket = None
+        reservation = None
+        logged = False
+
+        while True:
+            waited = time.time() - start
+            allowed = estimates if patience is not None and waited >= patience else estimates[:1]
+            with self._admission_lock():
+                reserved = self.reserved_mb()
+                for quality, fn, estimate in allowed:
+                    if self._fits(estimate, reserved):
+                        reservation = self._reserve(estimate)
+                        ticket = MemoryTicket(quality, estimate, fonts, fn)
+                        break
+            if ticket:
+                break
+
+            if not logged:
+                logger.info(
+                    f"🧠 記憶體不足，等待開始渲染（預估 {estimates[0][2]}MB，"
+                    f"已預留 {reserved}MB / 預算 {render_memory_budget_mb()}MB）"
+                )
+                logged = True
+
+            reason = should_cancel() if should_cancel else None
+            if reason:
+                raise RenderCancelled(reason)
+
+            if timeout is not None and waited > timeout:
+                logger.warning(f"🧠 等待記憶體逾時（{timeout}s）")
+                raise RenderPoolFull(render_pool.estimate_retry_after())
+
+            time.sleep(POLL_INTERVAL)
+
+        if ticket.quality != estimates[0][0]:
+            logger.warning(f"🧠 記憶體不足，品質由 {estimates[0][0]} 降為 {ticket.quality}")
+        elif logged:
+            logger.info(f"🧠 等待 {time.time() - start:.1f}s 後取得記憶體")
+
+        _local.ticket = ticket
+        try:
+            yield ticket
+        finally:
+            _local.ticket = None
+            self._release(reservation)
+            if ticket.peaks:
+                self.record_peak(fonts, ticket.quality, ticket.fn, max(ticket.peaks))
+
+    def status(self):
+        """記憶體使用狀況（健康檢查用）"""
+        with self._admission_lock():
+            reserved = self.reserved_mb()
+        return {
+            "budget_mb": render_memory_budget_mb(),
+            "reserved_mb": reserved,
+            "available_mb": available_memory_mb(),
+            "render_limit_mb": render_memory_limit_mb(),
+            "tracked_fonts": len(self._load_stats()),
+        }
+
+
+def report_peak(peak_mb):
+    """回報一次 openscad 執行的 peak RSS（記入目前 thread 已准入的渲染）"""
+    ticket = getattr(_local, "ticket", None)
+    if ticket is not None and peak_mb:
+        ticket.peaks.append(peak_mb)
+
+
+render_memory = RenderMemory(RENDER_POOL_DIR)
@@ -0,0 +1,228 @@
+"""
+Render Pool - 跨 gunicorn worker 的 OpenSCAD 渲染名額控制
+固定數量的渲染名額（slot）+ 有上限的等待佇列，滿了直接拒絕並估算 Retry-After
+
+名額與等待號碼牌都是 /tmp 下的 fcntl 檔案鎖：
+- 所有 worker process 與背景隊列共用同一組鎖，整台機器不會超量渲染
+- process 崩潰時鎖會自動釋放，不會留下殭屍名額
+- 持有者取得鎖後在鎖檔寫入自己的 pid；統計使用量時只讀取 pid，不去探測鎖，
+  避免探測的瞬間讓正在取得名額的請求誤判為已滿
+"""
+import fcntl
+import json
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+
+from openscad_runner import RenderCancelled
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_DIR = os.environ.get("RENDER_POOL_DIR", "/tmp/duet_render_pool")
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "2"))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", "2"))
+RENDER_QUEUE_TIMEOUT = float(os.environ.get("RENDER_QUEUE_TIMEOUT", "150"))
+
+# 沒有歷史資料時的預設單次渲染秒數
+DEFAULT_RENDER_SECONDS = 30.0
+POLL_INTERVAL = 0.5
+
+
+class RenderPoolFull(Exception):
+    """渲染名額與等待佇列都已滿"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Render pool is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class RenderPool:
+    def __init__(self, lock_dir, slots, queue_size):
+        self.lock_dir = lock_dir
+        self.slots = max(1, slots)
+        self.queue_size = max(0, queue_size)
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _lock_path(self, kind, index):
+        return os.path.join(self.lock_dir, f"{kind}-{index}.lock")
+
+    def _open(self, kind, index):
+        # 不使用 "w"：開啟時不可清空其他持有者寫入的 pid
+        return os.fdopen(os.open(self._lock_path(kind, index), os.O_RDWR | os.O_CREAT, 0o666), "r+")
+
+    def _try_lock(self, kind, count):
+        """嘗試取得 kind 類型中任一把空閒的鎖，成功返回檔案物件"""
+        for index in range(count):
+            fd = self._open(kind, index)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                fd.close()
+                continue
+            fd.seek(0)
+            fd.truncate()
+            fd.write(str(os.getpid()))
+            fd.flush()
+            return fd
+        return None
+
+    @staticmethod
+    def _holder_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _count_locked(self, kind, count):
+        """計算目前被持有的鎖數量（讀取持有者 pid，不探測鎖）"""
+        busy = 0
+        for index in range(count):
+            try:
+                with open(self._lock_path(kind, index), "r") as fd:
+                    holder = fd.read().strip()
+            except FileNotFoundError:
+                continue
+            # 持有者崩潰時留下的 pid 已不存在，不列入
+            if holder.isdigit() and self._holder_alive(int(holder)):
+                busy += 1
+        return busy
+
+    @staticmethod
+    def _release(fd):
+        if fd is None:
+            return
+        try:
+            fd.seek(0)
+            fd.truncate()
+            fd.flush()
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            fd.close()
+
+    # ---------- 平均渲染時間（估算 Retry-After 用） ----------
+
+    def _stats_path(self):
+        return os.path.join(self.lock_dir, "stats.json")
+
+    def average_render_seconds(self):
+        try:
+            with open(self._stats_path(), "r", encoding="utf-8") as f:
+                return float(json.load(f).get("avg_seconds", DEFAULT_RENDER_SECONDS))
+        except (FileNotFoundError, ValueError, json.JSONDecodeError):
+            return DEFAULT_RENDER_SECONDS
+
+    def record_duration(self, seconds):
+        """以指數移動平均記錄渲染時間"""
+        avg = self.average_render_seconds()
+        avg = avg * 0.8 + seconds * 0.2
+        tmp_path = f"{self._stats_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"avg_seconds": avg, "updated_at": time.time()}, f)
+        os.replace(tmp_path, self._stats_path())
+
+    def estimate_retry_after(self):
+        """佇列全滿時，估算多久後會有空位（秒）"""
+        rounds = math.ceil((self.queue_size + 1) / self.slots)
+        return max(1, int(math.ceil(rounds * self.average_render_seconds())))
+
+    # ---------- 取得名額 ----------
+
+    def _idle_slot_available(self):
+        """
+        低優先權渲染可用的名額：沒有人在等待，且取得後至少還留一個名額給其他請求
+        （只有一個名額時永遠不可用：佔用後使用者請求就得排在預先渲染後面）
+        """
+        if self.slots <= 1 or self._count_locked("wait", self.queue_size):
+            return False
+        return self._count_locked("slot", self.slots) < self.slots - 1
+
+    @contextmanager
+    def slot(
+        self,
+        timeout=RENDER_QUEUE_TIMEOUT,
+        reject_when_full=True,
+        should_cancel=None,
+        low_priority=False,
+    ):
+        """
+        取得一個渲染名額
+
+        Args:
+            timeout: 最長等待秒數（None = 無限等待）
+            reject_when_full: 等待佇列滿時直接拒絕（HTTP 用）；
+                              False 時持續等待號碼牌（背景隊列用）
+            should_cancel: 等待期間定期呼叫，返回取消原因時放棄等待
+            low_priority: 預先渲染用：不佔等待號碼牌，只在沒有人等待且還有其他空閒名額時才取得名額
+
+        Raises:
+            RenderPoolFull: 佇列已滿或等待逾時
+            RenderCancelled: 等待期間被取消
+        """
+        start = time.time()
+        ticket = None
+        slot_fd = None
+
+        try:
+            while True:
+                if not low_priority or self._idle_slot_available():
+                    slot_fd = self._try_lock("slot", self.slots)
+                    if slot_fd:
+                        break
+
+                if ticket is None and not low_priority:
+                    ticket = self._try_lock("wait", self.queue_size)
+                    if ticket is None and reject_when_full:
+                        retry_after = self.estimate_retry_after()
+                        logger.warning(f"🚦 渲染佇列已滿，建議 {retry_after} 秒後重試")
+                        raise RenderPoolFull(retry_after)
+
+                reason = should_cancel() if should_cancel else None
+                if reason:
+                    raise RenderCancelled(reason)
+
+                if timeout is not None and time.time() - start > timeout:
+                    retry_after = self.estimate_retry_after()
+                    logger.warning(f"🚦 等待渲染名額逾時（{timeout}s）")
+                    raise RenderPoolFull(retry_after)
+
+                time.sleep(POLL_INTERVAL)
+
+            # 取得名額後歸還號碼牌，讓下一位進入等待佇列
+            self._release(ticket)
+            ticket = None
+
+            waited = time.time() - start
+            if waited > 1:
+                logger.info(f"🚦 等待 {waited:.1f}s 後取得渲染名額")
+
+            render_start = time.time()
+            yield
+            self.record_duration(time.time() - render_start)
+        finally:
+            self._release(ticket)
+            self._release(slot_fd)
+
+    def is_full(self):
+        """名額與等待佇列是否都已被佔滿（提交工作前的快速檢查）"""
+        return (
+            self._count_locked("slot", self.slots) >= self.slots
+            and self._count_locked("wait", self.queue_size) >= self.queue_size
+        )
+
+    def status(self):
+        """目前的名額使用狀況（健康檢查用）"""
+        return {
+            "slots": self.slots,
+            "busy": self._count_locked("slot", self.slots),
+            "queue_size": self.queue_size,
+            "waiting": self._count_locked("wait", self.queue_size),
+            "avg_render_seconds": round(self.average_render_seconds(), 1),
+        }
+
+
+render_pool = RenderPool(RENDER_POOL_DIR, RENDER_SLOTS, RENDER_QUEUE_SIZE)
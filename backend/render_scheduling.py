@@ -0,0 +1,167 @@
+"""
+Render Scheduling - OpenSCAD 子進程的 CPU 排程隔離
+綠界付款回調必須很快回覆 1|OK，但它和 OpenSCAD 共用同一批 CPU 核心；
+背景 STL 生成把核心跑滿時，gunicorn worker 排不到 CPU，p99 延遲跟著拉長
+
+每個渲染子進程啟動後立即套用（與 RLIMIT_AS 相同，由父進程以 pid 設定，不使用 preexec_fn）：
+- nice（RENDER_NICE）：CPU 競爭時 web 請求優先取得 CPU；沒有競爭時渲染仍可用滿所有核心
+- CPU affinity（RENDER_CPUS 或 WEB_RESERVED_CPUS）：渲染只在指定的核心上執行，保留核心給 web
+- cgroup CPU quota（RENDER_CPU_QUOTA，選用）：所有渲染合計最多使用幾顆 CPU；
+  需要可寫入的 cgroupfs（v2 的 cpu.max 或 v1 的 cpu.cfs_quota_us），無法設定時只記錄一次警告
+
+Linux 的 nice 與 affinity 以 thread 為單位，套用到子進程當下的所有 thread；之後建立的 thread 會繼承
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 渲染子進程的 nice 值（0 = 不調整，19 = 最低優先權）
+RENDER_NICE = int(os.environ.get("RENDER_NICE", "10"))
+# 渲染可使用的 CPU（例如 "2-3" 或 "1,3"；空白 = 全部）
+RENDER_CPUS = os.environ.get("RENDER_CPUS", "")
+# 保留給 web 的 CPU（RENDER_CPUS 未設定時，渲染使用其餘的 CPU）
+WEB_RESERVED_CPUS = os.environ.get("WEB_RESERVED_CPUS", "")
+# 所有渲染合計可使用的 CPU 數（例如 1.5；0 = 不限制）
+RENDER_CPU_QUOTA = float(os.environ.get("RENDER_CPU_QUOTA", "0"))
+RENDER_CGROUP_NAME = os.environ.get("RENDER_CGROUP_NAME", "duet-render")
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CGROUP_PERIOD_US = 100000
+
+_cgroup_lock = threading.Lock()
+_cgroup_procs = None  # 設定完成後為 cgroup.procs 路徑；False = 無法使用
+_warned = set()
+
+
+def parse_cpu_list(value):
+    """解析 CPU 清單（"0-2,5" → {0, 1, 2, 5}）"""
+    cpus = set()
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def render_cpus():
+    """
+    渲染子進程可使用的 CPU（None = 不限制）
+
+    保留核心後沒有剩下任何 CPU 時（例如單核心機器）不限制
+    """
+    available = os.sched_getaffinity(0)
+    if RENDER_CPUS:
+        cpus = parse_cpu_list(RENDER_CPUS) & available
+    elif WEB_RESERVED_CPUS:
+        cpus = available - parse_cpu_list(WEB_RESERVED_CPUS)
+    else:
+        return None
+    return cpus or None
+
+
+def _warn_once(kind, message):
+    if kind not in _warned:
+        _warned.add(kind)
+        logger.warning(message)
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _setup_cgroup():
+    """
+    建立渲染用的 cgroup 並設定 CPU quota
+
+    Returns:
+        str: cgroup.procs 路徑
+
+    Raises:
+        OSError: cgroupfs 不可寫入
+    """
+    quota_us = str(int(RENDER_CPU_QUOTA * CGROUP_PERIOD_US))
+    if os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        # cgroup v2：子 cgroup 需要父層啟用 cpu controller
+        try:
+            _write(os.path.join(CGROUP_ROOT, "cgroup.subtree_control"), "+cpu")
+        except OSError:
+            pass
+        path = os.path.join(CGROUP_ROOT, RENDER_CGROUP_NAME)
+        os.makedirs(path, exist_ok=True)
+        _write(os.path.join(path, "cpu.max"), f"{quota_us} {CGROUP_PERIOD_US}")
+    else:
+        path = os.path.join(CGROUP_ROOT, "cpu", RENDER_CGROUP_NAME)
+        os.makedirs(path, exist_ok=True)
+        _write(os.path.join(path, "cpu.cfs_period_us"), str(CGROUP_PERIOD_US))
+        _write(os.path.join(path, "cpu.cfs_quota_us"), quota_us)
+    logger.info(f"🧮 渲染 cgroup: {path}（CPU quota {RENDER_CPU_QUOTA:g} 顆）")
+    return os.path.join(path, "cgroup.procs")
+
+
+def _cgroup_procs_path():
+    global _cgroup_procs
+    with _cgroup_lock:
+        if _cgroup_procs is None:
+            try:
+                _cgroup_procs = _setup_cgroup()
+            except OSError as e:
+                logger.warning(f"⚠️ 無法設定渲染 cgroup，CPU quota 不生效: {e}")
+                _cgroup_procs = False
+        return _cgroup_procs
+
+
+def _threads(pid):
+    try:
+        return [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        return [pid]
+
+
+def apply_render_scheduling(pid):
+    """子進程啟動後立即呼叫：套用 nice / CPU affinity / cgroup CPU quota（失敗只記錄警告，不影響渲染）"""
+    cpus = render_cpus()
+    for tid in _threads(pid):
+        if RENDER_NICE:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, RENDER_NICE)
+            except OSError as e:
+                _warn_once("nice", f"⚠️ 無法設定渲染 nice 值: {e}")
+        if cpus:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except OSError as e:
+                _warn_once("affinity", f"⚠️ 無法設定渲染 CPU affinity: {e}")
+
+    if RENDER_CPU_QUOTA > 0:
+        procs = _cgroup_procs_path()
+        if procs:
+            try:
+                _write(procs, str(pid))
+            except OSError as e:
+                _warn_once("cgroup", f"⚠️ 無法將渲染加入 cgroup: {e}")
+
+
+def apply_to_current_process():
+    """
+    將目前的 process 設為渲染優先權（獨立渲染服務啟動時呼叫）
+
+    解析引擎與網格處理在服務 process 內執行，也不應與 web 搶 CPU；
+    必須在建立其他 thread 之前呼叫，之後的 thread 與子進程都會繼承
+    """
+    apply_render_scheduling(os.getpid())
+
+
+def scheduling_status():
+    """目前的排程設定（健康檢查用）"""
+    cpus = render_cpus()
+    return {
+        "nice": RENDER_NICE,
+        "cpus": sorted(cpus) if cpus else None,
+        "cpu_quota": RENDER_CPU_QUOTA or None,
+        "cgroup": bool(_cgroup_procs) if RENDER_CPU_QUOTA > 0 else None,
+    }
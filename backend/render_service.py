@@ -0,0 +1,233 @@
+"""
+Render Service - 獨立的渲染服務 process
+OpenSCAD 原本由 gunicorn worker 直接 fork：子 process 複製整個 Flask worker 的記憶體，
+CPU 密集的渲染也和結帳 / 付款回調擠在同一批 process。
+渲染服務是獨立的 process，擁有 OpenSCAD 子 process、STL 快取與 render_pool / render_memory 的名額控制；
+Flask 與背景隊列設定 RENDER_SERVICE_SOCKET 後透過 UNIX socket 送出渲染請求（協定見 render_client.py）
+
+    python render_service.py [--socket /tmp/duet_render.sock]
+
+收到 SIGTERM / SIGINT 時停止接受新連線，進行中的渲染最多再等 RENDER_SERVICE_DRAIN_SECONDS 秒，
+仍未完成的回覆 "restarting"，由用戶端連線到重啟後的服務重新送出；HTTP 請求不會因重啟而失敗
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from font_index import font_index
+from openscad_runner import get_openscad_capabilities
+from render_client import (
+    MessageConnection,
+    error_message,
+    ERROR_RESTARTING,
+    RENDER_SERVICE_SOCKET,
+    SERVICE_CALLS,
+)
+from render_memory import render_memory
+from render_pool import render_pool
+from render_scheduling import apply_to_current_process, scheduling_status
+from stl_renderer import render_stl, stl_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/duet_render.sock"
+# 結束前等待進行中渲染的秒數
+RENDER_SERVICE_DRAIN_SECONDS = float(os.environ.get("RENDER_SERVICE_DRAIN_SECONDS", "60"))
+
+_drain_deadline = None
+_active_lock = threading.Lock()
+_active = 0
+
+
+class RenderRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        global _active
+        conn = MessageConnection(self.request)
+        try:
+            request = conn.receive()
+        except (ConnectionError, ValueError):
+            return
+
+        with _active_lock:
+            _active += 1
+        try:
+            op = request.get("op")
+            if op == "render":
+                self._render(conn, request)
+            elif op == "call":
+                self._call(conn, request)
+            elif op == "status":
+                conn.send(
+                    {
+                        "event": "status",
+                        "pid": os.getpid(),
+                        "active": _active,
+                        "render_pool": render_pool.status(),
+                        "render_memory": render_memory.status(),
+                        "render_scheduling": scheduling_status(),
+                        "stl_cache": stl_cache.stats(),
+                        "geometry_backends": get_openscad_capabilities()["backends"],
+                    }
+                )
+            else:
+                conn.send({"event": "error", "type": "ValueError", "message": f"unknown op: {op}"})
+        except OSError:
+            # 用戶端已離開
+            pass
+        finally:
+            with _active_lock:
+                _active -= 1
+
+    def _call(self, conn, request):
+        """web worker 的快取 / 名額查詢（render_client.SERVICE_CALLS）"""
+        name = request.get("name")
+        function = SERVICE_CALLS.get(name)
+        if function is None:
+            conn.send({"event": "error", "type": "ValueError", "message": f"unknown call: {name}"})
+            return
+        try:
+            response = {"event": "result", "result": function(*request.get("args", []))}
+        except Exception as e:
+            response = error_message(e)
+            if response["type"] not in ("RenderPoolFull", "ValueError"):
+                logger.error(f"❌ 渲染服務查詢錯誤（{name}）: {e}")
+        conn.send(response)
+
+    def _render(self, conn, request):
+        cancel = {"reason": None}
+        finished = threading.Event()
+
+        def watch():
+            # 渲染期間持續讀取用戶端訊息：cancel 要求或連線中斷
+            while not finished.is_set():
+                try:
+                    message = conn.receive()
+                except (OSError, ValueError):
+                    message = None
+                if message is None:
+                    if not finished.is_set():
+                        cancel["reason"] = cancel["reason"] or "client disconnected"
+                    return
+                if message.get("op") == "cancel":
+                    cancel["reason"] = message.get("reason") or "cancelled"
+
+        threading.Thread(target=watch, daemon=True).start()
+
+        def should_cancel():
+            if cancel["reason"]:
+                return cancel["reason"]
+            if _drain_deadline is not None and time.time() > _drain_deadline:
+                return ERROR_RESTARTING
+            return None
+
+        try:
+            stl_path, cache_hit = render_stl(
+                request["params"],
+                request.get("options"),
+                queue_timeout=request.get("queue_timeout"),
+                reject_when_full=request.get("reject_when_full", True),
+                on_stage=lambda stage: conn.send({"event": "stage", "stage": stage}),
+                should_cancel=should_cancel,
+                allow_downgrade=request.get("allow_downgrade", False),
+                low_priority=request.get("low_priority", False),
+            )
+            response = {
+                "event": "done",
+                "stl_path": os.path.abspath(stl_path),
+                "cache_hit": cache_hit,
+            }
+        except Exception as e:
+            response = error_message(e)
+            if getattr(e, "reason", None) == ERROR_RESTARTING:
+                response.update(type=ERROR_RESTARTING, message="render service restarting")
+            elif response["type"] not in ("RenderCancelled", "RenderPoolFull"):
+                logger.error(f"❌ 渲染服務錯誤: {e}")
+        finally:
+            finished.set()
+        conn.send(response)
+
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # 上一個服務異常結束時遺留的 socket 檔；仍有服務在監聽時不搶佔
+        if os.path.exists(self.server_address):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.server_address)
+                raise RuntimeError(f"渲染服務已在執行: {self.server_address}")
+            except ConnectionRefusedError:
+                os.unlink(self.server_address)
+            except FileNotFoundError:
+                pass
+            finally:
+                probe.close()
+        super().server_bind()
+
+
+def _stop(server):
+    """停止接受新連線，等待進行中的渲染（最多 RENDER_SERVICE_DRAIN_SECONDS 秒）"""
+    global _drain_deadline
+    _drain_deadline = time.time() + RENDER_SERVICE_DRAIN_SECONDS
+    logger.info(f"🛑 渲染服務停止中，等待進行中的渲染（最多 {RENDER_SERVICE_DRAIN_SECONDS:.0f}s）")
+    server.shutdown()
+
+
+def serve(socket_path):
+    server = RenderServer(socket_path, RenderRequestHandler)
+
+    def on_signal(signum, frame):
+        # shutdown() 會等待 serve_forever 結束，不能在 serve_forever 所在的 thread 呼叫
+        threading.Thread(target=_stop, args=(server,), daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    logger.info(f"🚀 渲染服務已啟動: {socket_path}（pid {os.getpid()}）")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+    # 新的服務已可綁定同一個 socket；這裡只等待舊連線收尾
+    while True:
+        with _active_lock:
+            active = _active
+        if not active:
+            break
+        time.sleep(0.2)
+    logger.info("✅ 渲染服務已結束")
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description="DUET 渲染服務（UNIX socket）")
+    parser.add_argument(
+        "--socket",
+        default=RENDER_SERVICE_SOCKET or DEFAULT_SOCKET,
+        help="監聽的 UNIX socket 路徑（預設 RENDER_SERVICE_SOCKET）",
+    )
+    args = parser.parse_args(argv)
+
+    # 服務本身（解析引擎、網格處理）與之後 fork 的 OpenSCAD 都使用渲染的 CPU 排程
+    apply_to_current_process()
+    logger.info(f"🧩 OpenSCAD 幾何後端: {', '.join(get_openscad_capabilities()['backends'])}")
+    font_index.build()
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Render Telemetry - 每次 OpenSCAD 渲染的結構化記錄
+解析 openscad 的 stderr（成功時原本直接丟棄），連同字體 / 字母 / 尺寸 / $fn 存成 JSON Lines，
+再依字體彙總，找出哪些字體最慢、最常出問題
+
+每筆記錄：
+    stage：full / core / bail（duet.scad 的 mode）；STL 快取命中（cache）、共用進行中的渲染（coalesced）
+        與解析引擎也各記一筆
+    wall_seconds：實際執行時間；render_seconds：openscad 回報的 Total rendering time（CGAL / Manifold 階段），
+        compile_seconds：兩者之差（解析 / CSG tree 建立 / 匯出）
+    vertices / facets / volumes：openscad 回報的頂層物件統計
+    geometry_cache / cgal_cache：openscad 內部快取的項目數
+    warnings：WARNING / DEPRECATED 行；font_fallback：警告中提到字體（OpenSCAD 改用預設字體）
+
+渲染的前後文（字體、字母、品質）由 render_stl 以 render_context 設定在目前的 thread，
+_run_scad_once 只需回報 openscad 的結果
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+RENDER_TELEMETRY_PATH = os.environ.get("RENDER_TELEMETRY_PATH", "render_telemetry.jsonl")
+# 超過此大小時輪替為 .1（只保留一份舊檔）
+RENDER_TELEMETRY_MAX_BYTES = int(os.environ.get("RENDER_TELEMETRY_MAX_MB", "20")) * 1024 * 1024
+
+# 每筆記錄保留的警告行數
+MAX_WARNINGS = 10
+
+_TOTAL_TIME_CLOCK = re.compile(r"Total rendering time:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_TOTAL_TIME_WORDS = re.compile(
+    r"Total rendering time:\s*(\d+) hours?, (\d+) minutes?, (\d+(?:\.\d+)?) seconds?"
+)
+_RENDER_BACKEND = re.compile(r"Rendering Polygon Mesh using (\w+)")
+_COUNTS = {
+    "vertices": re.compile(r"^\s*Vertices:\s*(\d+)", re.MULTILINE),
+    "facets": re.compile(r"^\s*Facets:\s*(\d+)", re.MULTILINE),
+    "volumes": re.compile(r"^\s*Volumes:\s*(\d+)", re.MULTILINE),
+    "geometry_cache": re.compile(r"Geometries in cache:\s*(\d+)"),
+    "cgal_cache": re.compile(r"CGAL Polyhedrons in cache:\s*(\d+)"),
+}
+_WARNING = re.compile(r"^(WARNING|DEPRECATED|ERROR):\s*(.+)$", re.MULTILINE)
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def parse_openscad_stderr(stderr):
+    """
+    解析 openscad 的 stderr
+
+    Returns:
+        dict: render_seconds / backend / vertices / facets / volumes / geometry_cache /
+            cgal_cache / warnings / errors / font_fallback（沒出現的欄位不列出）
+    """
+    stderr = stderr or ""
+    parsed = {}
+
+    match = _TOTAL_TIME_CLOCK.search(stderr) or _TOTAL_TIME_WORDS.search(stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        parsed["render_seconds"] = round(int(hours) * 3600 + int(minutes) * 60 + float(seconds), 3)
+
+    match = _RENDER_BACKEND.search(stderr)
+    if match:
+        parsed["backend"] = match.group(1).lower()
+
+    for field, pattern in _COUNTS.items():
+        matches = pattern.findall(stderr)
+        if matches:
+            # 墜頭模式會 import 核心，頂層物件的統計出現在最後
+            parsed[field] = int(matches[-1])
+
+    warnings = []
+    errors = []
+    for level, message in _WARNING.findall(stderr):
+        (errors if level == "ERROR" else warnings).append(message.strip())
+    parsed["warnings"] = warnings[:MAX_WARNINGS]
+    parsed["errors"] = errors[:MAX_WARNINGS]
+    parsed["font_fallback"] = any("font" in message.lower() for message in warnings)
+    return parsed
+
+
+# ---------- 記錄 ----------
+
+
+@contextmanager
+def render_context(params, quality=None, engine=None):
+    """設定目前 thread 的渲染前後文（字體、字母、尺寸、品質），期間的記錄都會帶上"""
+    previous = getattr(_local, "context", None)
+    _local.context = {
+        "letters": f"{params['letter1']}{params['letter2']}",
+        "font1": params["font1"],
+        "font2": params["font2"],
+        "size": params["size"],
+        "quality": quality,
+        "engine": engine,
+    }
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+def update_context(**fields):
+    """修改目前 thread 的渲染前後文（例如記憶體不足降級後的品質）"""
+    context = getattr(_local, "context", None)
+    if context is not None:
+        context.update(fields)
+
+
+def _rotate_if_needed():
+    try:
+        if os.path.getsize(RENDER_TELEMETRY_PATH) > RENDER_TELEMETRY_MAX_BYTES:
+            os.replace(RENDER_TELEMETRY_PATH, RENDER_TELEMETRY_PATH + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def record(stage, **fields):
+    """寫入一筆記錄（自動帶上目前 thread 的渲染前後文）"""
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "stage": stage,
+        **(getattr(_local, "context", None) or {}),
+        **fields,
+    }
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    try:
+        with _write_lock, open(RENDER_TELEMETRY_PATH, "a", encoding="utf-8") as f:
+            # 多個 gunicorn worker 同時附加寫入
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        _rotate_if_needed()
+    except OSError as e:
+        logger.warning(f"⚠️ 無法寫入渲染記錄: {e}")
+    return entry
+
+
+def record_openscad(defines, backend, result, wall_seconds):
+    """
+    記錄一次 openscad 執行（defines 為 *_library_defines 的 dict）
+
+    Returns:
+        dict: 寫入的記錄
+    """
+    parsed = parse_openscad_stderr(result.stderr)
+    fields = {
+        "engine": "openscad",
+        "backend": parsed.pop("backend", backend),
+        "fn": defines.get("$fn"),
+        "returncode": result.returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_mb": getattr(result, "peak_rss_mb", None),
+        **parsed,
+    }
+    if "render_seconds" in parsed:
+        fields["compile_seconds"] = round(max(0.0, wall_seconds - parsed["render_seconds"]), 3)
+
+    entry = record(defines.get("mode", "full"), **fields)
+    for warning in entry["warnings"]:
+        logger.warning(f"⚠️ OpenSCAD: {warning}")
+    if entry["font_fallback"]:
+        logger.warning(f"⚠️ OpenSCAD 字體 fallback: {entry.get('font1')} / {entry.get('font2')}")
+    return entry
+
+
+# ---------- 彙總 ----------
+
+
+def _load_records(since=None):
+    records = []
+    for path in (RENDER_TELEMETRY_PATH + ".1", RENDER_TELEMETRY_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if since and entry.get("timestamp", "") < since:
+                        continue
+                    records.append(entry)
+        except FileNotFoundError:
+            continue
+    return records
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def font_aggregates(days=None):
+    """
+    依字體彙總渲染記錄（每筆記錄同時計入兩個字體）
+
+    墜頭階段（bail）與字體無關，不計入
+
+    Args:
+        days: 只統計最近幾天（None = 全部記錄）
+
+    Returns:
+        list: 每個字體一筆，依平均渲染秒數由慢到快排序
+    """
+    since = None
+    if days:
+        since = datetime.fromtimestamp(time.time() - days * 86400).isoformat()
+
+    fonts = {}
+    for entry in _load_records(since):
+        if entry.get("stage") == "bail":
+            continue
+        for font in {entry.get("font1"), entry.get("font2")}:
+            if not font:
+                continue
+            stats = fonts.setdefault(
+                font,
+                {
+                    "font": font,
+                    "renders": 0,
+                    "cache_hits": 0,
+                    "failures": 0,
+                    "font_fallbacks": 0,
+                    "wall_seconds": [],
+                    "facets": [],
+                    "peak_rss_mb": [],
+                },
+            )
+            if entry["stage"] in ("cache", "coalesced"):
+                stats["cache_hits"] += 1
+                continue
+            stats["renders"] += 1
+            if entry.get("returncode"):
+                stats["failures"] += 1
+            if entry.get("font_fallback"):
+                stats["font_fallbacks"] += 1
+            for field in ("wall_seconds", "facets", "peak_rss_mb"):
+                if entry.get(field) is not None:
+                    stats[field].append(entry[field])
+
+    result = []
+    for stats in fonts.values():
+        seconds = stats.pop("wall_seconds")
+        facets = stats.pop("facets")
+        peaks = stats.pop("peak_rss_mb")
+        stats["avg_seconds"] = round(sum(seconds) / len(seconds), 2) if seconds else None
+        stats["p95_seconds"] = round(_percentile(seconds, 0.95), 2) if seconds else None
+        stats["max_seconds"] = round(max(seconds), 2) if seconds else None
+        stats["avg_facets"] = int(sum(facets) / len(facets)) if facets else None
+        stats["max_peak_rss_mb"] = max(peaks) if peaks else None
+        result.append(stats)
+
+    result.sort(key=lambda stats: stats["avg_seconds"] or 0, reverse=True)
+    return result
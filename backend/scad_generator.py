@@ -1,113 +1,259 @@
-def generate_scad_script(letter1, letter2, font1, font2, size, 
-                        bailRelativeX, bailRelativeY, bailRelativeZ, bailRotation):
-    """
-    簡化備份版本 - 只使用 9 個參數
-    
-    改用這個版本的原因：
-    1. BBox版本過於複雜，導致墜頭位置計算錯誤
-    2. 使用 resize([0, 0, target_height], auto=true) 配合 halign/valign="center" 更簡單穩定
-    3. intersection 的中心自然在原點 (0, 0, 0)
-    4. 墜頭位置計算直接用 relative 向量，不需要複雜的絕對座標轉換
-    
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+# 靜態模型庫：渲染時以 -D 參數驅動，不再為每個請求寫出新的 .scad
+DUET_LIBRARY_PATH = os.environ.get(
+    "DUET_SCAD_LIBRARY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "duet.scad")
+)
+
+# 墜頭參數（與前端一致）
+BAIL_RADIUS = 1.85  # innerRadius(1.5) + tubeRadius(0.35)
+BAIL_TUBE = 0.35    # 管半徑 0.35mm，直徑 0.7mm
+
+# 緊貼擠出深度的安全餘量（兩側合計 mm）
+DEPTH_MARGIN = 1.0
+
+
+def get_fn_for_size(size):
+    """動態精度設定"""
+    if size <= 20:
+        return 64      # 小尺寸 - 最高精度
+    elif size <= 25:
+        return 56      # 中尺寸 - 高精度
+    else:
+        return 48      # 大尺寸 - 較高精度
+
+
+def get_tight_depths(metrics1, metrics2, size):
+    """
+    依另一個字母的寬度計算緊貼的擠出深度
+
+    Letter 1 沿 Y 軸擠出，交集只會落在 Letter 2 的寬度範圍內（反之亦然），
+    不需要固定擠出 size * 5
+
+    參數:
+        metrics1, metrics2: glyph_metrics.GlyphMetrics；任一為 None 時回到 size * 5
+
+    Returns:
+        tuple: (depth1, depth2)
+    """
+    if not (metrics1 and metrics2):
+        return size * 5.0, size * 5.0
+    depth1 = round(2 * metrics2.half_width(size) + DEPTH_MARGIN, 3)
+    depth2 = round(2 * metrics1.half_width(size) + DEPTH_MARGIN, 3)
+    return depth1, depth2
+
+
+def _scad_string(value):
+    """轉成 SCAD 字串常值（路徑中的反斜線與引號需跳脫）"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+# ==========================================
+# 靜態模型庫（duet.scad）的 -D 參數
+# ==========================================
+
+
+@lru_cache(maxsize=1)
+def get_library_identity():
+    """
+    模型庫的識別：檔內宣告的版本 + 內容雜湊（放入渲染快取 key）
+
+    Returns:
+        str: 例如 "duet.scad@1:3f2a9c..."
+    """
+    with open(DUET_LIBRARY_PATH, "rb") as f:
+        content = f.read()
+    match = re.search(rb"^duet_library_version\s*=\s*(\d+);", content, re.MULTILINE)
+    version = match.group(1).decode() if match else "?"
+    return f"duet.scad@{version}:{hashlib.sha256(content).hexdigest()[:16]}"
+
+
+def _scad_literal(value):
+    """Python 值 → SCAD 常值（字串、數字、布林、巢狀陣列）"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return _scad_string(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(_scad_literal(v) for v in value) + "]"
+    if isinstance(value, int):
+        return str(value)
+    return f"{float(value):.10g}"
+
+
+def format_scad_defines(defines):
+    """
+    -D 參數清單（每個元素為 "name=value"，依序傳給 openscad）
+
+    Args:
+        defines: dict，名稱 → Python 值
+    """
+    return [f"{name}={_scad_literal(value)}" for name, value in defines.items()]
+
+
+def _resolution_defines(size, quality=None):
+    if not quality:
+        return {"$fn": get_fn_for_size(size), "bail_fn": 32, "bail_tube_fn": 24}
+    return {
+        "$fn": quality["fn"],
+        "$fa": quality["fa"],
+        "$fs": quality["fs"],
+        "bail_fn": quality["bail_fn"],
+        "bail_tube_fn": quality["bail_tube_fn"],
+    }
+
+
+def _bail_defines(pos_x, pos_y, pos_z, bail_rotation):
+    # 前端墜頭有初始 90° 偏移
+    return {
+        "bail_radius": BAIL_RADIUS,
+        "bail_tube": BAIL_TUBE,
+        "pos_x": pos_x,
+        "pos_y": pos_y,
+        "pos_z": pos_z,
+        "bail_rotation": bail_rotation + 90,
+    }
+
+
+def _outline_defines(prefix, outline, target_h):
+    """
+    字形輪廓 → glyphN_* 參數
+
+    對齊方式與 letter_geometry 相同：
+    halign="center" 以前進寬度置中、valign="center" 以墨水範圍置中，
+    再等比縮放使墨水高度 = target_h（等同 resize([0, target_h, 0], auto=true)）
+    """
+    xmin, ymin, xmax, ymax = outline.bbox
+
+    def contours(items):
+        return [[[round(x, 2), round(y, 2)] for x, y in c.tolist()] for c in items]
+
+    return {
+        f"{prefix}_outers": contours(outline.outer_contours()),
+        f"{prefix}_holes": contours(outline.hole_contours()),
+        f"{prefix}_scale": target_h / (ymax - ymin),
+        f"{prefix}_offset": [-outline.advance / 2.0, -(ymax + ymin) / 2.0],
+    }
+
+
+def _letter_defines(letter1, letter2, font1, font2, size,
+                    prism1_path=None, prism2_path=None,
+                    outline1=None, outline2=None, metrics1=None, metrics2=None):
+    """字母參數；字母來源的優先順序：柱體 > 字形輪廓 > text"""
+    defines = {
+        "letter1": letter1,
+        "letter2": letter2,
+        "font1": font1,
+        "font2": font2,
+        "target_height": size,
+    }
+
+    depth = size * 5.0  # 確保完全交集
+    if prism1_path and prism2_path:
+        depth1, depth2 = get_tight_depths(metrics1, metrics2, size)
+        defines.update(
+            letter_source="prism",
+            prism1=prism1_path,
+            prism2=prism2_path,
+            prism_depth=depth,
+            depth1=depth1,
+            depth2=depth2,
+        )
+    elif outline1 and outline2:
+        depth1, depth2 = get_tight_depths(metrics1, metrics2, size)
+        defines.update(letter_source="outline", depth1=depth1, depth2=depth2)
+        defines.update(_outline_defines("glyph1", outline1, size))
+        defines.update(_outline_defines("glyph2", outline2, size))
+    else:
+        defines.update(letter_source="text", depth1=depth, depth2=depth)
+    return defines
+
+
+def model_library_defines(letter1, letter2, font1, font2, size,
+                          bailRelativeX, bailRelativeY, bailRelativeZ, bailRotation,
+                          outline1=None, outline2=None, metrics1=None, metrics2=None,
+                          quality=None):
+    """
+    完整模型（字母交集 + 墜頭）的 -D 參數
+
     參數:
         letter1, letter2: 字母
         font1, font2: 字體名稱
         size: 目標高度 (mm)
         bailRelativeX, bailRelativeY, bailRelativeZ: 墜頭相對位置向量
         bailRotation: 墜頭旋轉角度 (degrees)
+        outline1, outline2: glyph_outline.GlyphOutline；兩者都提供時以 polygon()
+            取代 text()，不再依賴 OpenSCAD 的字體查找
+        metrics1, metrics2: glyph_metrics.GlyphMetrics；字形輪廓模式下用來計算緊貼的擠出深度
+        quality: quality_tiers 的解析度設定；未提供時使用依尺寸決定的 $fn
     """
-    
-    # 動態精度設定
-    if size <= 20:
-        fn = 64      # 小尺寸 - 最高精度
-    elif size <= 25:
-        fn = 56      # 中尺寸 - 高精度
-    else:
-        fn = 48      # 大尺寸 - 較高精度
-    
-    depth = size * 5.0  # 確保完全交集
-    
-    # 墜頭參數（與前端一致）
-    bail_radius = 1.85  # innerRadius(1.5) + tubeRadius(0.35)
-    bail_tube = 0.35    # 管半徑 0.35mm，直徑 0.7mm
-    
-    # 使用相對向量計算墜頭位置
-    pos_x = bailRelativeX
-    pos_y = bailRelativeY
-    pos_z = bailRelativeZ
-    
-    # 前端墜頭有初始 90° 偏移
-    bail_rotation_deg = bailRotation + 90
-    
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"📐 目標高度: {size}mm, 深度: {depth}mm, $fn: {fn}")
-    logger.info(f"📐 墜頭半徑: {bail_radius}mm, 管半徑: {bail_tube}mm")
-    logger.info(f"📍 墜頭相對位置: X={pos_x}, Y={pos_y}, Z={pos_z}")
-    logger.info(f"🔄 墜頭旋轉: {bail_rotation_deg}° (前端{bailRotation}° + 90°)")
-    
-    scad_script = f'''// DUET Z-Up 簡化穩定版
-// 使用 resize + halign/valign="center" 確保中心在原點
-$fn = {fn};
-
-letter1 = "{letter1}";
-letter2 = "{letter2}";
-font1 = "{font1}";
-font2 = "{font2}";
-target_height = {size};
-depth = {depth};
-bail_radius = {bail_radius};
-bail_tube = {bail_tube};
-pos_x = {pos_x};
-pos_y = {pos_y};
-pos_z = {pos_z};
-bail_rotation = {bail_rotation_deg};
-
-// 字母幾何模組 - 使用 resize 自動調整到目標高度
-module letter_geometry(char, font_name, target_h) {{
-    resize([0, target_h, 0], auto=true)
-        text(char, font=font_name, halign="center", valign="center");
-}}
-
-// Letter 1: 平行於 XZ 平面
-module letter1_shape() {{
-    rotate([90, 0, 0])
-        linear_extrude(height=depth, center=true)
-            letter_geometry(letter1, font1, target_height);
-}}
-
-// Letter 2: 平行於 YZ 平面（外層繞 Z 軸旋轉 90°）
-module letter2_shape() {{
-    rotate([0, 0, 90])
-        rotate([90, 0, 0])
-            linear_extrude(height=depth, center=true)
-                letter_geometry(letter2, font2, target_height);
-}}
-
-// 墜頭：torus 環
-module bail() {{
-    translate([pos_x, pos_y, pos_z])
-        rotate([0, 0, bail_rotation])
-            rotate([90, 0, 0])
-                rotate_extrude(angle=360, $fn=32)
-                    translate([bail_radius, 0, 0])
-                        circle(r=bail_tube, $fn=24);
-}}
-
-// 主組件：intersection + bail
-union() {{
-    intersection() {{
-        letter1_shape();
-        letter2_shape();
-    }}
-    bail();
-}}
-'''
-    
-    # Debug: 輸出生成的 SCAD 內容（前 50 行）
-    logger.info("📄 Generated SCAD content (first 50 lines):")
-    lines = scad_script.split('\n')
-    for i, line in enumerate(lines[:50], 1):
-        logger.info(f"  {i:3}: {line}")
-    
-    return scad_script
+    return {
+        "mode": "full",
+        **_resolution_defines(size, quality),
+        **_letter_defines(letter1, letter2, font1, font2, size,
+                          outline1=outline1, outline2=outline2,
+                          metrics1=metrics1, metrics2=metrics2),
+        **_bail_defines(bailRelativeX, bailRelativeY, bailRelativeZ, bailRotation),
+    }
+
+
+def core_library_defines(letter1, letter2, font1, font2, size,
+                         prism1_path=None, prism2_path=None,
+                         outline1=None, outline2=None,
+                         metrics1=None, metrics2=None, quality=None):
+    """
+    字母交集核心（不含墜頭）的 -D 參數
+
+    只和字母、字體、尺寸（$fn）有關，墜頭位置 / 旋轉改變時可直接重用快取結果
+
+    參數:
+        prism1_path, prism2_path: 預先擠出的字母柱體 STL（glyph_cache）；
+            兩者都提供時改用 import()，OpenSCAD 只需做布林交集，不再呼叫 text()
+        outline1, outline2: 字形輪廓（glyph_outline）；沒有柱體時以 polygon() 取代 text()
+        metrics1, metrics2: 字形度量（glyph_metrics）；柱體 / 字形輪廓模式下改用緊貼的擠出深度
+    """
+    return {
+        "mode": "core",
+        **_resolution_defines(size, quality),
+        **_letter_defines(letter1, letter2, font1, font2, size,
+                          prism1_path, prism2_path, outline1, outline2, metrics1, metrics2),
+    }
+
+
+def bail_library_defines(core_stl_path, bailRelativeX, bailRelativeY,
+                         bailRelativeZ, bailRotation, quality=None):
+    """
+    墜頭組合的 -D 參數：import() 已渲染的交集核心 STL，再 union torus 墜頭
+
+    參數:
+        core_stl_path: 交集核心 STL 的絕對路徑
+        quality: quality_tiers 的解析度設定（決定 torus 分段數）
+    """
+    return {
+        "mode": "bail",
+        "core_stl": core_stl_path,
+        **_bail_defines(bailRelativeX, bailRelativeY, bailRelativeZ, bailRotation),
+        "bail_fn": quality["bail_fn"] if quality else 32,
+        "bail_tube_fn": quality["bail_tube_fn"] if quality else 24,
+    }
+
+
+def prism_library_defines(char, font, size, outline=None, quality=None):
+    """
+    單一字母柱體（glyph_cache）的 -D 參數：resize 到目標高度後沿 Z 軸置中擠出（不旋轉）
+
+    同一個柱體可同時作為 letter1 或 letter2 使用；提供 outline（glyph_outline）時改用 polygon()；
+    quality 為柱體所代替的交集核心的解析度設定（quality_tiers）
+    """
+    resolution = _resolution_defines(size, quality)
+    defines = {
+        "mode": "prism",
+        **{name: value for name, value in resolution.items() if name.startswith("$")},
+        **_letter_defines(char, char, font, font, size, outline1=outline, outline2=outline),
+    }
+    # 與交集核心的 prism_depth 相同深度
+    defines["depth1"] = size * 5.0
+    return defines
@@ -0,0 +1,118 @@
+"""
+Single Flight - 相同渲染同時只執行一次（跨 gunicorn worker）
+顧客連點下載、前端逾時重送、背景工作與 HTTP 請求剛好是同一個設計時，
+原本會有兩個一模一樣的 OpenSCAD 同時執行
+
+每個快取 key 一個 fcntl 檔案鎖（RENDER_POOL_DIR/inflight/<key>.lock）：
+- 先取得鎖的請求負責渲染，完成後寫入 stl_cache 才釋放
+- 後到的請求等待鎖釋放後直接讀快取；先到的失敗（快取仍沒有）時改由它自己渲染
+- process 崩潰時鎖自動釋放；鎖檔由持有者在釋放前刪除，不會累積
+"""
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from openscad_runner import RenderCancelled
+from render_pool import render_pool, RenderPoolFull, RENDER_POOL_DIR, POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_DIR = os.path.join(RENDER_POOL_DIR, "inflight")
+os.makedirs(INFLIGHT_DIR, exist_ok=True)
+
+
+def _try_acquire(path):
+    """
+    嘗試取得鎖，成功返回檔案物件
+
+    取得鎖後確認路徑仍指向同一個檔案：上一個持有者可能在我們開檔後、上鎖前刪除了它
+    """
+    fd = open(path, "a")
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        fd.close()
+        return None
+    try:
+        if os.stat(path).st_ino == os.fstat(fd.fileno()).st_ino:
+            return fd
+    except FileNotFoundError:
+        pass
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    fd.close()
+    return None
+
+
+@contextmanager
+def key_lock(key, timeout=None, should_cancel=None, blocking=True):
+    """
+    取得 key 的渲染鎖
+
+    Args:
+        blocking: False 時不等待：已有其他請求持有鎖就拋出 RenderCancelled
+            （已持有渲染名額的低優先權渲染用，不佔著名額空等）
+
+    Yields:
+        bool: 是否等待過（其他請求剛渲染過同一個 key，呼叫端應先查快取）
+
+    Raises:
+        RenderPoolFull: 等待逾時
+        RenderCancelled: 等待期間被取消，或 blocking=False 時鎖已被持有
+    """
+    path = os.path.join(INFLIGHT_DIR, f"{key}.lock")
+    start = time.time()
+    waited = False
+
+    while True:
+        fd = _try_acquire(path)
+        if fd:
+            break
+
+        if not blocking:
+            raise RenderCancelled("same design is already rendering")
+
+        if not waited:
+            logger.info(f"🤝 相同設計正在渲染，等待結果（{key[:12]}）")
+            waited = True
+
+        reason = should_cancel() if should_cancel else None
+        if reason:
+            raise RenderCancelled(reason)
+
+        if timeout is not None and time.time() - start > timeout:
+            logger.warning(f"🤝 等待相同設計的渲染逾時（{timeout}s）")
+            raise RenderPoolFull(render_pool.estimate_retry_after())
+
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        yield waited
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        fd.close()
+
+
+def coalesce(key, lookup, produce, timeout=None, should_cancel=None, blocking=True):
+    """
+    相同 key 同時只執行一次 produce
+
+    Args:
+        lookup: 查詢結果（通常是 stl_cache.get），沒有時返回 None
+        produce: 產生結果；完成前必須寫入 lookup 查得到的地方
+        blocking: 見 key_lock
+
+    Returns:
+        tuple: (produce 或 lookup 的結果, shared) - shared 為 True 表示共用了其他請求的渲染
+    """
+    with key_lock(key, timeout=timeout, should_cancel=should_cancel, blocking=blocking):
+        # 呼叫端查過快取之後、取得鎖之前，其他請求可能剛好完成同一個 key
+        result = lookup()
+        if result is not None:
+            return result, True
+        return produce(), False
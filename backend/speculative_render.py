@@ -0,0 +1,327 @@
+"""
+Speculative Render - 結帳時預先渲染購物車商品的 STL
+原本 STL 要等綠界付款回調、背景 Worker 輪詢到隊列後才開始渲染；
+訂單一存好就以低優先權先渲染，付款確認時 STL 通常已在 stl_cache 中，
+內部 STL Email 在付款後數秒內就能寄出（仍在渲染的設計由 single_flight 合併，不會重複執行 OpenSCAD）
+
+- 結果直接存進 stl_cache（以設計參數為 key），與訂單的 STL 生成共用
+- 只使用閒置的渲染名額（render_pool 的 low_priority），不拖慢顧客的即時預覽
+- 每筆訂單一個 manifest（SPECULATIVE_DIR/<order_id>.json）記錄預先渲染產生的快取 key：
+  付款成功時 claim、付款失敗時 discard；未付款超過 SPECULATIVE_TTL_HOURS 的訂單，
+  由背景 Worker 刪除這些快取項目（期間被其他請求命中過的保留）
+
+AI 諮詢推薦字體時也以同樣方式預先渲染推薦的字體搭配（設計頁預覽的品質，預設 draft），
+顧客在設計頁第一次預覽時就是快取命中；這類結果不屬於任何訂單，依一般 LRU 淘汰
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from render_client import render_stl, compute_render_key, cache_last_used, remove_cached_stl
+from render_pool import RenderPoolFull
+from stl_renderer import STLRenderError, RenderCancelled
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_RENDER = os.environ.get("SPECULATIVE_RENDER", "true").lower() == "true"
+SPECULATIVE_DIR = os.environ.get("SPECULATIVE_DIR", "speculative_renders")
+SPECULATIVE_TTL_SECONDS = int(float(os.environ.get("SPECULATIVE_TTL_HOURS", "2")) * 3600)
+SPECULATIVE_THREADS = int(os.environ.get("SPECULATIVE_THREADS", "1"))
+# 本 process 尚未完成的預先渲染上限（超過時新的結帳不再預先渲染）
+SPECULATIVE_MAX_PENDING = int(os.environ.get("SPECULATIVE_MAX_PENDING", "8"))
+# 推薦字體的預先渲染：等待閒置名額超過此秒數就放棄（顧客多半已經自己預覽過了）
+PREFETCH_MAX_WAIT = float(os.environ.get("PREFETCH_MAX_WAIT", "600"))
+
+STATE_PENDING = "pending"
+STATE_CLAIMED = "claimed"
+STATE_DISCARDED = "discarded"
+
+# 付款成功後的訂單狀態：這些訂單的預先渲染結果不可刪除
+UNPAID_ORDER_STATUSES = (None, "pending", "payment_failed")
+
+os.makedirs(SPECULATIVE_DIR, exist_ok=True)
+
+
+class SpeculativeRenders:
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, SPECULATIVE_THREADS), thread_name_prefix="stl-speculative"
+        )
+        # 推薦字體的預覽另用一個執行緒池，不會排在已結帳訂單的前面
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=max(1, SPECULATIVE_THREADS), thread_name_prefix="stl-prefetch"
+        )
+        self._pending_lock = threading.Lock()
+        self._pending = 0
+
+    def _manifest_path(self, order_id):
+        safe_id = re.sub(r"[^\w-]", "_", str(order_id))
+        return os.path.join(self.state_dir, f"{safe_id}.json")
+
+    def _load(self, order_id):
+        try:
+            with open(self._manifest_path(order_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, manifest):
+        path = self._manifest_path(manifest["order_id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def _locked(self):
+        """manifest 的讀寫鎖（渲染完成的 thread 與處理付款回調的 worker 可能同時修改）"""
+        with open(os.path.join(self.state_dir, "manifest.lock"), "w") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _update(self, order_id, **fields):
+        with self._locked():
+            manifest = self._load(order_id)
+            if manifest is None:
+                return None
+            manifest.update(fields)
+            self._save(manifest)
+            return manifest
+
+    def _reserve(self, count):
+        """佔用 count 個待處理名額，超過 SPECULATIVE_MAX_PENDING 時返回 False"""
+        with self._pending_lock:
+            if self._pending + count > SPECULATIVE_MAX_PENDING:
+                return False
+            self._pending += count
+            return True
+
+    def _uncached(self, designs):
+        """去除重複與快取已有的設計，返回 {key: (params, options)}"""
+        todo = {}
+        for params, options in designs:
+            key = compute_render_key(params, options)
+            if key not in todo and cache_last_used(key) is None:
+                todo[key] = (params, options)
+        return todo
+
+    def _run(self, label, params, options, should_cancel, on_stage=None):
+        """
+        以低優先權渲染一個設計
+
+        Returns:
+            bool: 結果是這次渲染產生的（不是快取命中，也不是共用其他請求的渲染）
+        """
+        try:
+            _, cache_hit = render_stl(
+                params,
+                options,
+                queue_timeout=None,
+                reject_when_full=False,
+                on_stage=on_stage,
+                should_cancel=should_cancel,
+                low_priority=True,
+            )
+            return not cache_hit
+        except RenderCancelled as e:
+            logger.info(f"🔮 預先渲染已取消: {label}（{e.reason}）")
+        except (STLRenderError, RenderPoolFull) as e:
+            # 之後的正式請求會重新渲染並依原本的錯誤處理回報
+            logger.warning(f"⚠️ 預先渲染失敗: {label} - {e}")
+        except Exception as e:
+            logger.error(f"❌ 預先渲染錯誤: {label} - {e}")
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+        return False
+
+    # ---------- 結帳 ----------
+
+    def start(self, order_id, designs):
+        """
+        預先渲染訂單的所有設計（立即返回）
+
+        Args:
+            designs: [(params, options), ...]，必須與付款後生成 STL 時使用的參數相同，才會共用快取
+
+        Returns:
+            int: 排入預先渲染的設計數（快取已有的不列入）
+        """
+        if not SPECULATIVE_RENDER:
+            return 0
+
+        todo = self._uncached(designs)
+        if not todo:
+            return 0
+        if not self._reserve(len(todo)):
+            logger.info(f"🔮 預先渲染已滿，略過訂單 {order_id}")
+            return 0
+
+        now = time.time()
+        with self._locked():
+            self._save(
+                {
+                    "order_id": order_id,
+                    "state": STATE_PENDING,
+                    "created_at": datetime.now().isoformat(),
+                    "expires_at": now + SPECULATIVE_TTL_SECONDS,
+                    "rendered": {},
+                }
+            )
+
+        for key, (params, options) in todo.items():
+            self._executor.submit(self._render_for_order, order_id, key, params, options)
+        logger.info(f"🔮 訂單 {order_id} 預先渲染 {len(todo)} 個設計")
+        return len(todo)
+
+    def _cancel_reason(self, order_id, rendering):
+        manifest = self._load(order_id)
+        if manifest is None or manifest["state"] == STATE_DISCARDED:
+            return "speculative render discarded"
+        if manifest["state"] == STATE_CLAIMED and not rendering.is_set():
+            # 已付款：訂單 STL 會以一般優先權渲染同一個設計，還在等閒置名額的預先渲染不必再等；
+            # 已在執行 OpenSCAD 的繼續完成，訂單的請求由 single_flight 共用結果
+            return "order paid"
+        if manifest["state"] == STATE_PENDING and time.time() > manifest["expires_at"]:
+            return "speculative render expired"
+        return None
+
+    def _render_for_order(self, order_id, key, params, options):
+        label = f"訂單 {order_id}"
+        rendering = threading.Event()
+
+        def on_stage(stage):
+            if stage == "rendering":
+                rendering.set()
+
+        if not self._run(
+            label, params, options, lambda: self._cancel_reason(order_id, rendering), on_stage
+        ):
+            # 快取命中或共用其他請求的結果：快取項目不屬於這筆預先渲染，到期時不刪除
+            return
+        with self._locked():
+            manifest = self._load(order_id)
+            if manifest is not None:
+                manifest["rendered"][key] = time.time()
+                self._save(manifest)
+        logger.info(f"🔮 預先渲染完成: {label} ({key[:12]})")
+
+    # ---------- AI 推薦字體 ----------
+
+    def prefetch(self, designs):
+        """
+        預先渲染即將被預覽的設計（立即返回，不記錄 manifest、不會過期刪除）
+
+        Args:
+            designs: [(params, options), ...]，依優先順序排列；名額不足時只排入前面的設計
+
+        Returns:
+            int: 排入預先渲染的設計數
+        """
+        if not SPECULATIVE_RENDER:
+            return 0
+
+        deadline = time.time() + PREFETCH_MAX_WAIT
+
+        def should_cancel():
+            if time.time() > deadline:
+                return "prefetch expired"
+            return None
+
+        queued = 0
+        for key, (params, options) in self._uncached(designs).items():
+            if not self._reserve(1):
+                break
+            label = f"{params['letter1']}{params['letter2']} {params['font1']} / {params['font2']}"
+            self._prefetch_executor.submit(self._run, label, params, options, should_cancel)
+            queued += 1
+        if queued:
+            logger.info(f"🔮 預先渲染 {queued} 組推薦字體")
+        return queued
+
+    # ---------- 付款結果 ----------
+
+    def claim(self, order_id):
+        """
+        付款成功：預先渲染的結果成為一般快取項目（依 LRU 淘汰）
+        尚未開始執行 OpenSCAD 的預先渲染隨即取消，改由訂單的 STL 生成以一般優先權渲染
+        """
+        if self._update(order_id, state=STATE_CLAIMED):
+            logger.info(f"🔮 訂單 {order_id} 已付款，保留預先渲染結果")
+
+    def discard(self, order_id):
+        """付款失敗：停止尚未完成的預先渲染，結果在下一次 expire 時刪除"""
+        if self._update(order_id, state=STATE_DISCARDED):
+            logger.info(f"🔮 訂單 {order_id} 付款失敗，捨棄預先渲染")
+
+    def expire(self, order_status=None):
+        """
+        刪除未付款訂單的預先渲染結果，並清理已處理完的 manifest
+        由背景 Worker 定期呼叫
+
+        Args:
+            order_status: 查詢訂單狀態的函式；沒收到付款回調但訂單已付款時（例如回調失敗後人工處理）
+                不刪除
+
+        Returns:
+            int: 刪除的快取項目數
+        """
+        now = time.time()
+        removed = 0
+
+        for filename in os.listdir(self.state_dir):
+            if not filename.endswith(".json"):
+                continue
+            with self._locked():
+                try:
+                    with open(os.path.join(self.state_dir, filename), "r", encoding="utf-8") as f:
+                        manifest = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+                if manifest["state"] != STATE_DISCARDED and now <= manifest["expires_at"]:
+                    continue
+
+                order_id = manifest["order_id"]
+                unpaid = manifest["state"] != STATE_CLAIMED and (
+                    order_status is None or order_status(order_id) in UNPAID_ORDER_STATUSES
+                )
+                if unpaid:
+                    for key, rendered_at in manifest["rendered"].items():
+                        last_used = cache_last_used(key)
+                        # 預先渲染寫入後又被命中過（其他顧客的相同設計）的項目保留
+                        if last_used is not None and last_used <= rendered_at + 1:
+                            remove_cached_stl(key)
+                            removed += 1
+                try:
+                    os.unlink(os.path.join(self.state_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+        if removed:
+            logger.info(f"🔮 已刪除 {removed} 個未付款訂單的預先渲染結果")
+        return removed
+
+    def status(self):
+        """預先渲染狀況（健康檢查用）"""
+        with self._pending_lock:
+            pending = self._pending
+        return {
+            "enabled": SPECULATIVE_RENDER,
+            "pending": pending,
+            "orders": sum(1 for f in os.listdir(self.state_dir) if f.endswith(".json")),
+            "ttl_seconds": SPECULATIVE_TTL_SECONDS,
+        }
+
+
+speculative_renders = SpeculativeRenders(SPECULATIVE_DIR)
@@ -0,0 +1,174 @@
+"""
+STL Cache - 以內容雜湊為 key 的 STL 結果快取
+同一組設計參數只需渲染一次；超過容量上限時依 LRU 淘汰最久未使用的檔案
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_value(value):
+    """數值統一轉成 float 並四捨五入，避免 15 / 15.0 / "15" 產生不同 key"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 6)
+    if isinstance(value, str):
+        try:
+            return round(float(value), 6)
+        except ValueError:
+            return value.strip()
+    if isinstance(value, dict):
+        return {k: canonical_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(v) for v in value]
+    return value
+
+
+def make_cache_key(payload):
+    """將 payload 以 canonical JSON 序列化後取 SHA-256"""
+    canonical = json.dumps(
+        canonical_value(payload), sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class STLCache:
+    """
+    磁碟上的 STL 快取
+
+    每個項目為 <key>.stl + <key>.json（metadata）。
+    命中時更新 mtime，淘汰時刪除 mtime 最舊的項目（LRU）。
+    寫入使用暫存檔 + os.replace，多個 gunicorn worker 同時寫入也安全。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _stl_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.stl")
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        查詢快取
+
+        Returns:
+            str: 快取中的 STL 路徑，未命中則返回 None
+        """
+        path = self._stl_path(key)
+        try:
+            # 更新 mtime 作為 LRU 的「最近使用」時間
+            os.utime(path, None)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def last_used(self, key):
+        """快取項目最後寫入或命中的時間（epoch 秒），不存在時返回 None（不更新 mtime）"""
+        try:
+            return os.path.getmtime(self._stl_path(key))
+        except FileNotFoundError:
+            return None
+
+    def get_meta(self, key):
+        """讀取快取項目的 metadata"""
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, src_path, meta=None):
+        """
+        將 src_path 的 STL 移入快取（來源檔會被移走）
+
+        Returns:
+            str: 快取中的 STL 路徑
+        """
+        final_path = self._stl_path(key)
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        try:
+            os.replace(src_path, tmp_path)
+        except OSError:
+            # 跨檔案系統（例如 /tmp → 快取目錄）時改用複製
+            shutil.copyfile(src_path, tmp_path)
+            try:
+                os.unlink(src_path)
+            except OSError:
+                pass
+
+        if meta is not None:
+            meta_tmp = tmp_path + ".json"
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.replace(meta_tmp, self._meta_path(key))
+
+        os.replace(tmp_path, final_path)
+        logger.info(f"💾 STL 已寫入快取: {key[:12]}")
+
+        self.evict()
+        return final_path
+
+    def _entries(self):
+        """列出快取項目 (mtime, size, key)"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".stl") or filename.startswith("."):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename[:-4]))
+        return entries
+
+    def remove(self, key):
+        """刪除單一快取項目"""
+        for path in (self._stl_path(key), self._meta_path(key)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """超過容量上限時依 LRU 刪除最舊項目"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(key)
+            total -= size
+            removed += 1
+
+        logger.info(f"🧹 STL 快取淘汰 {removed} 個項目，目前 {total / 1024 / 1024:.1f} MB")
+        return removed
+
+    def stats(self):
+        """快取統計（健康檢查用）"""
+        entries = self._entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "oldest_age_seconds": int(time.time() - min(e[0] for e in entries))
+            if entries
+            else 0,
+        }
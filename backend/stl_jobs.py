@@ -0,0 +1,448 @@
+"""
+STL Jobs - 非同步 STL 渲染工作（提交 / 查詢 / 下載 / 取消）
+工作狀態存成 stl_jobs/<job_id>.json，worker 重啟後由背景 Worker 接手未完成的工作
+
+取消要求寫成 stl_jobs/<job_id>.cancel（任何 gunicorn worker 都能取消其他 process 的工作）：
+用戶端斷線、超過請求期限、同一 session 送出新的設計時，正在執行的 OpenSCAD 會被結束
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from render_pool import RenderPoolFull, RENDER_SLOTS, RENDER_QUEUE_TIMEOUT, DEFAULT_RENDER_SECONDS
+from render_client import (
+    render_stl,
+    lookup_cached_stl,
+    get_stl_backend,
+    get_stl_meta,
+    render_admission,
+    RenderServiceUnavailable,
+)
+from stl_renderer import STLRenderError, RenderCancelled
+
+logger = logging.getLogger(__name__)
+
+STL_JOBS_DIR = os.environ.get("STL_JOBS_DIR", "stl_jobs")
+STL_JOB_THREADS = int(os.environ.get("STL_JOB_THREADS", str(RENDER_SLOTS)))
+STL_JOB_MAX_PENDING = int(os.environ.get("STL_JOB_MAX_PENDING", "8"))
+STL_JOB_TTL_SECONDS = int(os.environ.get("STL_JOB_TTL_HOURS", "24")) * 3600
+
+# 每個 session 最新一筆工作的索引（新工作取代舊工作時用來找出要取消的工作）
+STL_SESSIONS_DIR = os.path.join(STL_JOBS_DIR, "sessions")
+
+os.makedirs(STL_JOBS_DIR, exist_ok=True)
+os.makedirs(STL_SESSIONS_DIR, exist_ok=True)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = ThreadPoolExecutor(max_workers=STL_JOB_THREADS, thread_name_prefix="stl-job")
+_pending_lock = threading.Lock()
+_pending_count = 0
+_done_events = {}
+
+
+def _process_token(pid):
+    """
+    process 身分識別：pid + 啟動時間（/proc/<pid>/stat 第 22 欄）
+    避免容器重啟後 pid 被重用，誤判舊工作仍在執行
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return f"{pid}:{fields[19]}"
+    except (OSError, IndexError):
+        return None
+
+
+CURRENT_PROCESS_TOKEN = _process_token(os.getpid()) or f"{os.getpid()}:unknown"
+
+
+def _job_path(job_id):
+    return os.path.join(STL_JOBS_DIR, f"{job_id}.json")
+
+
+def _save_job(job):
+    job["updated_at"] = datetime.now().isoformat()
+    tmp_path = f"{_job_path(job['id'])}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, _job_path(job["id"]))
+
+
+def load_job(job_id):
+    """讀取工作，job_id 格式不符或不存在時返回 None"""
+    if not JOB_ID_PATTERN.match(job_id or ""):
+        return None
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _update_job(job_id, **fields):
+    job = load_job(job_id)
+    if not job:
+        return None
+    job.update(fields)
+    _save_job(job)
+    return job
+
+
+def _cancel_path(job_id):
+    return os.path.join(STL_JOBS_DIR, f"{job_id}.cancel")
+
+
+def cancel_job(job_id, reason):
+    """
+    要求取消工作（由執行工作的 process 在下一次檢查時結束 OpenSCAD）
+
+    Returns:
+        bool: 工作存在且尚未結束
+    """
+    job = load_job(job_id)
+    if not job or job["status"] not in ACTIVE_STATUSES:
+        return False
+    with open(_cancel_path(job_id), "w", encoding="utf-8") as f:
+        f.write(reason)
+    logger.info(f"🛑 要求取消 STL 工作: {job_id}（{reason}）")
+    return True
+
+
+def _cancel_reason(job_id):
+    try:
+        with open(_cancel_path(job_id), "r", encoding="utf-8") as f:
+            return f.read() or "cancelled"
+    except FileNotFoundError:
+        return None
+
+
+def _session_path(session):
+    digest = hashlib.sha256(str(session).encode("utf-8")).hexdigest()[:32]
+    return os.path.join(STL_SESSIONS_DIR, digest)
+
+
+def _supersede_session(session, job_id):
+    """記錄 session 的最新工作，並取消同一 session 仍在進行中的上一筆工作"""
+    path = _session_path(session)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            previous = f.read().strip()
+    except FileNotFoundError:
+        previous = None
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(job_id)
+    os.replace(tmp_path, path)
+
+    if previous and previous != job_id:
+        cancel_job(previous, "superseded by a newer request")
+
+
+def _run_job(job_id):
+    """在執行緒池中執行渲染工作"""
+    global _pending_count
+
+    try:
+        reason = _cancel_reason(job_id)
+        if reason:
+            _update_job(
+                job_id,
+                status="cancelled",
+                stage="cancelled",
+                error=reason,
+                finished_at=datetime.now().isoformat(),
+            )
+            return
+
+        job = _update_job(
+            job_id,
+            status="running",
+            stage="waiting",
+            started_at=datetime.now().isoformat(),
+            owner=CURRENT_PROCESS_TOKEN,
+        )
+        if not job:
+            return
+
+        def on_stage(stage):
+            fields = {"stage": stage}
+            if stage == "rendering":
+                fields["render_started_at"] = time.time()
+            _update_job(job_id, **fields)
+
+        deadline = job.get("deadline")
+
+        def should_cancel():
+            if deadline and time.time() > deadline:
+                return "deadline exceeded"
+            return _cancel_reason(job_id)
+
+        # HTTP 提交的工作與原本的同步渲染一樣受 render_pool 的等待佇列限制（滿了回覆 429），
+        # 待處理工作上限只是各 process 的執行緒池排隊上限
+        reject_when_full = job.get("reject_when_full", True)
+        try:
+            stl_path, cache_hit = render_stl(
+                job["params"],
+                job.get("options"),
+                queue_timeout=RENDER_QUEUE_TIMEOUT if reject_when_full else None,
+                reject_when_full=reject_when_full,
+                on_stage=on_stage,
+                should_cancel=should_cancel,
+                # 互動預覽：記憶體不足時寧可降低品質也不要讓使用者久等
+                allow_downgrade=True,
+            )
+            meta = get_stl_meta(stl_path)
+            _update_job(
+                job_id,
+                status="done",
+                stage="done",
+                progress=1.0,
+                stl_path=stl_path,
+                cache_hit=cache_hit,
+                backend=meta.get("backend"),
+                quality=meta.get("quality"),
+                finished_at=datetime.now().isoformat(),
+            )
+            logger.info(f"✅ STL 工作完成: {job_id}")
+        except RenderCancelled as e:
+            _update_job(
+                job_id,
+                status="cancelled",
+                stage="cancelled",
+                error=e.reason,
+                finished_at=datetime.now().isoformat(),
+            )
+            logger.info(f"🛑 STL 工作已取消: {job_id}（{e.reason}）")
+        except RenderPoolFull as e:
+            # 渲染服務無法連線也是稍後重試，但對外回覆 503 而不是 429
+            service_unavailable = isinstance(e, RenderServiceUnavailable)
+            _update_job(
+                job_id,
+                status="rejected",
+                stage="rejected",
+                error="render service unavailable" if service_unavailable else "render pool is full",
+                retry_after=e.retry_after,
+                service_unavailable=service_unavailable,
+                finished_at=datetime.now().isoformat(),
+            )
+            cause = "渲染服務無法連線" if service_unavailable else "渲染佇列已滿"
+            logger.warning(f"🚦 STL 工作因{cause}被拒絕: {job_id}")
+        except STLRenderError as e:
+            _update_job(
+                job_id,
+                status="failed",
+                stage="failed",
+                error=e.stderr or str(e),
+                finished_at=datetime.now().isoformat(),
+            )
+            logger.error(f"❌ STL 工作失敗: {job_id}")
+        except Exception as e:
+            _update_job(
+                job_id,
+                status="failed",
+                stage="failed",
+                error=str(e),
+                finished_at=datetime.now().isoformat(),
+            )
+            logger.error(f"❌ STL 工作錯誤: {job_id} - {e}")
+    finally:
+        try:
+            os.unlink(_cancel_path(job_id))
+        except FileNotFoundError:
+            pass
+        with _pending_lock:
+            _pending_count -= 1
+        event = _done_events.pop(job_id, None)
+        if event:
+            event.set()
+
+
+def _enqueue(job_id):
+    global _pending_count
+    with _pending_lock:
+        _pending_count += 1
+    _done_events[job_id] = threading.Event()
+    _executor.submit(_run_job, job_id)
+
+
+def submit_job(params, options=None, session=None, deadline=None, reject_when_full=True):
+    """
+    提交渲染工作（立即返回）
+
+    快取命中時直接標記為完成；渲染名額與等待佇列都已滿、或本 process 待處理工作過多時拋出 RenderPoolFull。
+    工作開始執行時佇列才滿的，工作狀態為 "rejected"（附 retry_after）
+
+    Args:
+        params: 9 個 SCAD 參數
+        options: 渲染選項（stl_renderer.extract_render_options）
+        session: 前端 session 識別；同一 session 的新工作會取消上一筆未完成的工作
+        deadline: 工作期限（epoch 秒），超過時結束渲染
+        reject_when_full: 渲染佇列已滿時拒絕（HTTP 用）；False 時持續等待名額
+
+    Returns:
+        dict: 工作資料
+    """
+    job = {
+        "id": uuid.uuid4().hex,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0.0,
+        "params": params,
+        "options": options or {},
+        "deadline": deadline,
+        "reject_when_full": reject_when_full,
+        "created_at": datetime.now().isoformat(),
+        "owner": CURRENT_PROCESS_TOKEN,
+    }
+
+    cached_path = lookup_cached_stl(params, options)
+    if cached_path:
+        job.update(
+            status="done",
+            stage="done",
+            progress=1.0,
+            stl_path=cached_path,
+            cache_hit=True,
+            backend=get_stl_backend(cached_path),
+            finished_at=job["created_at"],
+        )
+        _save_job(job)
+        if session:
+            _supersede_session(session, job["id"])
+        logger.info(f"⚡ STL 工作快取命中: {job['id']}")
+        return job
+
+    # 名額狀況由擁有名額的 process 回報（設定 RENDER_SERVICE_SOCKET 時為渲染服務）
+    admission = render_admission()
+    if reject_when_full and admission["full"]:
+        retry_after = admission["retry_after"]
+        logger.warning(f"🚦 渲染佇列已滿，建議 {retry_after} 秒後重試")
+        raise RenderPoolFull(retry_after)
+
+    with _pending_lock:
+        pending = _pending_count
+    if pending >= STL_JOB_MAX_PENDING:
+        rounds = pending // max(1, admission["slots"]) + 1
+        raise RenderPoolFull(int(rounds * admission["average_render_seconds"]) + 1)
+
+    # 估算進度用的平均渲染秒數（查詢進度時不必再問渲染服務）
+    job["expected_seconds"] = admission["average_render_seconds"]
+
+    # 工作確定受理後才取代 session 的上一筆：被拒絕的請求不可取消仍在進行中的預覽
+    _save_job(job)
+    if session:
+        _supersede_session(session, job["id"])
+    _enqueue(job["id"])
+    logger.info(f"📥 STL 工作已提交: {job['id']}")
+    return job
+
+
+def wait_for_job(job_id, timeout):
+    """等待本 process 提交的工作完成，返回最新工作資料"""
+    event = _done_events.get(job_id)
+    if event:
+        event.wait(timeout)
+    else:
+        # 由其他 process 執行的工作只能輪詢工作檔
+        job = load_job(job_id)
+        if job and job["status"] in ACTIVE_STATUSES:
+            time.sleep(min(timeout, 1.0))
+    return load_job(job_id)
+
+
+def public_job_view(job):
+    """對外回傳的工作狀態（含估算進度）"""
+    progress = job.get("progress", 0.0)
+    if job["status"] == "running" and job.get("render_started_at"):
+        elapsed = time.time() - job["render_started_at"]
+        # OpenSCAD 不回報進度，用歷史平均渲染時間估算，完成前最多顯示 95%
+        expected = job.get("expected_seconds") or DEFAULT_RENDER_SECONDS
+        progress = min(0.95, elapsed / max(1.0, expected))
+
+    view = {
+        "jobId": job["id"],
+        "status": job["status"],
+        "stage": job.get("stage", job["status"]),
+        "progress": round(progress, 2),
+        "createdAt": job.get("created_at"),
+        "finishedAt": job.get("finished_at"),
+    }
+    if job["status"] == "done":
+        view["cacheHit"] = job.get("cache_hit", False)
+        view["backend"] = job.get("backend")
+        # 記憶體不足降級時，實際品質與請求的品質不同
+        view["quality"] = job.get("quality") or job.get("options", {}).get("quality")
+    if job["status"] in ("failed", "cancelled", "rejected"):
+        view["error"] = job.get("error", "")
+    if job["status"] == "rejected":
+        view["retryAfter"] = job.get("retry_after")
+    return view
+
+
+def recover_orphaned_jobs():
+    """
+    接手擁有者 process 已結束的未完成工作，並清理過期工作
+    由持有背景 Worker 鎖的 process 定期呼叫
+    """
+    now = time.time()
+    recovered = 0
+
+    for filename in os.listdir(STL_SESSIONS_DIR):
+        path = os.path.join(STL_SESSIONS_DIR, filename)
+        try:
+            if now - os.path.getmtime(path) > STL_JOB_TTL_SECONDS:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    for filename in os.listdir(STL_JOBS_DIR):
+        if filename.endswith(".cancel"):
+            # 工作檔已過期被刪除時遺留的取消要求
+            if not os.path.exists(_job_path(filename[:-7])):
+                try:
+                    os.unlink(os.path.join(STL_JOBS_DIR, filename))
+                except OSError:
+                    pass
+            continue
+        if not filename.endswith(".json"):
+            continue
+        job_id = filename[:-5]
+        path = _job_path(job_id)
+
+        try:
+            if now - os.path.getmtime(path) > STL_JOB_TTL_SECONDS:
+                os.unlink(path)
+                continue
+        except OSError:
+            continue
+
+        job = load_job(job_id)
+        if not job or job["status"] not in ACTIVE_STATUSES:
+            continue
+
+        owner = job.get("owner", "")
+        owner_pid = owner.split(":", 1)[0]
+        if owner == CURRENT_PROCESS_TOKEN or (
+            owner_pid.isdigit() and _process_token(int(owner_pid)) == owner
+        ):
+            continue
+
+        job.update(status="queued", stage="queued", owner=CURRENT_PROCESS_TOKEN)
+        _save_job(job)
+        _enqueue(job_id)
+        recovered += 1
+
+    if recovered:
+        logger.info(f"♻️ 已接手 {recovered} 個中斷的 STL 工作")
+    return recovered
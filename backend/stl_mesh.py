@@ -0,0 +1,117 @@
+"""
+STL Mesh - binary STL 讀寫、縮放與網格檢查（NumPy）
+OpenSCAD 一律輸出 binstl：80 bytes 標頭 + uint32 三角面數 + 每面 50 bytes
+"""
+import numpy as np
+
+STL_HEADER_BYTES = 80
+
+# 每個三角面：法向量 + 3 個頂點（12 個 float32）+ 2 bytes 屬性
+STL_FACET_DTYPE = np.dtype(
+    [("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+)
+
+
+def stl_facet_count(stl_path):
+    """binary STL 的三角面數（80 bytes 標頭後的 uint32）"""
+    with open(stl_path, "rb") as f:
+        f.seek(STL_HEADER_BYTES)
+        return int(np.frombuffer(f.read(4), dtype="<u4")[0])
+
+
+def read_binary_stl(stl_path):
+    """
+    讀取 binary STL 的三角形
+
+    Returns:
+        np.ndarray: (n, 3, 3) float32
+    """
+    with open(stl_path, "rb") as f:
+        f.seek(STL_HEADER_BYTES)
+        count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        facets = np.fromfile(f, dtype=STL_FACET_DTYPE, count=count)
+    return facets["vertices"]
+
+
+def is_manifold(stl_path):
+    """
+    檢查網格是否為封閉流形：每條邊恰好被兩個三角面共用
+
+    頂點以完全相同的座標合併（OpenSCAD 輸出同一頂點時座標一致）
+    """
+    try:
+        triangles = read_binary_stl(stl_path)
+    except (OSError, ValueError, IndexError):
+        return False
+    if len(triangles) == 0:
+        return False
+
+    _, indices = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    faces = indices.reshape(-1, 3)
+
+    # float32 輸出可能讓極細的三角形退化成線段，這些面不參與邊的計數
+    degenerate = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+    faces = faces[~degenerate]
+    if len(faces) == 0:
+        return False
+
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges.sort(axis=1)
+    _, counts = np.unique(edges, axis=0, return_counts=True)
+    return bool(np.all(counts == 2))
+
+
+def mesh_volume_area(stl_path):
+    """
+    封閉網格的體積與表面積（mm³, mm²）
+
+    體積以散度定理計算：每個三角形與原點構成的四面體有號體積總和
+    """
+    triangles = read_binary_stl(stl_path).astype(np.float64)
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    volume = abs(np.einsum("ij,ij->i", a, np.cross(b, c)).sum()) / 6.0
+    area = np.linalg.norm(np.cross(b - a, c - a), axis=1).sum() / 2.0
+    return float(volume), float(area)
+
+
+def write_binary_stl(stl_path, triangles, header=b"DUET binary STL"):
+    """
+    寫出 binary STL（法向量由頂點順序計算，逆時針為外側）
+
+    Args:
+        triangles: (n, 3, 3) 陣列
+    """
+    triangles = np.asarray(triangles, dtype=np.float32)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.where(lengths > 0, lengths, 1.0)
+
+    facets = np.zeros(len(triangles), dtype=STL_FACET_DTYPE)
+    facets["normal"] = normals
+    facets["vertices"] = triangles
+
+    with open(stl_path, "wb") as f:
+        f.write(header[:STL_HEADER_BYTES].ljust(STL_HEADER_BYTES, b"\0"))
+        f.write(np.uint32(len(facets)).tobytes())
+        facets.tofile(f)
+
+
+def scale_binary_stl(src_path, dst_path, factor):
+    """
+    等比縮放 binary STL 的所有頂點（等比縮放不改變法向量）
+
+    Returns:
+        int: 三角面數
+    """
+    with open(src_path, "rb") as f:
+        header = f.read(STL_HEADER_BYTES)
+        count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        facets = np.fromfile(f, dtype=STL_FACET_DTYPE, count=count)
+
+    facets["vertices"] *= np.float32(factor)
+
+    with open(dst_path, "wb") as f:
+        f.write(header)
+        f.write(np.uint32(count).tobytes())
+        facets.tofile(f)
+    return count
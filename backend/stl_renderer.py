@@ -0,0 +1,876 @@
+"""
+STL Renderer - STL 產生流程（SCAD 參數 → OpenSCAD 渲染 → 結果快取）
+/api/generate-stl 與訂單 STL 隊列共用同一套流程
+
+OpenSCAD 一律渲染靜態模型庫 duet.scad，每次請求只改變 -D 參數（不寫出暫存 .scad）
+
+幾何引擎：
+    openscad：SCAD 腳本交給 OpenSCAD（Manifold / CGAL）
+    analytic：analytic_engine 直接由字形輪廓計算交集網格（不需 OpenSCAD）
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from scad_generator import (
+    DUET_LIBRARY_PATH,
+    get_library_identity,
+    format_scad_defines,
+    model_library_defines,
+    core_library_defines,
+    bail_library_defines,
+)
+from openscad_runner import (
+    get_openscad_version,
+    get_openscad_capabilities,
+    get_font_fingerprint,
+    run_openscad,
+    build_openscad_command,
+    format_openscad_command,
+    RenderCancelled,
+    BACKEND_CGAL,
+    BACKEND_MANIFOLD,
+)
+from stl_mesh import is_manifold, scale_binary_stl
+from stl_cache import STLCache, make_cache_key
+from render_pool import render_pool, RENDER_QUEUE_TIMEOUT
+from render_memory import (
+    render_memory,
+    render_memory_budget_mb,
+    render_memory_limit_mb,
+    report_peak,
+    QUALITY_FALLBACK_ORDER,
+    RENDER_MEMORY_PATIENCE,
+)
+from glyph_cache import lookup_glyph_prism
+from glyph_outline import load_glyph_outline, glyph_source_tag, simplify_outline_mm
+from glyph_metrics import get_glyph_metrics
+from quality_tiers import get_quality_settings, normalize_quality, QUALITY_DRAFT, QUALITY_PRODUCTION
+from analytic_engine import render_analytic_stl, ANALYTIC_ENGINE_VERSION
+from workspace import job_workspace
+from single_flight import coalesce
+from font_index import preflight_fonts
+from render_telemetry import render_context, update_context, record, record_openscad
+
+logger = logging.getLogger(__name__)
+
+# 快取配置
+STL_CACHE_DIR = os.environ.get("STL_CACHE_DIR", "stl_cache")
+STL_CACHE_MAX_BYTES = int(os.environ.get("STL_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# 快取格式版本（key 組成改變時遞增；duet.scad 的修改由 get_library_identity 涵蓋）
+CACHE_SCHEMA_VERSION = 3
+
+# 分段渲染：交集核心與墜頭分開（墜頭調整只需重跑便宜的第二段）
+SPLIT_CORE_RENDER = os.environ.get("STL_SPLIT_CORE", "true").lower() == "true"
+
+# 交集核心只和這些參數有關
+CORE_PARAM_KEYS = ("letter1", "letter2", "font1", "font2", "size")
+
+# 標準高度核心快取：交集核心對尺寸是等比縮放（resize auto=true），同一解析度級距內
+# 只渲染一次參考高度的網格，其他尺寸直接縮放頂點；只有跨越 $fn 級距時才重新渲染
+# 參考高度取 10mm 而非 1mm：避開 OpenSCAD 的頂點格點吸附與 scale() 常值的小數位數
+CANONICAL_CORE_CACHE = os.environ.get("STL_CANONICAL_CORE", "true").lower() == "true"
+CANONICAL_HEIGHT = 10.0
+# 標準網格的輪廓簡化誤差換算到此尺寸仍不超過 simplify_tolerance_mm；更大的尺寸直接渲染
+CANONICAL_MAX_SIZE = float(os.environ.get("STL_CANONICAL_MAX_SIZE", "40"))
+
+# 幾何後端："auto"（有 Manifold 就用）、"manifold"、"cgal"；可由請求的 backend 欄位覆寫
+GEOMETRY_BACKEND = os.environ.get("STL_GEOMETRY_BACKEND", "auto").lower()
+BACKEND_CHOICES = ("auto", BACKEND_MANIFOLD, BACKEND_CGAL)
+
+# 幾何引擎："openscad" 或 "analytic"；可由請求的 engine 欄位覆寫
+ENGINE_OPENSCAD = "openscad"
+ENGINE_ANALYTIC = "analytic"
+ENGINE_CHOICES = (ENGINE_OPENSCAD, ENGINE_ANALYTIC)
+RENDER_ENGINE = os.environ.get("STL_ENGINE", ENGINE_OPENSCAD).lower()
+
+# 預設品質（draft / preview / production）；可由請求的 quality 欄位覆寫
+DEFAULT_QUALITY = os.environ.get("STL_DEFAULT_QUALITY", QUALITY_PRODUCTION)
+# 設計頁互動預覽（/api/generate-stl、/api/stl-jobs）的預設品質：前端不帶 quality，
+# 預覽只求快；訂單 / 鑄造檔案一律明確指定 production
+PREVIEW_QUALITY = os.environ.get("STL_PREVIEW_QUALITY", QUALITY_DRAFT)
+
+stl_cache = STLCache(STL_CACHE_DIR, STL_CACHE_MAX_BYTES)
+
+
+class STLRenderError(Exception):
+    """OpenSCAD 渲染失敗"""
+
+    def __init__(self, message, stderr=""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+def extract_scad_params(data):
+    """
+    只取出 scad_generator 需要的 9 個參數
+
+    字體名稱先經過字體索引預檢（校正為已安裝的正式名稱），不必啟動 OpenSCAD 才發現字體不存在
+
+    Raises:
+        UnknownFontError: 字體未安裝（ValueError 子類別）
+    """
+    params = {
+        "letter1": data["letter1"],
+        "letter2": data["letter2"],
+        "font1": data["font1"],
+        "font2": data["font2"],
+        "size": data.get("size", 15),
+        "bailRelativeX": data.get("bailRelativeX", 0),
+        "bailRelativeY": data.get("bailRelativeY", 0),
+        "bailRelativeZ": data.get("bailRelativeZ", 0),
+        "bailRotation": data.get("bailRotation", 0),
+    }
+    return preflight_fonts(params)
+
+
+def extract_render_options(data, default_quality=None):
+    """
+    取出渲染選項（不屬於 SCAD 參數，但會影響輸出）
+
+    Args:
+        default_quality: 請求沒帶 quality 時使用的品質（None = DEFAULT_QUALITY）
+
+    Raises:
+        ValueError: backend 不是 auto / manifold / cgal、quality 不是 draft / preview / production，
+            或 engine 不是 openscad / analytic
+    """
+    backend = str(data.get("backend") or GEOMETRY_BACKEND).lower()
+    if backend not in BACKEND_CHOICES:
+        raise ValueError(f"不支援的幾何後端: {backend}")
+    quality = normalize_quality(data.get("quality") or default_quality or DEFAULT_QUALITY)
+    engine = str(data.get("engine") or RENDER_ENGINE).lower()
+    if engine not in ENGINE_CHOICES:
+        raise ValueError(f"不支援的幾何引擎: {engine}")
+    return {"backend": backend, "quality": quality, "engine": engine}
+
+
+def _quality_name(options=None):
+    return (options or {}).get("quality", DEFAULT_QUALITY)
+
+
+def resolve_quality(params, options=None):
+    """此次渲染的解析度設定（quality_tiers）"""
+    return get_quality_settings(_quality_name(options), params["size"])
+
+
+def resolve_backend(options=None):
+    """依請求與 openscad 實際支援的後端決定要先嘗試哪一個"""
+    requested = (options or {}).get("backend", GEOMETRY_BACKEND)
+    if requested == BACKEND_CGAL:
+        return BACKEND_CGAL
+    if BACKEND_MANIFOLD in get_openscad_capabilities()["backends"]:
+        return BACKEND_MANIFOLD
+    if requested == BACKEND_MANIFOLD:
+        logger.warning("⚠️ 此 OpenSCAD 不支援 Manifold，改用 CGAL")
+    return BACKEND_CGAL
+
+
+def resolve_engine(params, options=None):
+    """
+    此次渲染實際使用的幾何引擎
+
+    analytic 需要兩個字母的字形輪廓，取不到（例如字體無法解析）時改用 OpenSCAD
+    """
+    requested = (options or {}).get("engine", RENDER_ENGINE)
+    if requested != ENGINE_ANALYTIC:
+        return ENGINE_OPENSCAD
+    if all(_load_outlines(params, resolve_quality(params, options))):
+        return ENGINE_ANALYTIC
+    logger.warning("⚠️ 無法取得字形輪廓，解析引擎改用 OpenSCAD")
+    return ENGINE_OPENSCAD
+
+
+def _load_outlines(params, quality):
+    """
+    取得兩個字母的字形輪廓（依品質的攤平容許誤差）；任一個無法取得時兩者都改用 text()
+
+    Returns:
+        tuple: (outline1, outline2) 或 (None, None)
+    """
+    tolerance_em = quality["curve_tolerance_em"]
+    outline1 = load_glyph_outline(params["font1"], params["letter1"], tolerance_em)
+    outline2 = load_glyph_outline(params["font2"], params["letter2"], tolerance_em)
+    if outline1 and outline2:
+        return outline1, outline2
+    return None, None
+
+
+def _prepare_outlines(params, quality):
+    """
+    渲染用的字形輪廓：依品質的 mm 容許誤差以 Douglas–Peucker 簡化
+
+    Returns:
+        tuple: (outline1, outline2, report) - report 記錄移除的頂點數與最大誤差；
+            無法使用字形輪廓時為 (None, None, None)
+    """
+    outlines = _load_outlines(params, quality)
+    if not all(outlines):
+        return None, None, None
+
+    tolerance_mm = quality["simplify_tolerance_mm"]
+    simplified = []
+    report = {"tolerance_mm": tolerance_mm, "vertices": 0, "removed": 0, "max_deviation_mm": 0.0}
+    for outline, letter, font in zip(
+        outlines, (params["letter1"], params["letter2"]), (params["font1"], params["font2"])
+    ):
+        result, removed, deviation = simplify_outline_mm(outline, tolerance_mm, params["size"])
+        logger.info(
+            f"🪶 輪廓簡化 {font} {letter}: {outline.vertex_count} → {result.vertex_count} 頂點"
+            f"（最大誤差 {deviation:.4f}mm）"
+        )
+        simplified.append(result)
+        report["vertices"] += outline.vertex_count
+        report["removed"] += removed
+        report["max_deviation_mm"] = round(max(report["max_deviation_mm"], deviation), 5)
+
+    return simplified[0], simplified[1], report
+
+
+def _load_metrics(params):
+    """兩個字母的字形度量（計算緊貼擠出深度用），取不到時為 None"""
+    return (
+        get_glyph_metrics(params["font1"], params["letter1"]),
+        get_glyph_metrics(params["font2"], params["letter2"]),
+    )
+
+
+def _cache_payload(kind, params, options=None, quality=None):
+    """
+    快取 key 組成：參數 + 幾何引擎 / 後端 + 解析度 + 模型庫版本 + OpenSCAD 版本
+    + 兩個字體檔指紋 + 字形來源
+    """
+    quality = quality or resolve_quality(params, options)
+    if resolve_engine(params, options) == ENGINE_ANALYTIC:
+        backend = f"{ENGINE_ANALYTIC}:{ANALYTIC_ENGINE_VERSION}"
+    else:
+        backend = resolve_backend(options)
+    return {
+        "schema": CACHE_SCHEMA_VERSION,
+        "kind": kind,
+        "params": params,
+        "backend": backend,
+        "quality": quality,
+        "script": get_library_identity(),
+        "openscad": get_openscad_version(),
+        "fonts": [
+            get_font_fingerprint(params["font1"]),
+            get_font_fingerprint(params["font2"]),
+        ],
+        "glyphs": [glyph_source_tag(outline) for outline in _load_outlines(params, quality)],
+    }
+
+
+def compute_render_key(params, options=None):
+    """完整模型（字母交集 + 墜頭）的快取 key：9 個 SCAD 參數"""
+    return make_cache_key(_cache_payload("full", params, options))
+
+
+def compute_core_key(params, options=None):
+    """交集核心的快取 key：只取字母、字體、尺寸，與墜頭無關"""
+    core_params = {k: params[k] for k in CORE_PARAM_KEYS}
+    return make_cache_key(_cache_payload("core", core_params, options))
+
+
+def _canonical_params(params):
+    return {**{k: params[k] for k in CORE_PARAM_KEYS}, "size": CANONICAL_HEIGHT}
+
+
+def _canonical_quality(params, options=None):
+    """
+    標準高度核心的解析度：沿用請求尺寸所在級距的設定（$fn 等），
+    輪廓簡化誤差換算成參考高度下的數值，縮放到 CANONICAL_MAX_SIZE 時剛好等於原本的 mm 誤差
+    """
+    quality = resolve_quality(params, options)
+    return {
+        **quality,
+        "simplify_tolerance_mm": round(
+            quality["simplify_tolerance_mm"] * CANONICAL_HEIGHT / CANONICAL_MAX_SIZE, 6
+        ),
+    }
+
+
+def glyph_prism_targets(sizes):
+    """
+    production 交集核心會查詢的柱體（glyph_cache 預先渲染用）
+
+    Args:
+        sizes: 請求尺寸
+
+    Returns:
+        list: [(柱體高度, 解析度設定), ...] - 標準核心範圍內的尺寸為標準高度與該級距的標準核心解析度
+    """
+    options = {"quality": QUALITY_PRODUCTION}
+    targets = []
+    for size in sizes:
+        params = {"size": size}
+        if CANONICAL_CORE_CACHE and float(size) <= CANONICAL_MAX_SIZE:
+            target = (CANONICAL_HEIGHT, _canonical_quality(params, options))
+        else:
+            target = (float(size), resolve_quality(params, options))
+        if target not in targets:
+            targets.append(target)
+    return targets
+
+
+def compute_canonical_core_key(params, options=None):
+    """標準高度核心的快取 key：不含尺寸，只含尺寸所在級距的解析度"""
+    return make_cache_key(
+        _cache_payload(
+            "canonical-core",
+            _canonical_params(params),
+            options,
+            quality=_canonical_quality(params, options),
+        )
+    )
+
+
+def lookup_cached_stl(params, options=None):
+    """只查詢快取，不觸發渲染；未命中返回 None"""
+    return stl_cache.get(compute_render_key(params, options))
+
+
+def get_stl_meta(stl_path):
+    """快取中 STL 的 metadata（幾何後端、品質、peak RSS 等）"""
+    key = os.path.splitext(os.path.basename(stl_path))[0]
+    return stl_cache.get_meta(key) or {}
+
+
+def get_stl_backend(stl_path):
+    """快取中的 STL 實際由哪個幾何後端產生（讀取 metadata）"""
+    return get_stl_meta(stl_path).get("backend")
+
+
+def _memory_candidates(params, options, allow_downgrade):
+    """准入控制的候選品質 [(quality, $fn), ...]：請求的品質，允許降級時再加上更便宜的品質"""
+    requested = _quality_name(options)
+    qualities = [requested]
+    if allow_downgrade and requested in QUALITY_FALLBACK_ORDER:
+        qualities += QUALITY_FALLBACK_ORDER[QUALITY_FALLBACK_ORDER.index(requested) + 1:]
+    return [
+        (name, resolve_quality(params, {**(options or {}), "quality": name})["fn"])
+        for name in qualities
+    ]
+
+
+def _workspace_stl(workdir):
+    """工作目錄內的新 STL 檔名（同一工作可能渲染多次：核心、墜頭、CGAL 重試）"""
+    fd, stl_path = tempfile.mkstemp(suffix=".stl", dir=workdir)
+    os.close(fd)
+    return stl_path
+
+
+def _is_out_of_memory(stderr):
+    """openscad 是否因配置記憶體失敗而結束（RLIMIT_AS）"""
+    stderr = (stderr or "").lower()
+    return "bad_alloc" in stderr or "out of memory" in stderr
+
+
+def _run_scad_once(defines, backend, workdir, should_cancel=None):
+    """
+    以指定後端渲染模型庫（defines 為 scad_generator 的 *_library_defines）
+
+    Returns:
+        str: 工作目錄內的 STL 路徑（呼叫端負責移入快取）
+    """
+    stl_path = _workspace_stl(workdir)
+
+    scad_defines = format_scad_defines(defines)
+    logger.info(
+        "📄 OpenSCAD: "
+        + format_openscad_command(
+            build_openscad_command(DUET_LIBRARY_PATH, "out.stl", backend, scad_defines)
+        )
+    )
+
+    started = time.monotonic()
+    try:
+        result = run_openscad(
+            DUET_LIBRARY_PATH,
+            stl_path,
+            backend=backend,
+            defines=scad_defines,
+            should_cancel=should_cancel,
+            memory_limit_mb=render_memory_limit_mb(),
+        )
+    except subprocess.TimeoutExpired as e:
+        os.unlink(stl_path)
+        raise STLRenderError(f"OpenSCAD timed out after {e.timeout}s")
+    except OSError as e:
+        # 例如字形輪廓過長超過命令列長度限制
+        os.unlink(stl_path)
+        raise STLRenderError(f"OpenSCAD could not be started: {e}")
+
+    # stderr 成功時也要解析：渲染時間、面數、字體 fallback 警告
+    record_openscad(defines, backend, result, time.monotonic() - started)
+
+    out_of_memory = result.returncode != 0 and _is_out_of_memory(result.stderr)
+    # 超過 RLIMIT_AS 時實際需求不止量到的 RSS：以整個渲染預算記錄，之後此字體只在沒有其他渲染時執行
+    # （RLIMIT_AS 是 VSZ，數值遠大於 RSS，不能直接當峰值記錄）
+    report_peak(render_memory_budget_mb() if out_of_memory else result.peak_rss_mb)
+
+    if result.returncode != 0:
+        logger.error(f"❌ OpenSCAD 錯誤: {result.stderr}")
+        os.unlink(stl_path)
+        if out_of_memory:
+            raise STLRenderError(
+                f"OpenSCAD exceeded the render memory limit ({render_memory_limit_mb()}MB)",
+                result.stderr,
+            )
+        raise STLRenderError("OpenSCAD failed", result.stderr)
+
+    if os.path.getsize(stl_path) == 0:
+        logger.error("❌ STL 檔案不存在")
+        os.unlink(stl_path)
+        raise STLRenderError("STL file not generated")
+
+    return stl_path
+
+
+def _run_scad(defines, backend, workdir, should_cancel=None):
+    """
+    渲染模型庫；Manifold 失敗或輸出非流形網格時自動改用 CGAL 重試
+
+    Returns:
+        tuple: (暫存 STL 路徑, 實際使用的後端)
+    """
+    if backend == BACKEND_MANIFOLD:
+        try:
+            stl_path = _run_scad_once(defines, BACKEND_MANIFOLD, workdir, should_cancel)
+            if is_manifold(stl_path):
+                return stl_path, BACKEND_MANIFOLD
+            logger.warning("⚠️ Manifold 輸出非流形網格，改用 CGAL 重新渲染")
+            os.unlink(stl_path)
+        except STLRenderError:
+            logger.warning("⚠️ Manifold 渲染失敗，改用 CGAL 重新渲染")
+
+    return _run_scad_once(defines, BACKEND_CGAL, workdir, should_cancel), BACKEND_CGAL
+
+
+def _cache_meta(params, backend, **extra):
+    return {
+        "params": params,
+        "backend": backend,
+        "openscad": get_openscad_version(),
+        "created_at": datetime.now().isoformat(),
+        **extra,
+    }
+
+
+def _render_analytic(params, options, workdir):
+    """
+    以解析引擎產生完整模型（在目前的執行緒內計算，不佔 OpenSCAD 渲染名額）
+
+    Returns:
+        tuple: (工作目錄內的 STL 路徑, meta)
+    """
+    quality = resolve_quality(params, options)
+    outline1, outline2, simplify_report = _prepare_outlines(params, quality)
+
+    stl_path = _workspace_stl(workdir)
+    stats = render_analytic_stl(stl_path, params, outline1, outline2, quality=quality)
+    record(
+        "full",
+        engine=ENGINE_ANALYTIC,
+        fn=quality["fn"],
+        wall_seconds=stats["seconds"],
+        facets=stats["facets"],
+    )
+
+    meta = _cache_meta(
+        params,
+        ENGINE_ANALYTIC,
+        quality=_quality_name(options),
+        simplify=simplify_report,
+        analytic=stats,
+    )
+    return stl_path, meta
+
+
+def _ensure_canonical_core_stl(params, options, workdir, should_cancel=None):
+    """
+    取得標準高度（CANONICAL_HEIGHT）的交集核心 STL（快取未命中時渲染）
+
+    Returns:
+        tuple: (canonical_stl_path, backend)
+    """
+    canonical_key = compute_canonical_core_key(params, options)
+
+    cached_path = stl_cache.get(canonical_key)
+    if cached_path:
+        return cached_path, get_stl_backend(cached_path)
+
+    # 同字母 / 字體、不同尺寸或墜頭位置的請求共用同一個標準核心：只渲染一次
+    cached_path, _ = coalesce(
+        canonical_key,
+        lambda: stl_cache.get(canonical_key),
+        lambda: _render_canonical_core(params, options, canonical_key, workdir, should_cancel),
+        should_cancel=should_cancel,
+    )
+    return cached_path, get_stl_backend(cached_path)
+
+
+def _render_canonical_core(params, options, canonical_key, workdir, should_cancel=None):
+    """渲染標準高度核心並寫入快取，返回快取路徑"""
+    canonical_params = _canonical_params(params)
+    quality = _canonical_quality(params, options)
+    outline1, outline2, simplify_report = _prepare_outlines(canonical_params, quality)
+    metrics1, metrics2 = _load_metrics(canonical_params)
+
+    # glyph_cache 預先擠出的標準高度柱體（production 解析度，與 _ensure_core_stl 相同）
+    prism1 = prism2 = None
+    if _quality_name(options) == QUALITY_PRODUCTION:
+        prism1 = lookup_glyph_prism(params["letter1"], params["font1"], CANONICAL_HEIGHT, quality)
+        prism2 = lookup_glyph_prism(params["letter2"], params["font2"], CANONICAL_HEIGHT, quality)
+
+    logger.info(
+        f"📏 渲染標準高度核心: {params['letter1']}{params['letter2']} "
+        f"({CANONICAL_HEIGHT}mm, $fn {quality['fn']})"
+    )
+    stl_path, backend = _run_scad(
+        core_library_defines(
+            **canonical_params,
+            prism1_path=prism1,
+            prism2_path=prism2,
+            outline1=outline1,
+            outline2=outline2,
+            metrics1=metrics1,
+            metrics2=metrics2,
+            quality=quality,
+        ),
+        resolve_backend(options),
+        workdir,
+        should_cancel,
+    )
+    meta = _cache_meta(
+        canonical_params, backend, quality=_quality_name(options), simplify=simplify_report
+    )
+    return stl_cache.put(canonical_key, stl_path, meta)
+
+
+def _ensure_core_stl(params, options, workdir, should_cancel=None):
+    """
+    取得交集核心 STL（快取未命中時渲染，需在渲染名額內呼叫）
+
+    啟用 CANONICAL_CORE_CACHE 時由標準高度核心等比縮放而來，
+    同一級距的其他尺寸不必再執行 OpenSCAD
+
+    Returns:
+        tuple: (core_stl_path, backend)
+    """
+    core_key = compute_core_key(params, options)
+
+    cached_path = stl_cache.get(core_key)
+    if cached_path:
+        logger.info(f"⚡ 交集核心快取命中: {params['letter1']}{params['letter2']} ({core_key[:12]})")
+        return cached_path, get_stl_backend(cached_path)
+
+    core_params = {k: params[k] for k in CORE_PARAM_KEYS}
+
+    if CANONICAL_CORE_CACHE and float(params["size"]) <= CANONICAL_MAX_SIZE:
+        canonical_path, backend = _ensure_canonical_core_stl(
+            params, options, workdir, should_cancel
+        )
+        factor = float(params["size"]) / CANONICAL_HEIGHT
+
+        stl_path = _workspace_stl(workdir)
+        scale_binary_stl(canonical_path, stl_path, factor)
+        logger.info(
+            f"📏 交集核心由標準高度縮放: {params['letter1']}{params['letter2']} x{factor:.3f}"
+        )
+
+        meta = _cache_meta(
+            core_params,
+            backend,
+            quality=_quality_name(options),
+            canonical=os.path.splitext(os.path.basename(canonical_path))[0],
+            scale=factor,
+        )
+        return stl_cache.put(core_key, stl_path, meta), backend
+
+    quality = resolve_quality(params, options)
+
+    # 有預先擠出的字母柱體時直接 import，省去 FreeType / resize / linear_extrude
+    # （柱體以 production 解析度預先渲染，其他品質不使用）
+    prism1 = prism2 = None
+    if _quality_name(options) == QUALITY_PRODUCTION:
+        prism1 = lookup_glyph_prism(params["letter1"], params["font1"], params["size"], quality)
+        prism2 = lookup_glyph_prism(params["letter2"], params["font2"], params["size"], quality)
+
+    outline1, outline2, simplify_report = _prepare_outlines(params, quality)
+    metrics1, metrics2 = _load_metrics(params)
+
+    stl_path, backend = _run_scad(
+        core_library_defines(
+            **core_params,
+            prism1_path=prism1,
+            prism2_path=prism2,
+            outline1=outline1,
+            outline2=outline2,
+            metrics1=metrics1,
+            metrics2=metrics2,
+            quality=quality,
+        ),
+        resolve_backend(options),
+        workdir,
+        should_cancel,
+    )
+    meta = _cache_meta(
+        core_params, backend, quality=_quality_name(options), simplify=simplify_report
+    )
+    return stl_cache.put(core_key, stl_path, meta), backend
+
+
+def render_stl(
+    params,
+    options=None,
+    queue_timeout=RENDER_QUEUE_TIMEOUT,
+    reject_when_full=True,
+    on_stage=None,
+    should_cancel=None,
+    allow_downgrade=False,
+    low_priority=False,
+):
+    """
+    產生 STL（優先使用快取；未命中時透過 render_pool 取得渲染名額）
+
+    預設分兩段渲染：字母交集核心（昂貴，依字母 / 字體 / 尺寸快取）
+    + import 核心後 union 墜頭（便宜），調整墜頭時不必重算 CGAL 交集
+
+    Args:
+        params: 9 個 SCAD 參數
+        options: extract_render_options 的渲染選項（幾何後端、品質、幾何引擎）
+        queue_timeout: 等待渲染名額的最長秒數（None = 無限等待）
+        reject_when_full: 等待佇列已滿時直接拋出 RenderPoolFull
+        on_stage: 進度回呼，依序收到 "waiting"（等待名額）、"rendering"（OpenSCAD 執行中）；
+            解析引擎不需等待名額，只收到 "rendering"
+        should_cancel: 取消檢查（返回取消原因字串時中止），等待名額與 OpenSCAD 執行期間定期呼叫
+        allow_downgrade: 記憶體不足且等待超過 RENDER_MEMORY_PATIENCE 秒時改用較低品質
+            （互動預覽用；訂單 STL 一律等待原品質）
+        low_priority: 預先渲染用：只使用閒置的渲染名額，不與使用者請求搶名額；
+            取得名額與記憶體後才取得 key 鎖，相同設計已有其他請求在渲染時直接取消
+
+    Returns:
+        tuple: (stl_path, cache_hit) - stl_path 位於快取目錄，呼叫端不可刪除；
+            實際使用的幾何後端與品質記錄在快取 metadata（get_stl_meta）
+
+    Raises:
+        STLRenderError: OpenSCAD 執行失敗或逾時
+        RenderPoolFull: 渲染佇列已滿、等待名額或記憶體逾時
+        RenderCancelled: should_cancel 要求取消（OpenSCAD 的 process group 已結束），
+            或低優先權渲染遇到相同設計正在渲染
+    """
+    # 這次請求期間的 openscad 執行都記錄字體 / 字母 / 尺寸（render_telemetry）
+    with render_context(params, quality=_quality_name(options)):
+        return _render_stl(
+            params,
+            options,
+            queue_timeout,
+            reject_when_full,
+            on_stage,
+            should_cancel,
+            allow_downgrade,
+            low_priority,
+        )
+
+
+def _render_stl(
+    params,
+    options,
+    queue_timeout,
+    reject_when_full,
+    on_stage,
+    should_cancel,
+    allow_downgrade,
+    low_priority,
+):
+    key = compute_render_key(params, options)
+
+    cached_path = stl_cache.get(key)
+    if cached_path:
+        logger.info(f"⚡ STL 快取命中: {params['letter1']}{params['letter2']} ({key[:12]})")
+        record("cache", cache_hit=True)
+        return cached_path, True
+
+    if low_priority and resolve_engine(params, options) != ENGINE_ANALYTIC:
+        # 預先渲染先取得閒置名額與記憶體才拿 key 鎖：持有 key 鎖等待閒置名額時，
+        # 同一個設計的使用者請求會排在它後面（優先權反轉）。
+        # 相同設計已有其他請求在渲染時不等待（不佔著名額空等），由該請求寫入快取
+        if on_stage:
+            on_stage("waiting")
+        with _render_admission(
+            params,
+            options,
+            queue_timeout,
+            reject_when_full,
+            should_cancel,
+            allow_downgrade,
+            low_priority,
+        ) as ticket:
+            result, shared = coalesce(
+                key,
+                lambda: stl_cache.get(key),
+                lambda: _render_admitted(params, options, key, ticket, on_stage, should_cancel),
+                should_cancel=should_cancel,
+                blocking=False,
+            )
+    else:
+        # 相同設計同時只渲染一次（跨 gunicorn worker）：後到的請求等先到的寫入快取後直接取用
+        result, shared = coalesce(
+            key,
+            lambda: stl_cache.get(key),
+            lambda: _render_uncached(
+                params,
+                options,
+                key,
+                queue_timeout,
+                reject_when_full,
+                on_stage,
+                should_cancel,
+                allow_downgrade,
+            ),
+            timeout=queue_timeout,
+            should_cancel=should_cancel,
+        )
+    if shared:
+        logger.info(f"🤝 共用相同設計的渲染: {params['letter1']}{params['letter2']} ({key[:12]})")
+        record("coalesced", cache_hit=True)
+        return result, True
+    return result
+
+
+@contextmanager
+def _render_admission(
+    params,
+    options,
+    queue_timeout,
+    reject_when_full,
+    should_cancel,
+    allow_downgrade,
+    low_priority,
+):
+    """取得渲染名額與記憶體，yield render_memory 的准入 ticket"""
+    with render_pool.slot(
+        timeout=queue_timeout,
+        reject_when_full=reject_when_full,
+        should_cancel=should_cancel,
+        low_priority=low_priority,
+    ), render_memory.admit(
+        _memory_candidates(params, options, allow_downgrade),
+        fonts=(params["font1"], params["font2"]),
+        patience=RENDER_MEMORY_PATIENCE if allow_downgrade else None,
+        timeout=queue_timeout,
+        should_cancel=should_cancel,
+    ) as ticket:
+        yield ticket
+
+
+def _render_uncached(
+    params,
+    options,
+    key,
+    queue_timeout,
+    reject_when_full,
+    on_stage,
+    should_cancel,
+    allow_downgrade,
+):
+    # 渲染中的暫存檔都放在此工作的目錄內，移入快取後整個目錄刪除（失敗 / 逾時也不會遺留）
+    if resolve_engine(params, options) == ENGINE_ANALYTIC:
+        if on_stage:
+            on_stage("rendering")
+        with job_workspace("render-") as workdir:
+            stl_path, meta = _render_analytic(params, options, workdir)
+            logger.info(f"🧩 STL 幾何引擎: {ENGINE_ANALYTIC}，品質: {_quality_name(options)}")
+            return stl_cache.put(key, stl_path, meta), False
+
+    if on_stage:
+        on_stage("waiting")
+    with _render_admission(
+        params,
+        options,
+        queue_timeout,
+        reject_when_full,
+        should_cancel,
+        allow_downgrade,
+        low_priority=False,
+    ) as ticket:
+        return _render_admitted(params, options, key, ticket, on_stage, should_cancel)
+
+
+def _render_admitted(params, options, key, ticket, on_stage, should_cancel):
+    """已取得名額與記憶體後的 OpenSCAD 渲染"""
+    downgraded_from = None
+    if ticket.quality != _quality_name(options):
+        # 記憶體不足降級：較低品質可能已有快取
+        downgraded_from = _quality_name(options)
+        options = {**(options or {}), "quality": ticket.quality}
+        update_context(quality=ticket.quality, downgraded_from=downgraded_from)
+        key = compute_render_key(params, options)
+        cached_path = stl_cache.get(key)
+        if cached_path:
+            return cached_path, True
+
+    backend = resolve_backend(options)
+    quality = resolve_quality(params, options)
+
+    if on_stage:
+        on_stage("rendering")
+
+    # 取得名額與記憶體後才建立工作目錄：排隊時間不計入 janitor 的遺留判斷
+    with job_workspace("render-") as workdir:
+        if SPLIT_CORE_RENDER:
+            core_path, core_backend = _ensure_core_stl(params, options, workdir, should_cancel)
+            stl_path, used_backend = _run_scad(
+                bail_library_defines(
+                    os.path.abspath(core_path),
+                    params["bailRelativeX"],
+                    params["bailRelativeY"],
+                    params["bailRelativeZ"],
+                    params["bailRotation"],
+                    quality=quality,
+                ),
+                backend,
+                workdir,
+                should_cancel,
+            )
+            meta = _cache_meta(
+                params,
+                used_backend,
+                core_backend=core_backend,
+                quality=_quality_name(options),
+                downgraded_from=downgraded_from,
+                peak_rss_mb=max(ticket.peaks, default=None),
+            )
+        else:
+            outline1, outline2, simplify_report = _prepare_outlines(params, quality)
+            metrics1, metrics2 = _load_metrics(params)
+            stl_path, used_backend = _run_scad(
+                model_library_defines(
+                    **params,
+                    outline1=outline1,
+                    outline2=outline2,
+                    metrics1=metrics1,
+                    metrics2=metrics2,
+                    quality=quality,
+                ),
+                backend,
+                workdir,
+                should_cancel,
+            )
+            meta = _cache_meta(
+                params,
+                used_backend,
+                quality=_quality_name(options),
+                simplify=simplify_report,
+                downgraded_from=downgraded_from,
+                peak_rss_mb=max(ticket.peaks, default=None),
+            )
+
+        logger.info(f"🧩 STL 幾何後端: {used_backend}，品質: {_quality_name(options)}")
+        return stl_cache.put(key, stl_path, meta), False
@@ -0,0 +1,200 @@
+"""
+Web Latency Benchmark - 背景渲染滿載時 web 請求的延遲
+先量測閒置時 /api/payment/callback 與 /api/order/status 的延遲，再啟動會跑滿渲染名額的 STL 生成，
+量測同樣的請求，比較 p50 / p95 / p99（用來確認 render_scheduling 的設定是否保住付款回調的延遲）
+
+    python web_latency_benchmark.py --url http://localhost:5000 --duration 30
+    python web_latency_benchmark.py --url http://localhost:5000 --no-scheduling   # 對照組
+
+量測的請求不會修改任何訂單：付款回調使用錯誤的 CheckMacValue（驗證失敗直接回覆），
+訂單狀態查詢不存在的訂單。背景渲染由本程式送出（設定 RENDER_SERVICE_SOCKET 時交給渲染服務，
+此時 --no-scheduling 無效，排程設定以渲染服務的環境變數為準）；每個渲染使用不同尺寸，不會命中快取
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import render_scheduling
+from quality_tiers import QUALITY_PRODUCTION
+from render_client import render_stl
+from render_pool import render_pool
+from stl_renderer import extract_scad_params, extract_render_options, STLRenderError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONTS = ("DejaVu Sans", "DejaVu Serif")
+LETTERS = "ABCDEFGHJKMNPRSW"
+# 每個端點兩次請求之間的間隔（秒）
+REQUEST_INTERVAL = 0.05
+
+
+def _request(url, data=None):
+    """送出請求並返回耗時（毫秒）；回應的狀態碼不影響量測（404 / 驗證失敗都是預期結果）"""
+    body = urllib.parse.urlencode(data).encode("utf-8") if data is not None else None
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=30) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        e.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def _endpoints(base_url):
+    return {
+        "/api/payment/callback": lambda: _request(
+            f"{base_url}/api/payment/callback",
+            {"MerchantTradeNo": "LATENCYBENCH", "RtnCode": "0", "CheckMacValue": "INVALID"},
+        ),
+        "/api/order/status": lambda: _request(f"{base_url}/api/order/status/LATENCYBENCH"),
+    }
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50_ms": round(_percentile(samples, 0.50), 1),
+        "p95_ms": round(_percentile(samples, 0.95), 1),
+        "p99_ms": round(_percentile(samples, 0.99), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+
+def measure(base_url, duration):
+    """每個端點各用一個 thread 連續送出請求，返回 {端點: 統計}"""
+    samples = {name: [] for name in _endpoints(base_url)}
+    deadline = time.time() + duration
+
+    def run(name, send):
+        while time.time() < deadline:
+            try:
+                samples[name].append(send())
+            except OSError as e:
+                logger.warning(f"⚠️ {name} 請求失敗: {e}")
+            time.sleep(REQUEST_INTERVAL)
+
+    threads = [
+        threading.Thread(target=run, args=(name, send), daemon=True)
+        for name, send in _endpoints(base_url).items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def _background_renders(stop, fonts, counter):
+    """持續送出不會命中快取的 production 渲染，直到 stop 被設定"""
+    options = extract_render_options({"quality": QUALITY_PRODUCTION})
+    while not stop.is_set():
+        params = extract_scad_params(
+            {
+                "letter1": random.choice(LETTERS),
+                "letter2": random.choice(LETTERS),
+                "font1": fonts[0],
+                "font2": fonts[-1],
+                "size": round(random.uniform(12, 28), 2),
+            }
+        )
+        try:
+            render_stl(
+                params,
+                options,
+                queue_timeout=None,
+                reject_when_full=False,
+                should_cancel=lambda: "benchmark finished" if stop.is_set() else None,
+            )
+            counter["renders"] += 1
+        except STLRenderError as e:
+            logger.warning(f"⚠️ 背景渲染失敗: {e}")
+        except Exception as e:
+            if not stop.is_set():
+                logger.warning(f"⚠️ 背景渲染錯誤: {e}")
+
+
+def run_benchmark(base_url, duration, fonts=DEFAULT_FONTS, renderers=None):
+    """
+    Returns:
+        dict: idle / rendering 兩個階段各端點的延遲統計，以及期間完成的渲染數
+    """
+    renderers = renderers or render_pool.slots
+    logger.info(f"⏱️ 閒置延遲量測 {duration}s")
+    idle = measure(base_url, duration)
+
+    stop = threading.Event()
+    counter = {"renders": 0}
+    threads = [
+        threading.Thread(target=_background_renders, args=(stop, fonts, counter), daemon=True)
+        for _ in range(renderers)
+    ]
+    for thread in threads:
+        thread.start()
+    # 等渲染真正開始佔用 CPU 再量測
+    time.sleep(2)
+    logger.info(f"⏱️ 渲染滿載延遲量測 {duration}s（{renderers} 個背景渲染）")
+    loaded = measure(base_url, duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    return {
+        "scheduling": render_scheduling.scheduling_status(),
+        "idle": idle,
+        "rendering": loaded,
+        "background_renders": counter["renders"],
+    }
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="DUET 背景渲染滿載時的 web 請求延遲")
+    parser.add_argument("--url", default="http://localhost:5000", help="後端網址")
+    parser.add_argument("--duration", type=float, default=30, help="每個階段的量測秒數")
+    parser.add_argument("--renderers", type=int, help="同時送出的背景渲染數（預設為渲染名額數）")
+    parser.add_argument("--fonts", nargs=2, default=list(DEFAULT_FONTS), help="背景渲染使用的兩個字體")
+    parser.add_argument("--no-scheduling", action="store_true", help="不套用渲染的 CPU 排程（對照組）")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    if args.no_scheduling:
+        render_scheduling.RENDER_NICE = 0
+        render_scheduling.RENDER_CPUS = ""
+        render_scheduling.WEB_RESERVED_CPUS = ""
+        render_scheduling.RENDER_CPU_QUOTA = 0
+
+    result = run_benchmark(args.url.rstrip("/"), args.duration, args.fonts, args.renderers)
+
+    print(f"\n排程設定: {result['scheduling']}（背景渲染完成 {result['background_renders']} 個）")
+    print(f"{'端點':<24}{'階段':<12}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}  (ms)")
+    for name in result["idle"]:
+        for phase in ("idle", "rendering"):
+            stats = result[phase][name]
+            if not stats["count"]:
+                continue
+            print(
+                f"{name:<24}{phase:<12}{stats['p50_ms']:>8}{stats['p95_ms']:>8}"
+                f"{stats['p99_ms']:>8}{stats['max_ms']:>8}"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
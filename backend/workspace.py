@@ -0,0 +1,183 @@
+"""
+Workspace - 渲染工作目錄與磁碟清理
+
+每個渲染工作使用獨立的暫存目錄（優先放在 tmpfs /dev/shm），工作結束後整個刪除；
+背景 janitor 定期依容量上限與存放時間清理 STL_DIR、工作目錄與系統暫存目錄中遺留的 STL，
+避免容器磁碟被 binary STL 塞滿
+"""
+import contextlib
+import fnmatch
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# tmpfs 可用空間低於此值時改用系統暫存目錄（Docker 預設的 /dev/shm 只有 64MB）
+WORKSPACE_MIN_TMPFS_BYTES = int(os.environ.get("STL_WORKSPACE_MIN_TMPFS_MB", "256")) * 1024 * 1024
+
+# 工作目錄存在超過此秒數視為遺留（進程被終止時來不及清理）
+WORKSPACE_MAX_AGE = int(os.environ.get("STL_WORKSPACE_MAX_AGE_SECONDS", "3600"))
+
+# 訂單 STL（STL_DIR）：容量上限與保存天數
+STL_DIR_MAX_BYTES = int(os.environ.get("STL_DIR_MAX_MB", "2048")) * 1024 * 1024
+STL_DIR_MAX_AGE = int(os.environ.get("STL_DIR_MAX_AGE_DAYS", "30")) * 24 * 3600
+
+# 系統暫存目錄中由渲染流程產生的檔案（其他檔案不動）
+TEMP_FILE_PATTERNS = ("tmp*.stl", "tmp*.scad")
+TEMP_MAX_AGE = int(os.environ.get("STL_TEMP_MAX_AGE_SECONDS", "3600"))
+
+# janitor 執行間隔
+JANITOR_INTERVAL = int(os.environ.get("STL_JANITOR_INTERVAL_SECONDS", "600"))
+
+
+def _default_workspace_dir():
+    shm = "/dev/shm"
+    try:
+        if os.access(shm, os.W_OK) and shutil.disk_usage(shm).free >= WORKSPACE_MIN_TMPFS_BYTES:
+            return os.path.join(shm, "duet-work")
+    except OSError:
+        pass
+    return os.path.join(tempfile.gettempdir(), "duet-work")
+
+
+WORKSPACE_DIR = os.environ.get("STL_WORKSPACE_DIR") or _default_workspace_dir()
+
+
+@contextlib.contextmanager
+def job_workspace(prefix="job-"):
+    """
+    單一工作的暫存目錄，離開時連同內容一起刪除
+
+    用法:
+        with job_workspace("render-") as workdir:
+            ...
+    """
+    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=prefix, dir=WORKSPACE_DIR)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _entry_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _entries(directory, patterns=None):
+    """列出目錄第一層的項目 (mtime, size, path)；patterns 限制檔名"""
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return entries
+
+    for name in names:
+        if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.path.getmtime(path), _entry_size(path), path))
+        except OSError:
+            continue
+    return entries
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def sweep_directory(directory, max_bytes=None, max_age=None, patterns=None):
+    """
+    清理目錄：先刪除超過 max_age 秒的項目，再依 mtime 由舊到新刪到 max_bytes 以下
+
+    Returns:
+        tuple: (刪除數, 釋放的 bytes)
+    """
+    now = time.time()
+    removed = freed = 0
+    kept = []
+
+    for mtime, size, path in sorted(_entries(directory, patterns)):
+        if max_age is not None and now - mtime > max_age:
+            _remove(path)
+            removed += 1
+            freed += size
+        else:
+            kept.append((mtime, size, path))
+
+    if max_bytes is not None:
+        total = sum(size for _, size, _ in kept)
+        for _, size, path in kept:
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+            freed += size
+
+    return removed, freed
+
+
+def run_janitor(stl_dir, temp_dir=None):
+    """
+    清理一次：STL_DIR（容量 + 天數）、遺留的工作目錄、系統暫存目錄中的渲染暫存檔
+
+    Returns:
+        dict: 各目錄的刪除數與釋放空間
+    """
+    temp_dir = temp_dir or tempfile.gettempdir()
+    summary = {}
+    for name, args in (
+        ("stl_dir", (stl_dir, STL_DIR_MAX_BYTES, STL_DIR_MAX_AGE)),
+        ("workspace", (WORKSPACE_DIR, None, WORKSPACE_MAX_AGE)),
+        ("temp", (temp_dir, None, TEMP_MAX_AGE, TEMP_FILE_PATTERNS)),
+    ):
+        removed, freed = sweep_directory(*args)
+        summary[name] = {"removed": removed, "freed_bytes": freed}
+        if removed:
+            logger.info(f"🧹 {name} 清理 {removed} 個項目，釋放 {freed / 1024 / 1024:.1f} MB")
+    return summary
+
+
+def directory_usage(directory, patterns=None):
+    """目錄使用量與所在檔案系統的剩餘空間（健康檢查用）"""
+    entries = _entries(directory, patterns)
+    try:
+        free = shutil.disk_usage(directory).free
+    except OSError:
+        free = None
+    return {
+        "path": directory,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "free_bytes": free,
+    }
+
+
+def disk_usage_report(stl_dir, temp_dir=None):
+    """STL_DIR、工作目錄、暫存目錄的使用量"""
+    temp_dir = temp_dir or tempfile.gettempdir()
+    return {
+        "stl_dir": {**directory_usage(stl_dir), "max_bytes": STL_DIR_MAX_BYTES},
+        "workspace": directory_usage(WORKSPACE_DIR),
+        "temp": directory_usage(temp_dir, TEMP_FILE_PATTERNS),
+    }